@@ -1,3 +1,47 @@
+from django import forms
 from django.contrib import admin
+from django.core.exceptions import ValidationError
 
-# Register your models here.
+from api.models import Url
+from api.services import url_service
+
+
+class UrlForm(forms.ModelForm):
+    def clean_short(self) -> str:
+        short_url = self.cleaned_data["short"]
+        # the form's own unique check only looks at the default DB, and the partitioned table
+        # doesn't reject taken short URLs by itself
+        if self.instance._state.adding and url_service.is_short_url_taken(short_url):
+            raise ValidationError("This short URL is taken.", code="unique")
+        return short_url
+
+
+@admin.register(Url)
+class UrlAdmin(admin.ModelAdmin):
+    form = UrlForm
+    list_display = ("short", "long", "created_at", "expires_at", "hits")
+    search_fields = ("short",)
+    show_full_result_count = False
+
+    def get_readonly_fields(self, request, obj=None):
+        # changing the short URL would insert a new URL without checking that it's free
+        if obj is not None:
+            return ("short", *super().get_readonly_fields(request, obj))
+        return super().get_readonly_fields(request, obj)
+
+    def save_model(self, request, obj, form, change) -> None:
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            # the form checked that the short URL is free, this only fails if it was taken since
+            url_service.insert_url(obj)
+        url_service.invalidate_cached_urls(obj.short)
+
+    def delete_model(self, request, obj) -> None:
+        super().delete_model(request, obj)
+        url_service.invalidate_cached_urls(obj.short)
+
+    def delete_queryset(self, request, queryset) -> None:
+        short_urls = list(queryset.values_list("short", flat=True))
+        super().delete_queryset(request, queryset)
+        url_service.invalidate_cached_urls(*short_urls)
@@ -0,0 +1,54 @@
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from api.models import Url
+from api.services import sharding
+
+
+class PrimaryReplicaRouter:
+    """
+    Send every query to the primary, and only migrate the primary. Replicas from
+    `settings.DATABASE_REPLICAS` are only read from explicitly, by redirect lookups (see
+    `url_service._lookup_dbs`), since other reads, e.g. in the admin, must see the URLs which
+    were just created.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name=None, **hints) -> Optional[bool]:
+        return db == DEFAULT_DB_ALIAS
+
+
+class ShardRouter:
+    """
+    Send reads and writes of a given URL instance to the shard of its short URL, and migrate the
+    URL table on every shard. Queries without an instance, e.g. lookups by short URL, must pick
+    their shard with `api.services.sharding` themselves.
+    """
+
+    def _shard(self, model, hints: dict) -> Optional[str]:
+        instance = hints.get("instance")
+        if model is Url and isinstance(instance, Url) and instance.pk and sharding.is_sharded():
+            return sharding.shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        return self._shard(model, hints)
+
+    def allow_migrate(self, db: str, app_label: str, model_name=None, **hints) -> Optional[bool]:
+        if db != DEFAULT_DB_ALIAS and db in settings.DATABASE_SHARDS:
+            return app_label == Url._meta.app_label and model_name == Url._meta.model_name
+        return None
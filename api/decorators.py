@@ -1,10 +1,20 @@
+import asyncio
 import logging
 from functools import wraps
 from typing import Callable, Optional
 
-from django.http import HttpResponse, HttpResponseServerError, JsonResponse
+from django.conf import settings
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseServerError,
+    JsonResponse,
+)
+from django.utils.log import log_response
 
-from api.errors import AppError
+from api.errors import AppError, Overloaded
+from api.services import admission, metrics
 
 
 def retry(
@@ -52,25 +62,131 @@ def retry(
 def request_handler(view: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
     """
     Handle HTTP errors according to error type and status.
+    Both sync and async views are supported.
 
     Args:
         view (Callable[..., HttpResponse]): A view function.
     """
 
+    if asyncio.iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_decorator(*args, **kwargs) -> HttpResponse:
+            try:
+                return await view(*args, **kwargs)
+            except Exception as e:
+                return _error_response(e)
+
+        return async_decorator
+
     @wraps(view)
     def decorator(*args, **kwargs) -> HttpResponse:
         try:
             return view(*args, **kwargs)
-        except AppError as e:
-            logging.exception(f"An app error occurred with status code {e.status_code}")
-            return JsonResponse(
-                status=e.status_code,
-                data={"App error": str(e)},
-            )
         except Exception as e:
-            logging.exception("An unexpected error occurred")
-            return HttpResponseServerError(
-                f"An unexpected error occurred while processing request: {str(e)}",
-            )
+            return _error_response(e)
 
     return decorator
+
+
+def _error_response(error: Exception) -> HttpResponse:
+    if isinstance(error, AppError):
+        logging.exception(f"An app error occurred with status code {error.status_code}")
+        return JsonResponse(
+            status=error.status_code,
+            data={"App error": str(error)},
+        )
+    logging.exception("An unexpected error occurred")
+    return HttpResponseServerError(
+        f"An unexpected error occurred while processing request: {str(error)}",
+    )
+
+
+def admission_control(request_class: str):
+    """
+    Reject requests of the given class with a 503 and a Retry-After header when too many of them
+    are in flight, rather than letting them pile up (see `api.services.admission`).
+    Both sync and async views are supported.
+
+    Args:
+        request_class (str): One of `admission.REQUEST_CLASSES`.
+    """
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_decorator(*args, **kwargs) -> HttpResponse:
+                gates = admission.get_gates()
+                if gates is None:
+                    return await view(*args, **kwargs)
+                gate = gates[request_class]
+                if not await gate.aenter(queue=admission.should_queue(gates, request_class)):
+                    return _overloaded_response(request_class)
+                try:
+                    return await view(*args, **kwargs)
+                finally:
+                    gate.leave()
+
+            return async_decorator
+
+        @wraps(view)
+        def sync_decorator(*args, **kwargs) -> HttpResponse:
+            gates = admission.get_gates()
+            if gates is None:
+                return view(*args, **kwargs)
+            gate = gates[request_class]
+            if not gate.enter(queue=admission.should_queue(gates, request_class)):
+                return _overloaded_response(request_class)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.leave()
+
+        return sync_decorator
+
+    return decorator
+
+
+def _overloaded_response(request_class: str) -> HttpResponse:
+    # rejections aren't logged, so shedding load stays cheap
+    metrics.ADMISSION_REJECTIONS.labels(request_class).inc()
+    error = Overloaded()
+    response = JsonResponse(status=error.status_code, data={"App error": str(error)})
+    response["Retry-After"] = str(settings.ADMISSION_RETRY_AFTER_SECONDS)
+    return response
+
+
+def async_require_http_methods(*methods: str):
+    """
+    An async counterpart of `django.views.decorators.http.require_http_methods`,
+    which only supports sync views in this version of Django.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if request.method not in methods:
+                response = HttpResponseNotAllowed(methods)
+                log_response(
+                    "Method Not Allowed (%s): %s",
+                    request.method,
+                    request.path,
+                    response=response,
+                    request=request,
+                )
+                return response
+            return await view(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def async_csrf_exempt(view):
+    """
+    Mark an async view as exempt from CSRF protection. Unlike `csrf_exempt`, the view is not
+    wrapped by a sync function, which would make Django run it as a sync view.
+    """
+    view.csrf_exempt = True
+    return view
@@ -12,6 +12,22 @@ class InvalidUrl(AppError):
         )
 
 
+class InvalidBatch(AppError):
+    def __init__(self, max_size: int):
+        super().__init__(
+            message=f"Please provide a list of at most {max_size} URLs",
+            status_code=400,
+        )
+
+
+class InvalidStatsRange(AppError):
+    def __init__(self):
+        super().__init__(
+            message="Please provide ISO 8601 `from` and `to` times, with `from` before `to`",
+            status_code=400,
+        )
+
+
 class UrlNotFound(AppError):
     def __init__(self, url: str):
         super().__init__(message=f"URL {url} not found or has expired", status_code=404)
@@ -22,5 +38,10 @@ class ExpiredUrl(AppError):
         super().__init__(message=f"URL {url} has expired", status_code=410)
 
 
+class Overloaded(AppError):
+    def __init__(self):
+        super().__init__(message="The service is overloaded, please retry later", status_code=503)
+
+
 class ShortUrlTaken(AppError):
     pass
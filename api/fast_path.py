@@ -0,0 +1,177 @@
+"""
+A thin dispatcher in front of Django's WSGI and ASGI handlers which serves redirects directly.
+
+Redirects don't use sessions, CSRF protection, authentication or messages, so resolving them
+through the whole middleware stack and URL resolver is pure overhead. Requests for /s/<code>/
+are answered by the redirect view itself, and the few response headers the middleware would have
+added are added by the dispatcher, so responses are identical to the ones Django returns.
+Everything else, and any redirect which would need per-request middleware logic (an invalid host,
+a code with characters short URLs can't have) or a conditional request, falls through to Django.
+"""
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import HttpResponse
+from django.http.request import split_domain_port, validate_host
+from django.utils.log import log_response
+
+from api import views
+from api.consts import ALLOWED_CHARACTERS
+
+# must match the redirect route in api.urls
+REDIRECT_PATH_PREFIX = "/s/"
+
+# middleware whose effect on redirect responses is reproduced by the dispatcher
+SUPPORTED_MIDDLEWARE = {
+    "api.middleware.ProfilingMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+}
+
+_SHORT_URL_CHARACTERS = frozenset(ALLOWED_CHARACTERS)
+
+
+def is_supported() -> bool:
+    """
+    Whether the current settings let redirects skip the middleware. Settings which make the
+    middleware act per request (HTTPS redirects, HSTS, etc.) disable the fast path.
+    """
+    return (
+        set(settings.MIDDLEWARE) <= SUPPORTED_MIDDLEWARE
+        and not settings.SECURE_SSL_REDIRECT
+        and not settings.SECURE_HSTS_SECONDS
+        and not settings.PREPEND_WWW
+        and not settings.DISALLOWED_USER_AGENTS
+        and not settings.USE_X_FORWARDED_HOST
+        # redirects go through the middleware to be profiled
+        and not settings.PROFILING_ENABLED
+    )
+
+
+class _RedirectDispatcher:
+    def __init__(self, application) -> None:
+        self.application = application
+        self.enabled = is_supported()
+        self._allowed_hosts = settings.ALLOWED_HOSTS
+        if settings.DEBUG and not self._allowed_hosts:
+            self._allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]
+        self._middleware_headers = self._get_middleware_headers()
+
+    def _match(self, method: str, path: str, host: str, conditional: bool) -> str:
+        """
+        Return the short URL if the request can be served by the fast path, or an empty string.
+        """
+        if (
+            not self.enabled
+            or conditional
+            or method not in ("GET", "HEAD")
+            or not path.startswith(REDIRECT_PATH_PREFIX)
+            or not path.endswith("/")
+        ):
+            return ""
+        short_url = path[len(REDIRECT_PATH_PREFIX) : -1]
+        if not short_url or not _SHORT_URL_CHARACTERS.issuperset(short_url):
+            return ""
+        domain, _ = split_domain_port(host)
+        if not domain or not validate_host(domain, self._allowed_hosts):
+            return ""
+        return short_url
+
+    def _get_middleware_headers(self) -> list[tuple[str, Optional[str]]]:
+        """
+        Return the headers added by the middleware, in the order the middleware would add them,
+        which is the reverse of MIDDLEWARE. Content-Length depends on the response, so it's
+        given without a value.
+        """
+        headers = []
+        if "django.middleware.clickjacking.XFrameOptionsMiddleware" in settings.MIDDLEWARE:
+            headers.append(("X-Frame-Options", settings.X_FRAME_OPTIONS.upper()))
+        if "django.middleware.common.CommonMiddleware" in settings.MIDDLEWARE:
+            headers.append(("Content-Length", None))
+        if "django.middleware.security.SecurityMiddleware" in settings.MIDDLEWARE:
+            if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+                headers.append(("X-Content-Type-Options", "nosniff"))
+            if settings.SECURE_REFERRER_POLICY:
+                referrer_policy = settings.SECURE_REFERRER_POLICY
+                if isinstance(referrer_policy, str):
+                    referrer_policy = referrer_policy.split(",")
+                headers.append(("Referrer-Policy", ",".join(v.strip() for v in referrer_policy)))
+            if settings.SECURE_CROSS_ORIGIN_OPENER_POLICY:
+                headers.append(
+                    ("Cross-Origin-Opener-Policy", settings.SECURE_CROSS_ORIGIN_OPENER_POLICY)
+                )
+        return headers
+
+    def _finish_response(self, response: HttpResponse, path: str) -> HttpResponse:
+        for header, value in self._middleware_headers:
+            response.headers.setdefault(header, value or str(len(response.content)))
+        if response.status_code >= 400:
+            log_response("%s: %s", response.reason_phrase, path, response=response)
+        return response
+
+
+class WSGIRedirectDispatcher(_RedirectDispatcher):
+    """
+    Serve redirects in front of a Django WSGI application, see the module docstring.
+    """
+
+    # the redirect view without its method check, which the dispatcher does itself
+    view = staticmethod(views.redirect_to_original_url.__wrapped__)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        # without a Host header Django falls back on the server name, the port doesn't matter
+        # for validating the host
+        host = environ.get("HTTP_HOST") or environ.get("SERVER_NAME", "")
+        conditional = any(key.startswith("HTTP_IF_") for key in environ)
+        short_url = self._match(environ["REQUEST_METHOD"], path, host, conditional)
+        if not short_url:
+            return self.application(environ, start_response)
+
+        signals.request_started.send(sender=WSGIHandler, environ=environ)
+        response = self._finish_response(self.view(None, short_url), path)
+        start_response(f"{response.status_code} {response.reason_phrase}", list(response.items()))
+        return response
+
+
+class ASGIRedirectDispatcher(_RedirectDispatcher):
+    """
+    Serve redirects in front of a Django ASGI application, see the module docstring.
+    """
+
+    def __init__(self, application: ASGIHandler) -> None:
+        super().__init__(application)
+        if settings.ASYNC_VIEWS:
+            self.view = views.aredirect_to_original_url.__wrapped__
+        else:
+            self.view = sync_to_async(
+                views.redirect_to_original_url.__wrapped__, thread_sensitive=True
+            )
+
+    async def __call__(self, scope, receive, send):
+        short_url = ""
+        if scope["type"] == "http" and not scope.get("root_path"):
+            host = next((value for name, value in scope["headers"] if name == b"host"), b"")
+            if host:
+                host = host.decode("latin1")
+            else:
+                host = scope["server"][0] if scope.get("server") else "unknown"
+            conditional = any(name.startswith(b"if-") for name, _ in scope["headers"])
+            short_url = self._match(scope["method"], scope["path"], host, conditional)
+        if not short_url:
+            return await self.application(scope, receive, send)
+
+        await sync_to_async(signals.request_started.send, thread_sensitive=True)(
+            sender=ASGIHandler, scope=scope
+        )
+        response = self._finish_response(await self.view(None, short_url), scope["path"])
+        await self.application.send_response(response, send)
@@ -0,0 +1,169 @@
+import json
+import platform
+import subprocess
+from typing import Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from api.errors import AppError
+from api.models import Url
+from api.services import url_service
+from api.services.load_generator import BENCH_URL_PREFIX, LoadGenerator
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Seed short URLs and measure the latency of redirects and creates under load"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-u",
+            "--urls",
+            dest="urls",
+            type=int,
+            help="number of short URLs to seed",
+            default=10_000,
+        )
+        parser.add_argument(
+            "-n",
+            "--requests",
+            dest="requests",
+            type=int,
+            help="total number of requests",
+            default=10_000,
+        )
+        parser.add_argument(
+            "-c",
+            "--concurrency",
+            dest="concurrency",
+            type=int,
+            help="number of requests in flight",
+            default=8,
+        )
+        parser.add_argument(
+            "--create-ratio",
+            dest="create_ratio",
+            type=float,
+            help="fraction of requests which create a short URL, the rest are redirects",
+            default=0.1,
+        )
+        parser.add_argument(
+            "--zipf",
+            dest="zipf_exponent",
+            type=float,
+            help="skew of the short URL popularity (0 is uniform)",
+            default=1.1,
+        )
+        parser.add_argument(
+            "--server",
+            dest="server",
+            help="base URL of a running server sharing this DB, e.g. http://localhost:8000 "
+            "(by default requests are sent in-process through the WSGI handler)",
+            default=None,
+        )
+        parser.add_argument(
+            "--seed",
+            dest="seed",
+            type=int,
+            help="seed of the request mix, runs with the same seed send the same requests",
+            default=0,
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            help="file to save the results to as JSON, for comparing runs across commits",
+            default=None,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Seeded and created URLs are removed once the benchmark is done.
+        Queries per request are only counted in-process, since they're made by the server otherwise.
+        """
+        if options["urls"] < 1:
+            raise CommandError("--urls must be at least 1")
+        short_urls = []
+        seed_errors = 0
+        for start in range(0, options["urls"], settings.CREATE_BATCH_MAX_SIZE):
+            batch_size = min(settings.CREATE_BATCH_MAX_SIZE, options["urls"] - start)
+            for result in url_service.create_short_urls(
+                [f"{BENCH_URL_PREFIX}{i}" for i in range(start, start + batch_size)]
+            ):
+                if isinstance(result, AppError):
+                    seed_errors += 1
+                else:
+                    short_urls.append(result)
+        if seed_errors:
+            self.stdout.write(f"Failed to seed {seed_errors} short URLs")
+        if not short_urls:
+            raise CommandError("No short URLs could be seeded")
+
+        generator = LoadGenerator(
+            short_urls,
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            create_ratio=options["create_ratio"],
+            zipf_exponent=options["zipf_exponent"],
+            server=options["server"],
+            seed=options["seed"],
+        )
+        try:
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                results = generator.run()
+        finally:
+            for shard in settings.DATABASE_SHARDS:
+                Url.objects.using(shard).filter(long__startswith=BENCH_URL_PREFIX).delete()
+
+        for operation in ("redirect", "create", "total"):
+            stats = results[operation]
+            queries = stats["queries_per_request"]
+            self.stdout.write(
+                f"{operation}: {stats['requests']} requests, {stats['errors']} errors, "
+                f"{stats['requests_per_second']:.0f} requests/sec, "
+                f"p50 {stats['p50_ms']:.2f}ms, p95 {stats['p95_ms']:.2f}ms, "
+                f"p99 {stats['p99_ms']:.2f}ms"
+                + (f", {queries:.2f} queries/request" if queries is not None else "")
+            )
+
+        if options["output"]:
+            config = {
+                key: options[key]
+                for key in (
+                    "urls",
+                    "requests",
+                    "concurrency",
+                    "create_ratio",
+                    "zipf_exponent",
+                    "server",
+                    "seed",
+                )
+            }
+            with open(options["output"], "w") as file:
+                json.dump(
+                    {
+                        "commit": _git_commit(),
+                        "timestamp": timezone.now().isoformat(),
+                        "python": platform.python_version(),
+                        "config": config,
+                        "results": results,
+                    },
+                    file,
+                    indent=2,
+                )
+            self.stdout.write(f"Saved results to {options['output']}")
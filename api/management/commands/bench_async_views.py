@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import path
+
+from api import views
+from api.models import Url
+from api.services import async_db, sharding, url_service
+from api.services.url_cache import url_cache
+
+
+class BenchUrlConf:
+    urlpatterns = [
+        path("sync/<str:url>/", views.redirect_to_original_url),
+        path("async/<str:url>/", views.aredirect_to_original_url),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of the sync and async redirect views under ASGI"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-n",
+            "--requests",
+            dest="requests",
+            type=int,
+            help="number of redirects per view",
+            default=2000,
+        )
+        parser.add_argument(
+            "-c",
+            "--concurrency",
+            dest="concurrency",
+            type=int,
+            help="number of redirects in flight",
+            default=50,
+        )
+        parser.add_argument(
+            "--cache",
+            dest="cache",
+            action="store_true",
+            help="serve redirects from the URL cache instead of the DB",
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Both views are served in-process by Django's ASGI handler, as they would be under an ASGI
+        server: the sync view runs in a thread through `sync_to_async` while the async view
+        queries the DB through the async connection pool.
+        """
+        short_urls = [
+            url_service.get_or_create_short_url("https://stackoverflow.com/")
+            for _ in range(options["concurrency"])
+        ]
+        if not options["cache"]:
+            url_cache.size = 0
+            url_cache.clear()
+
+        try:
+            with override_settings(ROOT_URLCONF=BenchUrlConf, ALLOWED_HOSTS=["testserver"]):
+                results = asyncio.run(self.run_benchmarks(short_urls, **options))
+        finally:
+            for shard, shard_short_urls in sharding.get_ring().group(short_urls).items():
+                Url.objects.using(shard).filter(short__in=shard_short_urls).delete()
+
+        for name, requests_per_second in results.items():
+            self.stdout.write(f"{name}: {requests_per_second:.0f} requests/sec")
+        self.stdout.write(f"async/sync: {results['async'] / results['sync']:.2f}x")
+
+    async def run_benchmarks(self, short_urls: list[str], **options) -> dict[str, float]:
+        try:
+            return {
+                prefix: await self.run_benchmark(prefix, short_urls, **options)
+                for prefix in ("sync", "async")
+            }
+        finally:
+            await async_db.close_pools()
+
+    async def run_benchmark(
+        self, prefix: str, short_urls: list[str], requests: int, concurrency: int, **_
+    ) -> float:
+        client = AsyncClient()
+        remaining = iter(range(requests))
+
+        async def worker(short_url: str) -> None:
+            for _ in remaining:
+                response = await client.get(f"/{prefix}/{short_url}/")
+                assert response.status_code == 302, response.content
+
+        await worker(short_urls[0])  # warm up connections
+        remaining = iter(range(requests))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(short_url) for short_url in short_urls[:concurrency]))
+        return requests / (time.perf_counter() - start)
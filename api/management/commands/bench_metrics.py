@@ -0,0 +1,65 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.services import metrics
+
+
+class Command(BaseCommand):
+    help = "Measure the overhead metrics add to every redirect"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-n",
+            "--requests",
+            dest="requests",
+            type=int,
+            help="number of instrumented redirects",
+            default=100_000,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        An uncached redirect is the most instrumented request: two timed stages and an outcome.
+        Metrics are updated in a registry of their own, so the benchmark doesn't add to the
+        metrics of running servers, both in memory and in a metrics directory.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for name, metrics_dir in (("in-process", None), ("metrics dir", directory)):
+                with override_settings(METRICS_DIR=metrics_dir):
+                    seconds_per_request = self.run_benchmark(options["requests"])
+                self.stdout.write(f"{name}: {seconds_per_request * 1e6:.2f}us/request")
+
+    def run_benchmark(self, requests: int) -> float:
+        registry = metrics.Registry()
+        redirects = metrics.Counter(
+            metrics.REDIRECTS.name,
+            metrics.REDIRECTS.documentation,
+            metrics.REDIRECTS.label,
+            ("found",),
+            registry=registry,
+        )
+        stages = metrics.Histogram(
+            metrics.REDIRECT_STAGE_SECONDS.name,
+            metrics.REDIRECT_STAGE_SECONDS.documentation,
+            metrics.REDIRECT_STAGE_SECONDS.label,
+            ("db_lookup", "record_hit"),
+            registry=registry,
+        )
+
+        start = time.perf_counter()
+        for _ in range(requests):
+            with stages.labels("db_lookup").time():
+                pass
+            redirects.labels("found").inc()
+            with stages.labels("record_hit").time():
+                pass
+        seconds = time.perf_counter() - start
+
+        # the same loop without metrics
+        start = time.perf_counter()
+        for _ in range(requests):
+            pass
+        return (seconds - (time.perf_counter() - start)) / requests
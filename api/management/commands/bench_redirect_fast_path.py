@@ -0,0 +1,85 @@
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from api.fast_path import WSGIRedirectDispatcher
+from api.models import Url
+from api.services import sharding, url_service
+
+
+def call_wsgi(application, path: str, **extra) -> tuple[str, list[tuple[str, str]], bytes]:
+    started = {}
+
+    def start_response(status, headers):
+        started.update(status=status, headers=headers)
+
+    response = application(RequestFactory()._base_environ(PATH_INFO=path, **extra), start_response)
+    try:
+        body = b"".join(response)
+    finally:
+        response.close()
+    return started["status"], started["headers"], body
+
+
+class Command(BaseCommand):
+    help = "Compare the per-request overhead of redirects with and without the fast path"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-n",
+            "--requests",
+            dest="requests",
+            type=int,
+            help="number of redirects per handler",
+            default=5000,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Redirects are sent straight to the WSGI callables, without a server in between, so the
+        difference is the time saved on every request. Responses for existing, missing and
+        expired short URLs are compared first, and the benchmark fails if they differ.
+        """
+        short_url = url_service.get_or_create_short_url("https://stackoverflow.com/")
+        expired_short_url = url_service.get_or_create_short_url("https://stackoverflow.com/")
+        Url.objects.using(sharding.shard_for(expired_short_url)).filter(
+            short=expired_short_url
+        ).update(expires_at=timezone.now())
+
+        try:
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                django_application = WSGIHandler()
+                fast_path_application = WSGIRedirectDispatcher(django_application)
+                for path in (f"/s/{short_url}/", "/s/missing/", f"/s/{expired_short_url}/"):
+                    expected = call_wsgi(django_application, path)
+                    actual = call_wsgi(fast_path_application, path)
+                    if actual != expected:
+                        raise CommandError(f"{path}: expected {expected}, got {actual}")
+
+                results = {
+                    name: self.run_benchmark(application, f"/s/{short_url}/", options["requests"])
+                    for name, application in (
+                        ("django", django_application),
+                        ("fast path", fast_path_application),
+                    )
+                }
+        finally:
+            for short in (short_url, expired_short_url):
+                Url.objects.using(sharding.shard_for(short)).filter(short=short).delete()
+
+        for name, seconds_per_request in results.items():
+            self.stdout.write(f"{name}: {seconds_per_request * 1e6:.1f}us/request")
+        saved = results["django"] - results["fast path"]
+        self.stdout.write(
+            f"saved {saved * 1e6:.1f}us/request ({saved / results['django']:.0%})"
+        )
+
+    def run_benchmark(self, application, path: str, requests: int) -> float:
+        call_wsgi(application, path)  # warm up
+        start = time.perf_counter()
+        for _ in range(requests):
+            call_wsgi(application, path)
+        return (time.perf_counter() - start) / requests
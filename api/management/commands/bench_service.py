@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import microbenchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the service layer against the query and time budgets of every operation, "
+        "and against a baseline"
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-s",
+            "--scale",
+            dest="scale",
+            type=float,
+            help="fraction of the default number of operations of every benchmark to run",
+            default=1.0,
+        )
+        parser.add_argument(
+            "-b",
+            "--baseline",
+            dest="baseline",
+            help=(
+                "results of an earlier run on this host to compare with, times included, "
+                "instead of the baseline in the repository, which only holds query counts"
+            ),
+            default=None,
+        )
+        parser.add_argument(
+            "-t",
+            "--tolerance",
+            dest="tolerance",
+            type=float,
+            help="fraction by which an operation may get slower than in the baseline",
+            default=0.5,
+        )
+        parser.add_argument(
+            "--queries-only",
+            dest="queries_only",
+            action="store_true",
+            help="only check the number of queries, e.g. on a shared CI host",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            help="file to save the results to as JSON",
+            default=None,
+        )
+        parser.add_argument(
+            "--update-baseline",
+            dest="update_baseline",
+            action="store_true",
+            help=(
+                "save the results as the baseline, if they're within their budgets "
+                "(only their query counts, unless --baseline is given)"
+            ),
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Fails if an operation exceeds its budgets, or regressed from the baseline. Timings depend
+        on the host, so they're only compared with a baseline given with --baseline, which should
+        be saved on the host the benchmarks run on; the query counts don't.
+        """
+        baseline_path = options["baseline"] or str(microbenchmarks.BASELINE_PATH)
+        results = microbenchmarks.run_benchmarks(options["scale"])
+        for _, result in results:
+            self.stdout.write(
+                f"{result.name}: {result.operations} operations, "
+                f"{result.queries_per_operation:g} queries/operation, "
+                f"p50 {result.p50_us:.1f}us, p99 {result.p99_us:.1f}us"
+            )
+        if options["output"]:
+            microbenchmarks.save_results(results, options["output"])
+            self.stdout.write(f"Saved results to {options['output']}")
+
+        baseline = None
+        if not options["update_baseline"]:
+            baseline = microbenchmarks.load_baseline(baseline_path)
+            if baseline is None:
+                self.stdout.write(f"No baseline at {baseline_path}, only budgets are checked")
+        failures = microbenchmarks.check_results(
+            results, baseline, options["tolerance"], check_times=not options["queries_only"]
+        )
+        if failures:
+            raise CommandError("\n".join(["Benchmarks failed:"] + failures))
+
+        if options["update_baseline"]:
+            microbenchmarks.save_results(results, baseline_path, times=bool(options["baseline"]))
+            self.stdout.write(f"Saved the baseline to {baseline_path}")
@@ -0,0 +1,83 @@
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# settings and WSGI module of each profile
+PROFILES = {
+    "full": ("memechose.settings", "memechose.wsgi"),
+    "lean": ("memechose.settings_lean", "memechose.wsgi_lean"),
+}
+
+# run by a new interpreter for every boot, so nothing is imported beforehand
+BOOT_SCRIPT = """
+import importlib, resource, sys, time
+
+start = time.perf_counter()
+application = importlib.import_module(sys.argv[1]).application
+from api.management.commands.bench_redirect_fast_path import call_wsgi
+
+call_wsgi(application, "/health/", HTTP_HOST=sys.argv[3])
+boot = time.perf_counter() - start
+for _ in range(int(sys.argv[2])):
+    call_wsgi(application, "/health/", HTTP_HOST=sys.argv[3])
+    call_wsgi(application, "/s/0000000/", HTTP_HOST=sys.argv[3])
+print(boot, len(sys.modules), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+class Command(BaseCommand):
+    help = "Compare the boot time and memory of a worker with the full and lean settings"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-b",
+            "--boots",
+            dest="boots",
+            type=int,
+            help="number of workers booted per profile",
+            default=5,
+        )
+
+        parser.add_argument(
+            "-n",
+            "--requests",
+            dest="requests",
+            type=int,
+            help="number of requests served by each worker before its memory is measured",
+            default=1000,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Every boot is a new interpreter which imports the WSGI application and serves its first
+        request, which is the boot time. It then serves health checks and redirects of a missing
+        short URL, which queries the DB, and reports its peak RSS as the steady-state memory.
+        """
+        host = settings.ALLOWED_HOSTS[0].lstrip(".") if settings.ALLOWED_HOSTS else "localhost"
+        for profile, (settings_module, wsgi_module) in PROFILES.items():
+            boots = [
+                self.boot(settings_module, wsgi_module, options["requests"], host)
+                for _ in range(options["boots"])
+            ]
+            seconds, modules, rss_kb = zip(*boots)
+            self.stdout.write(
+                f"{profile}: boot {statistics.median(seconds) * 1000:.0f}ms (median), "
+                f"{modules[0]} modules, RSS {statistics.median(rss_kb) / 1024:.1f} MB"
+            )
+
+    def boot(self, settings_module: str, wsgi_module: str, requests: int, host: str):
+        result = subprocess.run(
+            [sys.executable, "-c", BOOT_SCRIPT, wsgi_module, str(requests), host],
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": settings_module},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Booting {wsgi_module} failed, run it directly to see why")
+        seconds, modules, rss_kb = result.stdout.split()
+        return float(seconds), int(modules), int(rss_kb)
@@ -0,0 +1,121 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.consts import SHORT_URL_LENGTH
+from api.services.load_generator import percentile
+from api.services.url_keys import short_url_sql
+from api.utils import (
+    KEY_SPACE,
+    decode_base62,
+    decode_short_url_key,
+    encode_base62,
+    encode_short_url_key,
+)
+
+# keys are spread over the key space by multiplying row numbers by a prime coprime with it
+KEY_STRIDE = 2_147_483_647
+
+TABLES = {
+    "text": ("bench_url_keys_text", f"varchar({SHORT_URL_LENGTH})"),
+    "integer": ("bench_url_keys_integer", "bigint"),
+}
+
+
+class Command(BaseCommand):
+    help = "Compare text and integer short URL keys: codec speed, PK index size and lookup latency"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-r",
+            "--rows",
+            dest="rows",
+            type=int,
+            help="number of keys in each table",
+            default=1_000_000,
+        )
+
+        parser.add_argument(
+            "-n",
+            "--lookups",
+            dest="lookups",
+            type=int,
+            help="number of lookups per table, and of codec operations",
+            default=10_000,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Keys are loaded into two unlogged tables, with a text and an integer primary key, which
+        are dropped afterwards. Differences grow with the table, so run it with e.g. 100M rows
+        (--rows 100000000) on a host like production's to size the gain on the real table.
+        """
+        keys = [random.randrange(KEY_SPACE) for _ in range(options["lookups"])]
+        self.bench_codec(keys)
+
+        rows = options["rows"]
+        lookup_keys = [
+            (random.randrange(rows) * KEY_STRIDE) % KEY_SPACE for _ in range(options["lookups"])
+        ]
+        with connection.cursor() as cursor:
+            try:
+                for name, (table, column_type) in TABLES.items():
+                    self.load_table(cursor, table, column_type, rows)
+                    values = (
+                        [encode_short_url_key(key) for key in lookup_keys]
+                        if name == "text"
+                        else lookup_keys
+                    )
+                    self.bench_lookups(cursor, name, table, values)
+            finally:
+                for table, _ in TABLES.values():
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def bench_codec(self, keys: list[int]) -> None:
+        short_urls = [encode_short_url_key(key) for key in keys]
+        for name, encode, decode in (
+            ("base62", lambda key: encode_base62(key, SHORT_URL_LENGTH), decode_base62),
+            ("key codec", encode_short_url_key, decode_short_url_key),
+        ):
+            start = time.perf_counter()
+            for key in keys:
+                encode(key)
+            encoded = time.perf_counter() - start
+            start = time.perf_counter()
+            for short_url in short_urls:
+                decode(short_url)
+            decoded = time.perf_counter() - start
+            self.stdout.write(
+                f"{name}: encode {encoded / len(keys) * 1e9:.0f}ns/op, "
+                f"decode {decoded / len(keys) * 1e9:.0f}ns/op"
+            )
+
+    def load_table(self, cursor, table: str, column_type: str, rows: int) -> None:
+        key = f"(i::bigint * {KEY_STRIDE}) % {KEY_SPACE}"
+        if column_type != "bigint":
+            key = short_url_sql(f"({key})")
+        start = time.perf_counter()
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {table} (short {column_type} PRIMARY KEY)")
+        cursor.execute(f"INSERT INTO {table} SELECT {key} FROM generate_series(0, {rows - 1}) i")
+        cursor.execute(f"ANALYZE {table}")
+        self.stdout.write(f"Loaded {rows} rows into {table} in {time.perf_counter() - start:.1f}s")
+
+    def bench_lookups(self, cursor, name: str, table: str, values: list) -> None:
+        cursor.execute("SELECT pg_relation_size(%s::regclass)", [f"{table}_pkey"])
+        (index_size,) = cursor.fetchone()
+        latencies = []
+        for value in values:
+            start = time.perf_counter()
+            cursor.execute(f"SELECT 1 FROM {table} WHERE short = %s", [value])
+            cursor.fetchone()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        self.stdout.write(
+            f"{name} keys: PK index {index_size / 1024 / 1024:.1f} MB, lookups "
+            f"mean {sum(latencies) / len(latencies) * 1e6:.0f}us, "
+            f"p50 {percentile(latencies, 50) * 1e6:.0f}us, "
+            f"p99 {percentile(latencies, 99) * 1e6:.0f}us"
+        )
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services.hit_rollups import compact_hourly_rollups, delete_daily_rollups
+
+
+class Command(BaseCommand):
+    help = "Compact old hourly hit rollups into daily ones"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--hourly-days",
+            dest="hourly_days",
+            type=int,
+            help="number of days to keep hourly rollups for",
+            default=settings.HIT_ROLLUPS_HOURLY_RETENTION_DAYS,
+        )
+
+        parser.add_argument(
+            "--daily-days",
+            dest="daily_days",
+            type=int,
+            help="number of days to keep daily rollups for, forever if not provided",
+            default=None,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        This command is designed to be run daily. Every day older than --hourly-days is compacted
+        in its own transaction, so an interrupted run is simply completed by the next one.
+        """
+        now = datetime.now(timezone.utc)
+        compacted = compact_hourly_rollups(now - timedelta(days=options["hourly_days"]))
+        self.stdout.write(f"Compacted {compacted} hourly rollups")
+        if options["daily_days"] is not None:
+            deleted = delete_daily_rollups(now - timedelta(days=options["daily_days"]))
+            self.stdout.write(f"Deleted {deleted} daily rollups")
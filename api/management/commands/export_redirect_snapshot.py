@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.redirect_snapshot import export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Export the non-expired URLs to the redirect snapshot shared by the workers"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-o",
+            "--output",
+            dest="output",
+            help="path of the snapshot, defaults to REDIRECT_SNAPSHOT_PATH",
+            default=settings.REDIRECT_SNAPSHOT_PATH,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        This command is designed to be run periodically on every host, e.g. every few minutes.
+        The new snapshot atomically replaces the previous one, which workers keep using until
+        they notice the new one.
+        """
+        if not options["output"]:
+            raise CommandError("Please provide --output or set REDIRECT_SNAPSHOT_PATH")
+        stats = export_snapshot(options["output"])
+        self.stdout.write(
+            f"Exported {stats.urls} urls ({stats.size / 1024 / 1024:.1f} MB) "
+            f"in {stats.seconds:.1f}s"
+        )
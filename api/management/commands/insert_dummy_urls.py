@@ -1,20 +1,15 @@
 import logging
-import random
-from datetime import timedelta
 
 from django.core.management.base import BaseCommand
 
-from api.models import Url
-from api.services import url_service
+from api.services.seed_service import UrlSeeder
 
 log = logging.getLogger(__name__)
 
 
-def random_ttl() -> timedelta:
-    return timedelta(days=random.randint(0, 30))
-
-
 class Command(BaseCommand):
+    help = "Insert dummy URLs for load and capacity testing (PostgreSQL only)"
+
     def add_arguments(self, parser) -> None:
         parser.add_argument(
             "-a",
@@ -23,12 +18,74 @@ class Command(BaseCommand):
             type=int,
         )
 
+        parser.add_argument(
+            "-b",
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            help="number of rows copied in each transaction",
+            default=100_000,
+        )
+
+        parser.add_argument(
+            "-w",
+            "--workers",
+            dest="workers",
+            type=int,
+            help="number of processes, each copying a share of the rows",
+            default=1,
+        )
+
+        parser.add_argument(
+            "--long-urls",
+            dest="long_urls",
+            type=int,
+            help="number of distinct long URLs",
+            default=1000,
+        )
+
+        parser.add_argument(
+            "--long-url-zipf",
+            dest="long_url_zipf",
+            type=float,
+            help="skew of the long URL popularity (0 is uniform)",
+            default=0,
+        )
+
+        parser.add_argument(
+            "--ttl-days",
+            dest="ttl_days",
+            type=int,
+            nargs=2,
+            metavar=("MIN", "MAX"),
+            help="range of the uniformly distributed TTLs (days)",
+            default=(0, 30),
+        )
+
+        parser.add_argument(
+            "--no-expiry-ratio",
+            dest="no_expiry_ratio",
+            type=float,
+            help="fraction of URLs which never expire",
+            default=0,
+        )
+
     def handle(self, *args, **options) -> None:
-        Url.objects.bulk_create(
-            Url(
-                short=url_service._generate_short_url(),
-                long="https://stackoverflow.com/",
-                time_to_live=random_ttl(),
-            )
-            for _ in range(options["amount"])
+        """
+        Rows are generated as they're streamed to the DB with COPY, so any amount can be inserted
+        with flat memory usage. Short URLs are issued from the allocator's sequence, so they don't
+        collide with each other or with short URLs issued by the allocator later on.
+        """
+        stats = UrlSeeder(
+            chunk_size=options["chunk_size"],
+            long_urls=options["long_urls"],
+            long_url_zipf=options["long_url_zipf"],
+            ttl_days=tuple(options["ttl_days"]),
+            no_expiry_ratio=options["no_expiry_ratio"],
+            workers=options["workers"],
+        ).run(options["amount"])
+        log.info(f"Inserted {stats.rows} dummy urls")
+        self.stdout.write(
+            f"Inserted {stats.rows} urls in {stats.seconds:.1f}s "
+            f"({stats.rows_per_second:.0f} rows/sec)"
         )
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.consts import DEFAULT_GRACE_PERIOD_DAYS
+from api.services import partition_service, url_service
+
+
+class Command(BaseCommand):
+    help = "Manage the monthly partitions of the URL table by expiry date (PostgreSQL only)"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "action",
+            choices=["convert", "maintain", "drop-expired"],
+            help=(
+                "convert: rebuild the URL table as a partitioned table; "
+                "maintain: create the partitions for the coming months; "
+                "drop-expired: drop the partitions whose URLs all expired"
+            ),
+        )
+
+        parser.add_argument(
+            "-m",
+            "--months-ahead",
+            dest="months_ahead",
+            type=int,
+            help="number of future monthly partitions to keep created",
+            default=3,
+        )
+
+        parser.add_argument(
+            "-g",
+            "--grace-period",
+            dest="grace_period",
+            type=int,
+            help="grace period for expired entries (days)",
+            default=DEFAULT_GRACE_PERIOD_DAYS,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Once converted, expired URLs are removed by dropping whole partitions, which is much
+        cheaper than deleting them row by row. `maintain` should be run periodically (e.g. daily)
+        so URLs are written to their monthly partition rather than to the default one.
+        """
+        if options["action"] == "convert":
+            partition_service.convert_to_partitioned(options["months_ahead"])
+            self.stdout.write(
+                "Converted the URL table to monthly partitions, set URL_TABLE_PARTITIONED=true"
+            )
+            return
+
+        if not partition_service.is_partitioned():
+            raise CommandError("The URL table is not partitioned, run `partition_urls convert`")
+        if not settings.URL_TABLE_PARTITIONED:
+            self.stderr.write("The URL table is partitioned but URL_TABLE_PARTITIONED is off")
+
+        if options["action"] == "maintain":
+            created = partition_service.ensure_partitions(options["months_ahead"])
+            self.stdout.write(f"Created {len(created)} partitions: {', '.join(created)}")
+        else:
+            dropped = partition_service.drop_expired_partitions(
+                url_service.expired_urls_cutoff(options["grace_period"])
+            )
+            self.stdout.write(f"Dropped {len(dropped)} partitions: {', '.join(dropped)}")
@@ -0,0 +1,55 @@
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import profiling
+
+
+class Command(BaseCommand):
+    help = "Aggregate the sampled request profiles: top functions and SQL queries by time"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-d",
+            "--directory",
+            dest="directory",
+            help="directory of the profiles, defaults to PROFILING_DIR",
+            default=settings.PROFILING_DIR,
+        )
+
+        parser.add_argument(
+            "-n",
+            "--limit",
+            dest="limit",
+            type=int,
+            help="number of functions and queries to list",
+            default=20,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Profiles are only kept on the host which wrote them, so run it on every host of interest
+        (or on a copy of their profiles). Times are totals across all profiled requests.
+        """
+        stats, records = profiling.load_profiles(options["directory"])
+        if stats is None:
+            raise CommandError(f"No profiles in {options['directory']}")
+        seconds = sorted(record["seconds"] for record in records)
+        self.stdout.write(
+            f"{len(records)} profiled requests, median {statistics.median(seconds) * 1000:.1f}ms, "
+            f"max {seconds[-1] * 1000:.1f}ms"
+        )
+
+        self.stdout.write("\nTop functions by cumulative time:")
+        for function in profiling.top_functions(stats, options["limit"]):
+            self.stdout.write(
+                f"{function.cumulative_seconds * 1000:10.1f}ms {function.calls:8} calls  "
+                f"{function.function}"
+            )
+
+        self.stdout.write("\nTop SQL queries by total time:")
+        for query in profiling.top_queries(records, options["limit"]):
+            self.stdout.write(
+                f"{query.total_seconds * 1000:10.1f}ms {query.count:8} times  {query.sql}"
+            )
@@ -1,6 +1,4 @@
 import logging
-import os
-from datetime import datetime
 
 from django.core.management.base import BaseCommand
 
@@ -8,20 +6,12 @@ from api.consts import (
     DEFAULT_EXPIRED_URLS_ITERATION_BATCH_SIZE,
     DEFAULT_GRACE_PERIOD_DAYS,
 )
-from api.models import Url
-from api.services import url_service
-from api.utils import iterate_in_batches
+from api.services.purge_service import ExpiredUrlPurger
 
 log = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    def __init__(self) -> None:
-        self.expired_urls = None
-        self.total_expired_urls = None
-        self.batch_size = None
-        self.filename = f"remove_expired_urls_job_{str(datetime.now().date())}"
-
     help = "Remove expired entries from the DB"
 
     def add_arguments(self, parser) -> None:
@@ -43,48 +33,54 @@ class Command(BaseCommand):
             default=DEFAULT_EXPIRED_URLS_ITERATION_BATCH_SIZE,
         )
 
+        parser.add_argument(
+            "-w",
+            "--workers",
+            dest="workers",
+            type=int,
+            help="number of processes, each removing a separate range of short URLs",
+            default=1,
+        )
+
+        parser.add_argument(
+            "-c",
+            "--checkpoint-dir",
+            dest="checkpoint_dir",
+            help="directory for tracking progress, an interrupted job resumes from it when rerun",
+            default="remove_expired_urls_checkpoint",
+        )
+
+        parser.add_argument(
+            "-a",
+            "--archive-dir",
+            dest="archive_dir",
+            help="directory to archive removed entries to as compressed CSV (PostgreSQL only)",
+            default=None,
+        )
+
     def handle(self, *args, **options) -> None:
         """
         This command is designed to be run periodically, ideally during low-traffic hours.
         It will remove expired entries from the DB to keep the data fresh and maintain efficient reads.
-        The removed data should ideally be written to some persistent storage for analytical needs.
+        With --archive-dir, the removed data is first written to compressed CSV files for analytical
+        needs, and each chunk is only deleted once its file is safely on disk.
 
         Due to the potentially massive amount of records, we can't just load the entire queryset to memory.
-        Therefore, we first iterate the queryset in batches, write the PKs to a file and then delete
-        (again in batches) all records using the file as a guide.
-        This process ensures that we can delete all records.
+        Therefore, expired records are deleted in chunks by walking the PK index from the last deleted key,
+        which keeps every chunk equally cheap and the memory usage flat however many records expired.
+        Progress is checkpointed after every chunk, so an interrupted job can be resumed by rerunning it.
         """
-        self.expired_urls = url_service.retrieve_expired_urls(
-            grace_days=options["grace_period"]
+        stats = ExpiredUrlPurger(
+            grace_days=options["grace_period"],
+            batch_size=options["batch_size"],
+            checkpoint_dir=options["checkpoint_dir"],
+            workers=options["workers"],
+            archive_dir=options["archive_dir"],
+        ).run()
+        logging.info(f"Removed {stats.rows} expired urls")
+        self.stdout.write(
+            f"Removed {stats.rows} expired urls in {stats.seconds:.1f}s "
+            f"({stats.rows_per_second:.0f} rows/sec), peak memory {stats.peak_memory_kb / 1024:.1f} MB"
         )
-        self.total_expired_urls = self.expired_urls.count()
-        self.batch_size = options["batch_size"]
-        self.write_expired_urls_to_file()
-        self.remove_expired_urls()
-        self.delete_file()
-        logging.info(f"Removed {self.total_expired_urls} expired urls")
-
-    def write_expired_urls_to_file(self) -> None:
-        with open(self.filename, "w") as file:
-            for batch in iterate_in_batches(
-                items=self.expired_urls,
-                total=self.total_expired_urls,
-                batch_size=self.batch_size,
-            ):
-                short_urls = "\n".join(url.short for url in batch)
-                file.writelines(short_urls + "\n")
-
-    def remove_expired_urls(self) -> int:
-        with open(self.filename, "r") as file:
-            for batch in iterate_in_batches(
-                items=file.readlines(),
-                total=self.total_expired_urls,
-                batch_size=self.batch_size,
-            ):
-                short_urls = tuple(map(str.strip, batch))
-                # in real-world scenarios we would not delete this data, but rather
-                # redirect it for future usage.
-                Url.objects.filter(short__in=short_urls).delete()
-
-    def delete_file(self) -> None:
-        os.remove(self.filename)
+        if stats.partitions_dropped:
+            self.stdout.write(f"Dropped {stats.partitions_dropped} expired partitions")
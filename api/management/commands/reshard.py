@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.services.reshard_service import Resharder
+
+
+class Command(BaseCommand):
+    help = "Move URLs to their shards after shards were added"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            help="number of short URLs scanned per chunk",
+            default=1000,
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        To add shards without downtime:
+        1. Append the new shards to DB_SHARD_URLS, and run `migrate --database shard_<n>` for each.
+        2. Set DB_RESHARD_FROM to the previous number of shards (counting the default DB) and
+        deploy, so URLs which weren't moved yet are looked up on their previous shard.
+        3. Run this command, which can be rerun safely if it's interrupted.
+        4. Unset DB_RESHARD_FROM and deploy.
+        """
+        stats = Resharder(batch_size=options["batch_size"]).run()
+        self.stdout.write(
+            f"Moved {stats.moved} of {stats.scanned} urls in {stats.seconds:.1f}s "
+            f"({stats.rows_per_second:.0f} rows/sec)"
+        )
+        if stats.conflicts:
+            self.stdout.write(
+                f"{stats.conflicts} short urls are taken on their new shard and were left on "
+                "their previous one"
+            )
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services import url_keys
+
+
+class Command(BaseCommand):
+    help = "Convert the short URL column to integer keys and back (PostgreSQL only)"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "action",
+            choices=["convert", "revert"],
+            help=(
+                "convert: store short URLs as the integers they decode to; "
+                "revert: store them as text again"
+            ),
+        )
+
+    def handle(self, *args, **options) -> None:
+        """
+        Servers must be stopped during the conversion, and restarted with URL_INTEGER_KEYS
+        set accordingly, since they read and write short URLs in the column's type.
+        """
+        if options["action"] == "convert":
+            url_keys.convert_to_integer_keys()
+            self.stdout.write("Converted the URL table to integer keys, set URL_INTEGER_KEYS=true")
+        else:
+            url_keys.revert_to_text_keys()
+            self.stdout.write("Converted the URL table to text keys, unset URL_INTEGER_KEYS")
+        if settings.URL_INTEGER_KEYS != url_keys.has_integer_keys():
+            self.stderr.write("URL_INTEGER_KEYS doesn't match the URL table until servers restart")
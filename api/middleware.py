@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+
+
+class ProfilingMiddleware:
+    """
+    Profile sampled requests, see `api.services.profiling`. It should come first in MIDDLEWARE so
+    the whole request is profiled. Django leaves it out of the middleware chain unless
+    `settings.PROFILING_ENABLED` is set, so it costs nothing when it's off.
+    """
+
+    def __init__(self, get_response) -> None:
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        # imported here rather than at the top, so workers which don't profile don't import it
+        from api.services import profiling
+
+        if not profiling.should_profile(request.headers.get(profiling.HEADER)):
+            return self.get_response(request)
+        return profiling.profile(
+            f"{request.method} {request.path}", lambda: self.get_response(request)
+        )
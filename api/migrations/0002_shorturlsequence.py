@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def create_default_sequence(apps, schema_editor) -> None:
+    ShortUrlSequence = apps.get_model("api", "ShortUrlSequence")
+    ShortUrlSequence.objects.using(schema_editor.connection.alias).get_or_create(name="default")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShortUrlSequence",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                (
+                    "next_value",
+                    models.BigIntegerField(default=0),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_default_sequence, migrations.RunPython.noop),
+    ]
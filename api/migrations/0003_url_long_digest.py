@@ -0,0 +1,26 @@
+# Generated by Django 4.1.5 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+import api.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_shorturlsequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="url",
+            name="long_digest",
+            field=api.models.UrlDigestField(
+                editable=False, max_length=64, null=True, source="long"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="url",
+            index=models.Index(fields=["long_digest"], name="api_url_long_digest_idx"),
+        ),
+    ]
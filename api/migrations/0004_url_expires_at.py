@@ -0,0 +1,35 @@
+# Generated by Django 4.1.5 on 2026-10-18 07:10
+
+from django.db import migrations, models
+from django.db.models import F
+
+import api.models
+
+
+def populate_expires_at(apps, schema_editor) -> None:
+    Url = apps.get_model("api", "Url")
+    Url.objects.using(schema_editor.connection.alias).exclude(time_to_live__isnull=True).update(
+        expires_at=F("created_at") + F("time_to_live")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_url_long_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="url",
+            name="expires_at",
+            field=api.models.ExpiryField(
+                editable=False, null=True, start="created_at", time_to_live="time_to_live"
+            ),
+        ),
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="url",
+            index=models.Index(fields=["expires_at"], name="api_url_expires_at_idx"),
+        ),
+    ]
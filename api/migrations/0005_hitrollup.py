@@ -0,0 +1,34 @@
+# Generated by Django 4.1.5 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_url_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HitRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("short", models.CharField(max_length=7)),
+                ("bucket", models.DateTimeField()),
+                ("hours", models.PositiveSmallIntegerField(default=1)),
+                ("hits", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="hitrollup",
+            constraint=models.UniqueConstraint(
+                fields=("short", "bucket", "hours"), name="api_hitrollup_short_bucket_hours_uniq"
+            ),
+        ),
+    ]
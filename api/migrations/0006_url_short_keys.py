@@ -0,0 +1,21 @@
+# Generated by Django 4.1.5 on 2026-10-18 07:28
+
+from django.db import migrations
+
+import api.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_hitrollup"),
+    ]
+
+    operations = [
+        # doesn't change the column, which `manage.py url_keys convert` converts to integer keys
+        migrations.AlterField(
+            model_name="url",
+            name="short",
+            field=api.models.ShortUrlField(max_length=7, primary_key=True, serialize=False),
+        ),
+    ]
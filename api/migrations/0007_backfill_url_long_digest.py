@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from api.utils import digest_url
+
+BATCH_SIZE = 1000
+
+
+def populate_long_digest(apps, schema_editor) -> None:
+    """
+    Fill in the digest of the URLs created before 0003 added it, which `get_or_create_short_url`
+    would otherwise never find by their long URL.
+    """
+    Url = apps.get_model("api", "Url")
+    urls = Url.objects.using(schema_editor.connection.alias)
+    while batch := list(urls.filter(long_digest__isnull=True).only("short", "long")[:BATCH_SIZE]):
+        for url in batch:
+            url.long_digest = digest_url(url.long)
+        urls.bulk_update(batch, ["long_digest"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_url_short_keys"),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_long_digest, migrations.RunPython.noop),
+    ]
@@ -1,26 +1,147 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
+from django.conf import settings
 from django.db import models
-from django.db.models import F
 from django.utils import timezone
 
 from api.consts import DEFAULT_EXPIRATION_PERIOD_DAYS, SHORT_URL_LENGTH
+from api.utils import decode_short_url_key, digest_url, encode_short_url_key
 
 DEFAULT_TTL_TIMEDELTA = timedelta(days=DEFAULT_EXPIRATION_PERIOD_DAYS)
 
 
+class UrlDigestField(models.CharField):
+    """
+    Holds the digest of the normalized URL in another field, computed whenever the model is saved.
+    """
+
+    def __init__(self, source: str, *args, **kwargs) -> None:
+        self.source = source
+        kwargs.setdefault("max_length", 64)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance: models.Model, add: bool) -> str:
+        value = digest_url(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class ExpiryField(models.DateTimeField):
+    """
+    Holds the time a model instance expires at, computed from its creation time and time to live
+    whenever the model is saved. Queryset updates of either field must update this one as well.
+    """
+
+    def __init__(self, start: str, time_to_live: str, *args, **kwargs) -> None:
+        self.start = start
+        self.time_to_live = time_to_live
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["start"] = self.start
+        kwargs["time_to_live"] = self.time_to_live
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance: models.Model, add: bool) -> Optional[datetime]:
+        time_to_live = getattr(model_instance, self.time_to_live)
+        value = None
+        if time_to_live is not None:
+            value = getattr(model_instance, self.start) + time_to_live
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class ShortUrlField(models.CharField):
+    """
+    Holds a short URL as text or, once the column was converted by `manage.py url_keys convert`
+    (see `settings.URL_INTEGER_KEYS`), as the integer it decodes to, which is faster to compare
+    and doesn't need a LIKE index. Values are short URLs either way, and ones which can't be
+    decoded match no row. Raw SQL must convert short URLs with `short_url_to_db` and
+    `short_url_from_db`.
+    """
+
+    def get_prep_value(self, value):
+        if settings.URL_INTEGER_KEYS and isinstance(value, int):
+            return value
+        return super().get_prep_value(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return short_url_to_db(value) if isinstance(value, str) else value
+
+    def from_db_value(self, value, expression, connection):
+        return short_url_from_db(value)
+
+
+def short_url_to_db(short_url: str):
+    """
+    Return the value the given short URL is stored as in the URL table.
+    """
+    if settings.URL_INTEGER_KEYS:
+        return decode_short_url_key(short_url)
+    return short_url
+
+
+def short_url_from_db(value) -> Optional[str]:
+    return encode_short_url_key(value) if isinstance(value, int) else value
+
+
 class Url(models.Model):
-    short = models.CharField(max_length=SHORT_URL_LENGTH, primary_key=True)
+    short = ShortUrlField(max_length=SHORT_URL_LENGTH, primary_key=True)
     long = models.CharField(max_length=255)
     created_at = models.DateTimeField(default=timezone.now)
     time_to_live = models.DurationField(default=DEFAULT_TTL_TIMEDELTA, null=True)
     hits = models.BigIntegerField(default=0)
+    long_digest = UrlDigestField(source="long", null=True, editable=False)
+    expires_at = ExpiryField(
+        start="created_at", time_to_live="time_to_live", null=True, editable=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["long_digest"], name="api_url_long_digest_idx"),
+            models.Index(fields=["expires_at"], name="api_url_expires_at_idx"),
+        ]
 
     def is_expired(self, as_of: Optional[datetime] = None) -> bool:
-        if self.time_to_live is None:
+        if self.expires_at is None:
             return False
-        return self.created_at + self.time_to_live <= (as_of or timezone.now())
+        return self.expires_at <= (as_of or timezone.now())
+
+
+class ShortUrlSequence(models.Model):
+    """
+    A counter from which workers reserve blocks of sequence numbers for short URLs.
+    """
+
+    name = models.CharField(max_length=32, primary_key=True)
+    next_value = models.BigIntegerField(default=0)
+
+
+class HitRollup(models.Model):
+    """
+    The number of hits of a short URL during an hour, or during a day once compacted.
+    """
+
+    HOURLY = 1
+    DAILY = 24
+
+    short = models.CharField(max_length=SHORT_URL_LENGTH)
+    bucket = models.DateTimeField()
+    hours = models.PositiveSmallIntegerField(default=HOURLY)
+    hits = models.BigIntegerField(default=0)
 
-    def increment_hits(self) -> None:
-        Url.objects.filter(short=self.short).update(hits=F("hits") + 1)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["short", "bucket", "hours"], name="api_hitrollup_short_bucket_hours_uniq"
+            ),
+        ]
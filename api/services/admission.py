@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Optional
+
+from django.conf import settings
+
+# request classes, in the order they're shed
+CREATE = "create"
+REDIRECT = "redirect"
+REQUEST_CLASSES = (CREATE, REDIRECT)
+
+
+class _Waiter:
+    __slots__ = ("admitted", "_wake")
+
+    def __init__(self, wake) -> None:
+        self.admitted = False
+        self._wake = wake
+
+    def admit(self) -> None:
+        self.admitted = True
+        self._wake()
+
+
+class Gate:
+    """
+    Bound the requests of a class which are in flight in this process. Requests beyond the limit
+    wait in a FIFO queue for up to `queue_seconds`, and a request leaving hands its slot to the
+    oldest waiting one. Both threads and coroutines can wait, so sync and async views share the
+    limit.
+
+    Args:
+        limit (int): Maximum number of requests in flight.
+        queue_seconds (float): Maximum time a request waits for a slot, 0 rejects it right away.
+    """
+
+    def __init__(self, limit: int, queue_seconds: float) -> None:
+        self.limit = limit
+        self.queue_seconds = queue_seconds
+        self.in_flight = 0
+        self._waiters: deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.limit
+
+    def _enter(self, queue: bool, wake) -> tuple[bool, Optional[_Waiter]]:
+        """
+        Take a free slot, or queue a waiter woken by `wake` once it's handed a slot.
+        """
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return True, None
+            if not queue or self.queue_seconds <= 0:
+                return False, None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return False, waiter
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if waiter.admitted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def enter(self, queue: bool = True) -> bool:
+        """
+        Return whether the request was admitted, in which case it must call `leave`.
+        """
+        event = threading.Event()
+        admitted, waiter = self._enter(queue, event.set)
+        if waiter is None:
+            return admitted
+        event.wait(self.queue_seconds)
+        return self._give_up(waiter)
+
+    async def aenter(self, queue: bool = True) -> bool:
+        """
+        An async counterpart of `enter`, which waits without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        admitted, waiter = self._enter(queue, wake)
+        if waiter is None:
+            return admitted
+        try:
+            await asyncio.wait([future], timeout=self.queue_seconds)
+        except asyncio.CancelledError:
+            # a slot handed over meanwhile is handed on
+            if self._give_up(waiter):
+                self.leave()
+            raise
+        return self._give_up(waiter)
+
+    def leave(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # the slot is handed over, so in-flight requests don't change
+                self._waiters.popleft().admit()
+            else:
+                self.in_flight -= 1
+
+
+_gates: Optional[dict[str, Gate]] = None
+_gates_lock = threading.Lock()
+
+
+def get_gates() -> Optional[dict[str, Gate]]:
+    """
+    Return this process' gate of every request class, creating them on first use,
+    or None if `settings.ADMISSION_CONTROL_ENABLED` is off.
+    """
+    global _gates
+    if not settings.ADMISSION_CONTROL_ENABLED:
+        return None
+    if _gates is None:
+        with _gates_lock:
+            if _gates is None:
+                _gates = {
+                    CREATE: Gate(
+                        settings.ADMISSION_CREATE_MAX_IN_FLIGHT,
+                        settings.ADMISSION_CREATE_QUEUE_SECONDS,
+                    ),
+                    REDIRECT: Gate(
+                        settings.ADMISSION_REDIRECT_MAX_IN_FLIGHT,
+                        settings.ADMISSION_REDIRECT_QUEUE_SECONDS,
+                    ),
+                }
+    return _gates
+
+
+def reset_gates() -> None:
+    """
+    Forget the gates, so they're created again from the current settings.
+    """
+    global _gates
+    with _gates_lock:
+        _gates = None
+
+
+def should_queue(gates: dict[str, Gate], request_class: str) -> bool:
+    """
+    Creates are shed first: while redirects use all their slots, creates which can't be admitted
+    right away are rejected rather than queued, so they give up their workers and DB connections.
+    """
+    return request_class != CREATE or not gates[REDIRECT].saturated
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils import timezone
+
+from api.models import Url
+
+# the short URL comes first, so the key of every archived row is the first CSV field
+ARCHIVE_COLUMNS = [Url._meta.pk.column] + [
+    field.column for field in Url._meta.concrete_fields if not field.primary_key
+]
+MANIFEST_FILE_NAME = "manifest.jsonl"
+
+# archives are written once and rarely read, so favor speed over compression ratio
+COMPRESS_LEVEL = 1
+
+
+@dataclass
+class ArchivedChunk:
+    file: str
+    rows: int
+    sha256: str
+    last_key: str
+
+
+class _ChunkWriter:
+    """
+    File-like object which `COPY ... TO STDOUT` streams into, compressing the rows as they come
+    while counting them and keeping track of the last one.
+    """
+
+    def __init__(self, file) -> None:
+        self._gzip = gzip.GzipFile(fileobj=file, mode="wb", compresslevel=COMPRESS_LEVEL, mtime=0)
+        self._sha256 = hashlib.sha256()
+        self._partial_line = b""
+        self.last_line = b""
+        self.rows = 0
+
+    def write(self, data) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        self._gzip.write(data)
+        self._sha256.update(data)
+        end = data.rfind(b"\n")
+        if end == -1:
+            self._partial_line += data
+            return
+        self.rows += data.count(b"\n")
+        start = data.rfind(b"\n", 0, end) + 1
+        self.last_line = (self._partial_line if start == 0 else b"") + data[start:end]
+        self._partial_line = data[end + 1 :]
+
+    def close(self) -> str:
+        self._gzip.close()
+        return self._sha256.hexdigest()
+
+
+class UrlArchive:
+    """
+    Directory of gzip-compressed CSV files of removed URLs, one file per archived chunk.
+
+    Rows are streamed from Postgres with `COPY ... TO STDOUT` straight into the compressed file,
+    so archiving a chunk takes the same memory however large it is. Every chunk file is synced
+    to disk before it's listed in the manifest, which records its row count and the SHA-256 of its
+    uncompressed content, and the manifest is synced before the archived rows may be deleted.
+
+    Args:
+        archive_dir (str): Directory for the chunk files and their manifest.
+    """
+
+    def __init__(self, archive_dir: str) -> None:
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("Archiving URLs is only supported for PostgreSQL")
+        if settings.URL_INTEGER_KEYS:
+            raise ImproperlyConfigured("Archiving URLs isn't supported with integer URL keys")
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def write_chunk(
+        self, name: str, sql: str, params, using: str = DEFAULT_DB_ALIAS
+    ) -> Optional[ArchivedChunk]:
+        """
+        Write the rows of the given query, which must select `ARCHIVE_COLUMNS`, from the given DB
+        to a chunk file. A chunk file with the same name is overwritten.
+
+        Returns:
+            Optional[ArchivedChunk]: The archived chunk, or None if the query returned no rows.
+        """
+        file_name = f"{name}.csv.gz"
+        path = os.path.join(self.archive_dir, file_name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file, connections[using].cursor() as cursor:
+            writer = _ChunkWriter(file)
+            query = cursor.mogrify(sql, params).decode()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", writer)
+            sha256 = writer.close()
+            file.flush()
+            os.fsync(file.fileno())
+
+        if not writer.rows:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+        self._sync_dir()
+        return ArchivedChunk(
+            file=file_name,
+            rows=writer.rows,
+            sha256=sha256,
+            last_key=writer.last_line.split(b",", 1)[0].decode(),
+        )
+
+    def record(self, chunk: ArchivedChunk) -> None:
+        entry = {**asdict(chunk), "columns": ARCHIVE_COLUMNS, "archived_at": timezone.now()}
+        line = json.dumps(entry, default=str) + "\n"
+        # a single small append is atomic, so workers can share the manifest
+        with open(os.path.join(self.archive_dir, MANIFEST_FILE_NAME), "a") as manifest:
+            manifest.write(line)
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+    def _sync_dir(self) -> None:
+        fd = os.open(self.archive_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
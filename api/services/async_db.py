@@ -0,0 +1,81 @@
+import asyncio
+from typing import TYPE_CHECKING, Any, Optional, Sequence
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+
+if TYPE_CHECKING:
+    from psycopg_pool import AsyncConnectionPool
+
+_pools: dict[tuple[int, str], "AsyncConnectionPool"] = {}
+
+
+def _import_psycopg():
+    """
+    psycopg is only imported once a pool is needed, since importing it takes longer than
+    importing the rest of the app, and sync workers never need it.
+    """
+    try:
+        from psycopg.conninfo import make_conninfo
+        from psycopg_pool import AsyncConnectionPool
+    except ImportError:  # pragma: no cover
+        raise ImproperlyConfigured("Async views require `psycopg` and `psycopg_pool`")
+    return make_conninfo, AsyncConnectionPool
+
+
+def _conninfo(alias: str) -> str:
+    db = connections[alias].settings_dict
+    if db["ENGINE"] != "django.db.backends.postgresql":
+        raise ImproperlyConfigured("Async DB access is only supported for PostgreSQL")
+    make_conninfo, _ = _import_psycopg()
+    return make_conninfo(
+        dbname=db["NAME"],
+        user=db["USER"],
+        password=db["PASSWORD"],
+        host=db["HOST"],
+        port=db["PORT"],
+    )
+
+
+async def get_pool(alias: str = DEFAULT_DB_ALIAS) -> "AsyncConnectionPool":
+    """
+    Return the connection pool of the given DB for the running event loop, opening it on first use.
+    Connections are in autocommit mode, use `connection.transaction()` to group statements.
+    """
+    _, AsyncConnectionPool = _import_psycopg()
+    key = (id(asyncio.get_running_loop()), alias)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = AsyncConnectionPool(
+            _conninfo(alias),
+            min_size=settings.ASYNC_DB_POOL["MIN_SIZE"],
+            max_size=settings.ASYNC_DB_POOL["MAX_SIZE"],
+            kwargs={"autocommit": True},
+            open=False,
+        )
+        _pools[key] = pool
+        await pool.open()
+    return pool
+
+
+async def fetch_one(
+    sql: str, params: Sequence[Any] = (), alias: str = DEFAULT_DB_ALIAS
+) -> Optional[tuple]:
+    pool = await get_pool(alias)
+    async with pool.connection() as connection:
+        cursor = await connection.execute(sql, params)
+        return await cursor.fetchone()
+
+
+async def execute(sql: str, params: Sequence[Any] = (), alias: str = DEFAULT_DB_ALIAS) -> int:
+    pool = await get_pool(alias)
+    async with pool.connection() as connection:
+        cursor = await connection.execute(sql, params)
+        return cursor.rowcount
+
+
+async def close_pools() -> None:
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _pools if key[0] == loop_id]:
+        await _pools.pop(key).close()
@@ -0,0 +1,181 @@
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.utils import timezone
+
+from api.consts import MAX_RETRIES_FOR_URL_CLASH
+from api.errors import AppError, ExpiredUrl, InvalidUrl, UrlNotFound
+from api.models import Url, short_url_from_db, short_url_to_db
+from api.services import async_db, metrics, sharding, url_service
+from api.services.hit_counters import get_hit_counter
+from api.services.short_url_allocator import get_allocator
+from api.services.url_cache import CachedUrl, url_cache
+from api.utils import digest_url, normalize_url
+
+URL_COLUMNS = ("short", "long", "created_at", "time_to_live", "expires_at")
+
+
+def _select_urls_sql(column: str) -> str:
+    quote_name = connection.ops.quote_name
+    return (
+        f"SELECT {', '.join(map(quote_name, URL_COLUMNS))} "
+        f"FROM {quote_name(Url._meta.db_table)} WHERE {quote_name(column)} = %s"
+    )
+
+
+def _url_from_row(row: tuple) -> Url:
+    url = Url(**dict(zip(URL_COLUMNS, row)))
+    url.short = short_url_from_db(url.short)
+    return url
+
+
+async def _agenerate_short_url() -> str:
+    if settings.SHORT_URL_ALLOCATOR_ENABLED:
+        return await get_allocator().anext_short_url()
+    return url_service._generate_random_short_url()
+
+
+async def _aget_url_entry_from_short_url(short_url: str) -> Url:
+    for db in url_service._lookup_dbs(short_url):
+        row = await async_db.fetch_one(
+            _select_urls_sql("short"), [short_url_to_db(short_url)], alias=db
+        )
+        if row is not None:
+            return _url_from_row(row)
+    raise UrlNotFound(short_url)
+
+
+async def aget_redirect(short_url: str) -> CachedUrl:
+    cached = url_cache.get(short_url)
+    if cached is not None:
+        metrics.REDIRECTS.labels("cached").inc()
+        await _arecord_hit(short_url)
+        return cached
+
+    snapshot = url_service.get_redirect_snapshot()
+    if snapshot is not None:
+        snapshotted = snapshot.get(short_url)
+        if snapshotted is not None:
+            if snapshotted.expires_at is not None and snapshotted.expires_at <= timezone.now():
+                metrics.REDIRECTS.labels("expired").inc()
+                raise ExpiredUrl(short_url)
+            metrics.REDIRECTS.labels("snapshot").inc()
+            await _arecord_hit(short_url)
+            return snapshotted
+
+    short_url_filter = url_service.get_short_url_filter()
+    if short_url_filter is not None and not short_url_filter.might_exist(short_url):
+        metrics.REDIRECTS.labels("filtered").inc()
+        raise UrlNotFound(short_url)
+    try:
+        with metrics.REDIRECT_STAGE_SECONDS.labels("db_lookup").time():
+            url = await _aget_url_entry_from_short_url(short_url)
+    except UrlNotFound:
+        metrics.REDIRECTS.labels("not_found").inc()
+        raise
+    if url.is_expired():
+        metrics.REDIRECTS.labels("expired").inc()
+        raise ExpiredUrl(url.short)
+    metrics.REDIRECTS.labels("found").inc()
+    url_cache.put(url.short, url.long, url.expires_at)
+    await _arecord_hit(url.short)
+    return CachedUrl(url.long, url.expires_at)
+
+
+async def aget_redirect_url(short_url: str) -> str:
+    return (await aget_redirect(short_url)).long
+
+
+async def _arecord_hit(short_url: str) -> None:
+    with metrics.REDIRECT_STAGE_SECONDS.labels("record_hit").time():
+        await get_hit_counter().arecord(short_url)
+        hit_rollups = url_service.get_hit_rollups()
+        if hit_rollups is not None:
+            hit_rollups.record(short_url)
+
+
+async def aget_or_create_short_url(long_url: str, deduplicate: Optional[bool] = None) -> str:
+    if not url_service._is_url_valid(long_url):
+        metrics.CREATES.labels("invalid").inc()
+        raise InvalidUrl(long_url)
+    if deduplicate is None:
+        deduplicate = settings.DEDUPLICATE_URLS
+
+    pool = await async_db.get_pool()
+    async with pool.connection() as db:
+        if not deduplicate:
+            return await _acreate_short_url(db, long_url)
+
+        async with db.transaction():
+            with metrics.CREATE_STAGE_SECONDS.labels("deduplicate").time():
+                await db.execute(
+                    "SELECT pg_advisory_xact_lock(%s)", [url_service._long_url_lock_id(long_url)]
+                )
+                existing_short_url = await _aget_existing_short_url(db, long_url)
+            if existing_short_url:
+                metrics.CREATES.labels("deduplicated").inc()
+                return existing_short_url
+            return await _acreate_short_url(db, long_url)
+
+
+async def _aget_existing_short_url(db, long_url: str) -> Optional[str]:
+    normalized_url = normalize_url(long_url)
+    for shard in settings.DATABASE_SHARDS:
+        rows = await _afetch_all(db, shard, _select_urls_sql("long_digest"), [digest_url(long_url)])
+        for row in rows:
+            url = _url_from_row(row)
+            if not url.is_expired() and normalize_url(url.long) == normalized_url:
+                return url.short
+    return None
+
+
+async def _acreate_short_url(db, long_url: str) -> str:
+    try:
+        with metrics.CREATE_STAGE_SECONDS.labels("insert").time():
+            short_url = await _acreate_url_entry_with_retry(db, long_url)
+    except AppError:
+        metrics.CREATES.labels("failed").inc()
+        raise
+    metrics.CREATES.labels("created").inc()
+    short_url_filter = url_service.get_short_url_filter()
+    if short_url_filter is not None:
+        from api.services.short_url_filter import notify_statement
+
+        short_url_filter.add(short_url)
+        await db.execute(*notify_statement([short_url]))
+    return short_url
+
+
+async def _afetch_all(db, shard: str, sql: str, params) -> list[tuple]:
+    """
+    Run a statement on the given shard, through `db` if it's the default DB, and return its rows.
+    """
+    if shard == DEFAULT_DB_ALIAS:
+        return await (await db.execute(sql, params)).fetchall()
+    pool = await async_db.get_pool(shard)
+    async with pool.connection() as shard_db:
+        return await (await shard_db.execute(sql, params)).fetchall()
+
+
+async def _acreate_url_entry_with_retry(db, long_url: str) -> str:
+    for _ in range(MAX_RETRIES_FOR_URL_CLASH):
+        entry = Url(short=await _agenerate_short_url(), long=long_url)
+        shards = sharding.shards_for(entry.short)
+        # while resharding, short URLs which weren't moved yet are taken on their previous shard
+        if len(shards) > 1 and await _afetch_all(
+            db, shards[1], _select_urls_sql("short"), [short_url_to_db(entry.short)]
+        ):
+            metrics.SHORT_URL_COLLISIONS.inc()
+            continue
+        shard = shards[0]
+        async with db.transaction():
+            if settings.URL_TABLE_PARTITIONED:
+                await db.execute(*url_service._lock_short_urls_statement([entry.short]))
+            inserted = await _afetch_all(
+                db, shard, *url_service._insert_ignoring_conflicts_statement([entry])
+            )
+        if inserted:
+            return entry.short
+        metrics.SHORT_URL_COLLISIONS.inc()
+    raise AppError(url_service.SHORT_URL_GENERATION_ERROR)
@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import Callable, Union
+
+from api.errors import AppError
+
+
+class _PendingCreate:
+    __slots__ = ("long_url", "result", "done")
+
+    def __init__(self, long_url: str) -> None:
+        self.long_url = long_url
+        self.result: Union[str, BaseException, None] = None
+        self.done = False
+
+
+class CreateBatcher:
+    """
+    Gather the short URLs created concurrently by the threads of a process into batches, each
+    inserted with a single multi-row statement and commit instead of one per short URL.
+
+    The first thread to create a short URL while no batch is gathering leads the next batch: it
+    waits up to `window_seconds`, or until `max_batch_size` short URLs were requested, and then
+    creates the whole batch on its own DB connection while the other threads wait for their
+    result. Short URLs which were taken are retried within the batch by `create_many`. If the
+    batch fails, each of its URLs is created on its own, so a URL which can't be created only
+    fails its own request.
+
+    Args:
+        create_many (Callable[[list[str]], list[Union[str, AppError]]]): Creates the short URLs
+        of valid URLs, see `url_service.create_short_urls`.
+        window_seconds (float): Maximum time a batch is gathered for.
+        max_batch_size (int): Number of short URLs which closes a batch early.
+    """
+
+    def __init__(
+        self,
+        create_many: Callable[[list[str]], list[Union[str, AppError]]],
+        window_seconds: float,
+        max_batch_size: int,
+    ) -> None:
+        self.create_many = create_many
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._condition = threading.Condition()
+        self._batch: list[_PendingCreate] = []
+        self._gathering = False
+
+    def create(self, long_url: str) -> str:
+        """
+        Return a new short URL for the given valid URL, created in a batch.
+
+        Raises:
+            AppError: If no free short URL was found.
+        """
+        pending = _PendingCreate(long_url)
+        with self._condition:
+            self._batch.append(pending)
+            if self._gathering:
+                if len(self._batch) >= self.max_batch_size:
+                    self._condition.notify_all()
+                while not pending.done:
+                    self._condition.wait()
+                return self._result(pending)
+
+            self._gathering = True
+            deadline = time.monotonic() + self.window_seconds
+            while len(self._batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            # the next batch gathers while this one is written
+            batch, self._batch = self._batch, []
+            self._gathering = False
+
+        try:
+            try:
+                results = self.create_many([create.long_url for create in batch])
+            except Exception:
+                if len(batch) == 1:
+                    raise
+                results = [self._create_alone(create.long_url) for create in batch]
+        except BaseException as e:
+            # waiters get exceptions of their own, a shared one would mix up their tracebacks
+            results = [
+                e if create is pending else RuntimeError(f"Creating {create.long_url} failed")
+                for create in batch
+            ]
+        with self._condition:
+            for create, result in zip(batch, results):
+                create.result = result
+                create.done = True
+            self._condition.notify_all()
+        return self._result(pending)
+
+    def _create_alone(self, long_url: str) -> Union[str, BaseException]:
+        try:
+            return self.create_many([long_url])[0]
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _result(pending: _PendingCreate) -> str:
+        if isinstance(pending.result, BaseException):
+            raise pending.result
+        return pending.result
@@ -0,0 +1,217 @@
+import abc
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from api.models import Url, short_url_from_db, short_url_to_db
+from api.services import async_db, metrics, sharding
+
+log = logging.getLogger(__name__)
+
+HITS_FLUSH_BATCH_SIZE = 1000
+
+
+class HitCounter(abc.ABC):
+    """
+    Base class for hit counting backends.
+    """
+
+    @abc.abstractmethod
+    def record(self, short_url: str, amount: int = 1) -> None:
+        pass
+
+    async def arecord(self, short_url: str, amount: int = 1) -> None:
+        await sync_to_async(self.record)(short_url, amount)
+
+    def flush(self) -> int:
+        """
+        Write pending hits to the DB and return the number of hits written.
+        """
+        return 0
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SyncHitCounter(HitCounter):
+    """
+    Increment the hit counter in the DB on every redirect.
+    """
+
+    def record(self, short_url: str, amount: int = 1) -> None:
+        # while resharding, the URL may still be on its previous shard
+        for shard in sharding.shards_for(short_url):
+            if Url.objects.using(shard).filter(short=short_url).update(hits=F("hits") + amount):
+                return
+
+    async def arecord(self, short_url: str, amount: int = 1) -> None:
+        table = connection.ops.quote_name(Url._meta.db_table)
+        for shard in sharding.shards_for(short_url):
+            if await async_db.execute(
+                f"UPDATE {table} SET hits = hits + %s WHERE short = %s",
+                [amount, short_url_to_db(short_url)],
+                alias=shard,
+            ):
+                return
+
+
+class BufferedHitCounter(HitCounter):
+    """
+    Aggregate hits in memory and periodically write them to the DB in bulk.
+
+    Recording a hit never touches the DB. Pending hits are swapped out under a lock and written
+    with a single UPDATE per batch of short URLs, and those which weren't written are put back if
+    the write fails, so hits are only lost if the process is killed before it gets to flush them.
+
+    Args:
+        flush_interval (float, optional): Seconds between background flushes. If not provided,
+        hits are only written when `flush` or `close` are called.
+    """
+
+    thread_name = "hit-counter-flusher"
+
+    def __init__(self, flush_interval: Optional[float] = None) -> None:
+        self._pending: defaultdict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(
+                target=self._flush_periodically,
+                args=(flush_interval,),
+                name=self.thread_name,
+                daemon=True,
+            )
+            self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    def record(self, short_url: str, amount: int = 1) -> None:
+        with self._lock:
+            self._pending[short_url] += amount
+
+    async def arecord(self, short_url: str, amount: int = 1) -> None:
+        self.record(short_url, amount)
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return 0
+
+        written = set()
+        try:
+            self._write(pending, written)
+        except Exception:
+            # batches written before the failure are committed, adding them again would count
+            # their hits twice
+            with self._lock:
+                for key, amount in pending.items():
+                    if key not in written:
+                        self._pending[key] += amount
+            raise
+        return sum(pending.values())
+
+    def _write(self, pending: dict, written: set) -> None:
+        """
+        Write the pending hits, adding the keys of those committed to `written` as it goes.
+        """
+        with metrics.HIT_FLUSH_SECONDS.time():
+            apply_hits(pending, applied=written)
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Failed to flush hit counters, will retry")
+                connection.close()
+        connection.close()
+
+
+def apply_hits(hits: dict[str, int], applied: Optional[set[str]] = None) -> None:
+    """
+    Add the given amounts to the hit counters of the given short URLs, on their shards.
+
+    Short URLs are updated in sorted order so concurrent flushes from several workers
+    lock rows in the same order and can't deadlock.
+
+    Args:
+        hits (dict[str, int]): Amounts by short URL.
+        applied (set[str], optional): Filled in with the short URLs whose counters were updated,
+        batch by batch, so a caller can tell which were if a later batch fails.
+    """
+    if applied is None:
+        applied = set()
+    missing = _apply_hits_to_shards(hits, sharding.get_ring(), applied)
+    previous_ring = sharding.get_previous_ring()
+    if missing and previous_ring is not None:
+        # while resharding, some URLs may still be on their previous shard
+        _apply_hits_to_shards(
+            {short_url: hits[short_url] for short_url in missing}, previous_ring, applied
+        )
+
+
+def _apply_hits_to_shards(
+    hits: dict[str, int], ring: sharding.HashRing, applied: set[str]
+) -> set[str]:
+    """
+    Returns:
+        set[str]: The short URLs which weren't found.
+    """
+    table = connection.ops.quote_name(Url._meta.db_table)
+    missing = set()
+    for shard, short_urls in ring.group(hits).items():
+        items = sorted((short_url_to_db(short_url), hits[short_url]) for short_url in short_urls)
+        updated = set()
+        with connections[shard].cursor() as cursor:
+            for start in range(0, len(items), HITS_FLUSH_BATCH_SIZE):
+                batch = items[start : start + HITS_FLUSH_BATCH_SIZE]
+                values = ", ".join(["(%s, %s)"] * len(batch))
+                cursor.execute(
+                    f"WITH increments (short, hits) AS (VALUES {values}) "
+                    f"UPDATE {table} SET hits = {table}.hits + increments.hits "
+                    f"FROM increments WHERE {table}.short = increments.short "
+                    f"RETURNING {table}.short",
+                    [param for item in batch for param in item],
+                )
+                batch_updated = {short_url_from_db(row[0]) for row in cursor.fetchall()}
+                updated.update(batch_updated)
+                applied.update(batch_updated)
+        missing.update(set(short_urls) - updated)
+    return missing
+
+
+_hit_counter = None
+_hit_counter_lock = threading.Lock()
+
+
+def get_hit_counter() -> HitCounter:
+    """
+    Return this process' hit counter, creating it from `settings.HIT_COUNTER` on first use.
+    Pending hits are flushed when the process exits cleanly.
+    """
+    global _hit_counter
+    if _hit_counter is None:
+        with _hit_counter_lock:
+            if _hit_counter is None:
+                backend = import_string(settings.HIT_COUNTER["BACKEND"])
+                _hit_counter = backend(**settings.HIT_COUNTER.get("OPTIONS", {}))
+                atexit.register(_hit_counter.close)
+    return _hit_counter
@@ -0,0 +1,193 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from api.errors import InvalidStatsRange
+from api.models import HitRollup
+from api.services.hit_counters import HITS_FLUSH_BATCH_SIZE, BufferedHitCounter
+
+SECONDS_PER_HOUR = 3600
+
+# range of /stats/<code>/ when the request doesn't specify one
+DEFAULT_STATS_RANGE = timedelta(days=7)
+
+TABLE = connection.ops.quote_name(HitRollup._meta.db_table)
+
+
+class HitRollups(BufferedHitCounter):
+    """
+    Count hits per short URL per hour in memory and periodically add them to the hourly rollups
+    in the DB in bulk, so memory and writes grow with the number of short URLs hit during the
+    flush interval rather than with the number of hits.
+
+    Args:
+        flush_interval (float, optional): Seconds between background flushes. If not provided,
+        hits are only written when `flush` or `close` are called.
+    """
+
+    thread_name = "hit-rollups-flusher"
+
+    def record(self, short_url: str, amount: int = 1) -> None:
+        hour = int(time.time()) // SECONDS_PER_HOUR
+        with self._lock:
+            self._pending[(short_url, hour)] += amount
+
+    def _write(self, pending: dict[tuple[str, int], int], written: set) -> None:
+        add_hourly_hits(pending, added=written)
+
+
+def add_hourly_hits(
+    hits: dict[tuple[str, int], int], added: Optional[set[tuple[str, int]]] = None
+) -> None:
+    """
+    Add the given amounts to the hourly rollups of the given short URLs and hours (since epoch).
+
+    Rows are upserted in sorted order so concurrent flushes from several workers
+    lock rows in the same order and can't deadlock.
+
+    Args:
+        hits (dict[tuple[str, int], int]): Amounts by short URL and hour.
+        added (set[tuple[str, int]], optional): Filled in with the short URLs and hours whose
+        rollups were upserted, batch by batch, so a caller can tell which were if a later batch
+        fails.
+    """
+    keys = sorted(hits)
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), HITS_FLUSH_BATCH_SIZE):
+            batch = keys[start : start + HITS_FLUSH_BATCH_SIZE]
+            rows = [
+                (short_url, _hour_start(hour), HitRollup.HOURLY, hits[short_url, hour])
+                for short_url, hour in batch
+            ]
+            cursor.execute(
+                f"INSERT INTO {TABLE} (short, bucket, hours, hits) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))} "
+                f"ON CONFLICT (short, bucket, hours) DO UPDATE "
+                f"SET hits = {TABLE}.hits + EXCLUDED.hits",
+                [param for row in rows for param in row],
+            )
+            if added is not None:
+                added.update(batch)
+
+
+def _hour_start(hour: int) -> datetime:
+    return datetime.fromtimestamp(hour * SECONDS_PER_HOUR, timezone.utc)
+
+
+def _day_start(when: datetime) -> datetime:
+    when = when.astimezone(timezone.utc)
+    return datetime(when.year, when.month, when.day, tzinfo=timezone.utc)
+
+
+def compact_hourly_rollups(before: datetime) -> int:
+    """
+    Replace the hourly rollups of the days before the given time with one daily rollup per short
+    URL per day, a day at a time. Hourly rollups of a day which was already compacted, from a
+    late flush, are added to its daily rollup.
+
+    Returns:
+        int: The number of compacted hourly rollups.
+    """
+    before = _day_start(before)
+    oldest = (
+        HitRollup.objects.filter(hours=HitRollup.HOURLY, bucket__lt=before)
+        .order_by("bucket")
+        .values_list("bucket", flat=True)
+        .first()
+    )
+    if oldest is None:
+        return 0
+
+    compacted = 0
+    day = _day_start(oldest)
+    while day < before:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH hourly AS (DELETE FROM {TABLE} "
+                f"WHERE hours = %s AND bucket >= %s AND bucket < %s RETURNING short, hits) "
+                f"INSERT INTO {TABLE} (short, bucket, hours, hits) "
+                f"SELECT short, %s, %s, SUM(hits) FROM hourly GROUP BY short ORDER BY short "
+                f"ON CONFLICT (short, bucket, hours) DO UPDATE "
+                f"SET hits = {TABLE}.hits + EXCLUDED.hits "
+                f"RETURNING (SELECT COUNT(*) FROM hourly)",
+                [HitRollup.HOURLY, day, day + timedelta(days=1), day, HitRollup.DAILY],
+            )
+            row = cursor.fetchone()
+            compacted += row[0] if row else 0
+        day += timedelta(days=1)
+    return compacted
+
+
+def delete_daily_rollups(before: datetime) -> int:
+    """
+    Returns:
+        int: The number of deleted daily rollups.
+    """
+    deleted, _ = HitRollup.objects.filter(hours=HitRollup.DAILY, bucket__lt=before).delete()
+    return deleted
+
+
+def parse_stats_range(since: Optional[str], until: Optional[str]) -> tuple[datetime, datetime]:
+    """
+    Parse the ISO 8601 bounds of a stats request, which default to the last
+    `DEFAULT_STATS_RANGE` up to now. Bounds without a time zone are in UTC.
+    """
+    try:
+        end = _parse_bound(until) if until else datetime.now(timezone.utc)
+        start = _parse_bound(since) if since else end - DEFAULT_STATS_RANGE
+    except ValueError:
+        raise InvalidStatsRange()
+    if start >= end:
+        raise InvalidStatsRange()
+    return start, end
+
+
+def _parse_bound(value: str) -> datetime:
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def get_hit_stats(
+    short_url: str, start: datetime, end: datetime
+) -> list[tuple[datetime, int, int]]:
+    """
+    Return the rollups of the given short URL which start in the given range, as
+    (start, hours, hits), in a single range scan of the rollups' unique index.
+    Hits still pending in the workers' memory are not included.
+    """
+    return list(
+        HitRollup.objects.filter(short=short_url, bucket__gte=start, bucket__lt=end)
+        .order_by("bucket", "hours")
+        .values_list("bucket", "hours", "hits")
+    )
+
+
+_hit_rollups = None
+_hit_rollups_lock = threading.Lock()
+
+
+def get_hit_rollups() -> Optional[HitRollups]:
+    """
+    Return this process' hit rollups, creating them on first use,
+    or None if `settings.HIT_ROLLUPS_ENABLED` is off.
+    Pending hits are flushed when the process exits cleanly.
+    """
+    global _hit_rollups
+    if not settings.HIT_ROLLUPS_ENABLED:
+        return None
+    if _hit_rollups is None:
+        with _hit_rollups_lock:
+            if _hit_rollups is None:
+                _hit_rollups = HitRollups(
+                    flush_interval=settings.HIT_ROLLUPS_FLUSH_INTERVAL_SECONDS
+                )
+                atexit.register(_hit_rollups.close)
+    return _hit_rollups
@@ -0,0 +1,230 @@
+import bisect
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+BENCH_URL_PREFIX = "https://example.com/bench/"
+
+# redirects may be permanent, see `settings.REDIRECT_CACHE_STATUS`
+REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+
+class ZipfSampler:
+    """
+    Sample indexes in [0, n) where index k is drawn with probability proportional to 1 / (k + 1)^s,
+    i.e. a few keys get most of the traffic, like short URLs shared on social media.
+    """
+
+    def __init__(self, n: int, exponent: float, rng: random.Random) -> None:
+        self._cumulative_weights = list(
+            itertools.accumulate((rank**-exponent for rank in range(1, n + 1)))
+        )
+        self._rng = rng
+
+    def sample(self) -> int:
+        point = self._rng.random() * self._cumulative_weights[-1]
+        return bisect.bisect(self._cumulative_weights, point)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, min(len(sorted_values), round(q / 100 * len(sorted_values))) - 1)]
+
+
+@dataclass
+class OperationStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    queries: Optional[int] = 0
+
+    def merge(self, other: "OperationStats") -> None:
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        if self.queries is not None and other.queries is not None:
+            self.queries += other.queries
+        else:
+            self.queries = None
+
+    def summary(self, seconds: float) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "requests_per_second": len(latencies) / seconds if seconds else 0.0,
+            "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p95_ms": 1000 * percentile(latencies, 95),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "queries_per_request": (
+                self.queries / len(latencies) if latencies and self.queries is not None else None
+            ),
+        }
+
+
+class _WsgiClient:
+    """
+    Send requests through Django's WSGI handler in-process, counting the DB queries they make.
+    """
+
+    counts_queries = True
+
+    def __init__(self) -> None:
+        self._client = Client()
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> int:
+        if method == "GET":
+            return self._client.get(path).status_code
+        return self._client.post(path, body, content_type="application/json").status_code
+
+    def close(self) -> None:
+        connection.close()
+
+
+class _HttpClient:
+    """
+    Send requests to a running server over a keep-alive connection.
+    DB queries happen in the server, so they aren't counted.
+    """
+
+    counts_queries = False
+
+    def __init__(self, server: str) -> None:
+        url = urlsplit(server)
+        self._host, self._port = url.hostname, url.port
+        self._prefix = url.path.rstrip("/")
+        self._connection = http.client.HTTPConnection(self._host, self._port)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> int:
+        try:
+            self._connection.request(
+                method,
+                self._prefix + path,
+                body=json.dumps(body) if body is not None else None,
+                headers={"Content-Type": "application/json"},
+            )
+            response = self._connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self._connection.close()
+            self._connection = http.client.HTTPConnection(self._host, self._port)
+            raise
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class LoadGenerator:
+    """
+    Send a mix of redirect and create requests from several threads and measure their latency.
+
+    Every request is planned upfront from a seeded RNG, so runs with the same arguments send
+    the same requests. Redirected short URLs are drawn from a Zipf distribution over `short_urls`.
+
+    Args:
+        short_urls (list[str]): Existing short URLs to redirect, most popular first.
+        requests (int): Total number of requests.
+        concurrency (int): Number of threads sending requests.
+        create_ratio (float): Fraction of requests which create a short URL.
+        zipf_exponent (float): Skew of the short URL popularity, 0 is uniform.
+        server (str, optional): Base URL of a running server, e.g. http://localhost:8000.
+        Defaults to None, which sends requests in-process.
+        seed (int, optional): Seed of the RNG which plans the requests.
+    """
+
+    def __init__(
+        self,
+        short_urls: list[str],
+        requests: int,
+        concurrency: int,
+        create_ratio: float,
+        zipf_exponent: float,
+        server: Optional[str] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        rng = random.Random(seed)
+        sampler = ZipfSampler(len(short_urls), zipf_exponent, rng)
+        create_path = reverse("create")
+        self.plan = [
+            ("create", create_path)
+            if rng.random() < create_ratio
+            else ("redirect", reverse("redirect", args=[short_urls[sampler.sample()]]))
+            for _ in range(requests)
+        ]
+        self.concurrency = concurrency
+        self.server = server
+
+    def run(self) -> dict:
+        planned = iter(self.plan)
+        results: list[dict[str, OperationStats]] = []
+        threads = [
+            threading.Thread(target=self._send_requests, args=(planned, results))
+            for _ in range(self.concurrency)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        stats = {"redirect": OperationStats(), "create": OperationStats()}
+        for thread_stats in results:
+            for operation, operation_stats in thread_stats.items():
+                stats[operation].merge(operation_stats)
+        total = OperationStats()
+        for operation_stats in stats.values():
+            total.merge(operation_stats)
+        return {
+            "seconds": seconds,
+            "total": total.summary(seconds),
+            **{operation: stats[operation].summary(seconds) for operation in stats},
+        }
+
+    def _send_requests(self, planned, results: list) -> None:
+        client = _HttpClient(self.server) if self.server else _WsgiClient()
+        stats = {
+            operation: OperationStats(queries=0 if client.counts_queries else None)
+            for operation in ("redirect", "create")
+        }
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count_query):
+                for operation, path in planned:
+                    operation_stats = stats[operation]
+                    queries = 0
+                    start = time.perf_counter()
+                    try:
+                        if operation == "redirect":
+                            ok = client.request("GET", path) in REDIRECT_STATUSES
+                        else:
+                            ok = client.request("POST", path, {"url": BENCH_URL_PREFIX}) == 201
+                    except (OSError, http.client.HTTPException):
+                        ok = False
+                    operation_stats.latencies.append(time.perf_counter() - start)
+                    operation_stats.errors += not ok
+                    if operation_stats.queries is not None:
+                        operation_stats.queries += queries
+        finally:
+            client.close()
+        results.append(stats)
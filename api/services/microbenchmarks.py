@@ -0,0 +1,308 @@
+"""
+Microbenchmarks of the service layer, each with a budget for the queries and the time of a single
+operation, run by `manage.py bench_service`.
+
+Budgets are those of the default settings, with a local DB: features which trade queries for
+something else (the short URL allocator, buffered hits, a read replica, etc.) change the number
+of queries of some operations. Results are also compared against a baseline saved by an earlier
+run, so an operation which gets slower, or makes more queries, than it used to fails the run even
+while it's within its budget. Timings depend on the host, so the baseline in the repository only
+holds the number of queries.
+"""
+import itertools
+import json
+import platform
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils import timezone
+
+from api.models import Url
+from api.services import sharding, url_service
+from api.services.hit_counters import SyncHitCounter
+from api.services.load_generator import BENCH_URL_PREFIX, percentile
+from api.services.purge_service import ExpiredUrlPurger
+from api.services.url_cache import url_cache
+
+BASELINE_PATH = settings.BASE_DIR / "api" / "microbenchmarks_baseline.json"
+
+# rows removed by every operation of the purge benchmark, in chunks of PURGE_BATCH_SIZE
+PURGE_ROWS = 1000
+PURGE_BATCH_SIZE = 500
+
+# fields of a result saved without its times
+_QUERY_FIELDS = ("name", "operations", "queries_per_operation")
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    """
+    Args:
+        name (str): Name of the benchmark.
+        operation (Callable[[Any], Any]): Runs one operation, given what `prepare` returned.
+        max_queries (int): Maximum number of queries per operation.
+        max_microseconds (float): Maximum median time of an operation.
+        operations (int): Number of operations run.
+        prepare (Callable[[], Any], optional): Prepares an operation, neither timed nor counted.
+    """
+
+    name: str
+    operation: Callable[[Any], Any]
+    max_queries: int
+    max_microseconds: float
+    operations: int
+    prepare: Callable[[], Any] = lambda: None
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    operations: int
+    queries_per_operation: float
+    mean_us: float
+    p50_us: float
+    p99_us: float
+
+
+class _QueryCounter:
+    """
+    An execute wrapper (see `connection.execute_wrapper`) which counts the queries made while
+    it's counting.
+    """
+
+    def __init__(self) -> None:
+        self.counting = False
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.counting:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def _create_urls(amount: int, expires_at=None) -> list[str]:
+    short_urls = []
+    for start in range(0, amount, settings.CREATE_BATCH_MAX_SIZE):
+        batch_size = min(settings.CREATE_BATCH_MAX_SIZE, amount - start)
+        short_urls += url_service.create_short_urls(
+            [f"{BENCH_URL_PREFIX}{i}" for i in range(start, start + batch_size)]
+        )
+    if expires_at is not None:
+        Url.objects.filter(short__in=short_urls).update(expires_at=expires_at)
+    return short_urls
+
+
+def _get_benchmarks(scale: float, checkpoint_dir: str) -> list[Benchmark]:
+    def operations(amount: int) -> int:
+        return max(1, round(amount * scale))
+
+    short_urls = _create_urls(operations(1000))
+    next_short_url = itertools.cycle(short_urls).__next__
+
+    def prepare_uncached() -> str:
+        short_url = next_short_url()
+        url_service.invalidate_cached_urls(short_url)
+        return short_url
+
+    def prepare_cached() -> str:
+        short_url = next_short_url()
+        url_service.get_redirect(short_url)
+        return short_url
+
+    def prepare_purge() -> ExpiredUrlPurger:
+        _create_urls(PURGE_ROWS, expires_at=timezone.now() - timedelta(days=1))
+        return ExpiredUrlPurger(
+            grace_days=0, batch_size=PURGE_BATCH_SIZE, checkpoint_dir=checkpoint_dir
+        )
+
+    hit_counter = SyncHitCounter()
+    return [
+        Benchmark(
+            "generate_short_url",
+            lambda _: url_service._generate_short_url(),
+            max_queries=0,
+            max_microseconds=50,
+            operations=operations(10_000),
+        ),
+        Benchmark(
+            "validate_url",
+            lambda _: url_service._is_url_valid(f"{BENCH_URL_PREFIX}some/path?query=1"),
+            max_queries=0,
+            max_microseconds=100,
+            operations=operations(10_000),
+        ),
+        # a SELECT, and the UPDATE of the hit counter
+        Benchmark(
+            "redirect_lookup",
+            url_service.get_redirect,
+            max_queries=2,
+            max_microseconds=10_000,
+            operations=operations(1000),
+            prepare=prepare_uncached,
+        ),
+        Benchmark(
+            "redirect_lookup_cached",
+            url_service.get_redirect,
+            max_queries=1,
+            max_microseconds=5000,
+            operations=operations(1000),
+            prepare=prepare_cached,
+        ),
+        Benchmark(
+            "hit_increment",
+            hit_counter.record,
+            max_queries=1,
+            max_microseconds=5000,
+            operations=operations(1000),
+            prepare=next_short_url,
+        ),
+        # a DELETE per chunk, and one which finds nothing left to delete
+        Benchmark(
+            f"purge_{PURGE_ROWS}_urls",
+            lambda purger: purger.run(),
+            max_queries=PURGE_ROWS // PURGE_BATCH_SIZE + 1,
+            max_microseconds=500_000,
+            operations=operations(20),
+            prepare=prepare_purge,
+        ),
+    ]
+
+
+def _run(benchmark: Benchmark, counter: _QueryCounter) -> BenchmarkResult:
+    latencies = []
+    counter.queries = 0
+    for _ in range(benchmark.operations):
+        prepared = benchmark.prepare()
+        counter.counting = True
+        start = time.perf_counter()
+        benchmark.operation(prepared)
+        latencies.append(time.perf_counter() - start)
+        counter.counting = False
+    latencies.sort()
+    return BenchmarkResult(
+        name=benchmark.name,
+        operations=benchmark.operations,
+        queries_per_operation=round(counter.queries / benchmark.operations, 3),
+        mean_us=round(statistics.fmean(latencies) * 1_000_000, 1),
+        p50_us=round(percentile(latencies, 50) * 1_000_000, 1),
+        p99_us=round(percentile(latencies, 99) * 1_000_000, 1),
+    )
+
+
+def run_benchmarks(scale: float = 1.0) -> list[tuple[Benchmark, BenchmarkResult]]:
+    """
+    Run every benchmark, with its number of operations scaled by `scale`. The URLs they create
+    are rolled back once they're done.
+    """
+    # the URLs would be created on every shard, outside of the transaction which rolls them back,
+    # and sharded purges run in processes which can't see them
+    if sharding.is_sharded():
+        raise ImproperlyConfigured("The microbenchmarks aren't supported with sharding")
+    counter = _QueryCounter()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        checkpoint_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(transaction.atomic())
+        benchmarks = _get_benchmarks(scale, f"{checkpoint_dir}/purge")
+        try:
+            return [(benchmark, _run(benchmark, counter)) for benchmark in benchmarks]
+        finally:
+            transaction.set_rollback(True)
+            url_cache.clear()
+
+
+def check_results(
+    results: list[tuple[Benchmark, BenchmarkResult]],
+    baseline: Optional[dict[str, dict]],
+    tolerance: float,
+    check_times: bool = True,
+) -> list[str]:
+    """
+    Return a description of every budget the results exceed, and of every regression from the
+    baseline, if any.
+
+    Args:
+        results (list[tuple[Benchmark, BenchmarkResult]]): The results of `run_benchmarks`.
+        baseline (dict[str, dict], optional): Results of an earlier run by name, see
+        `load_baseline`. Benchmarks missing from it are only checked against their budgets, and
+        times missing from it aren't compared.
+        tolerance (float): Fraction by which an operation may get slower than its baseline,
+        to allow for noise.
+        check_times (bool, optional): Whether to check times, or only the number of queries,
+        which doesn't depend on the load of the host. Defaults to True.
+
+    Returns:
+        list[str]: The failures, empty if all benchmarks passed.
+    """
+    failures = []
+    for benchmark, result in results:
+        if result.queries_per_operation > benchmark.max_queries:
+            failures.append(
+                f"{result.name}: {result.queries_per_operation:g} queries per operation, "
+                f"the budget is {benchmark.max_queries}"
+            )
+        if check_times and result.p50_us > benchmark.max_microseconds:
+            failures.append(
+                f"{result.name}: {result.p50_us:.1f}us per operation, "
+                f"the budget is {benchmark.max_microseconds:g}us"
+            )
+        previous = (baseline or {}).get(result.name)
+        if previous is None:
+            continue
+        if result.queries_per_operation > previous["queries_per_operation"]:
+            failures.append(
+                f"{result.name}: {result.queries_per_operation:g} queries per operation, "
+                f"up from {previous['queries_per_operation']:g} in the baseline"
+            )
+        if not check_times or "p50_us" not in previous:
+            continue
+        if result.p50_us > previous["p50_us"] * (1 + tolerance):
+            failures.append(
+                f"{result.name}: {result.p50_us:.1f}us per operation, "
+                f"up from {previous['p50_us']:.1f}us in the baseline"
+            )
+    return failures
+
+
+def save_results(
+    results: list[tuple[Benchmark, BenchmarkResult]], path: str, times: bool = True
+) -> None:
+    """
+    Save the results as JSON, without their times if `times` is False.
+    """
+    saved = {}
+    for _, result in results:
+        saved[result.name] = asdict(result)
+        if not times:
+            saved[result.name] = {field: saved[result.name][field] for field in _QUERY_FIELDS}
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "timestamp": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "results": saved,
+            },
+            file,
+            indent=2,
+        )
+        file.write("\n")
+
+
+def load_baseline(path: str) -> Optional[dict[str, dict]]:
+    """
+    Return the results saved by `save_results` by benchmark name, or None if there are none.
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)["results"]
+    except FileNotFoundError:
+        return None
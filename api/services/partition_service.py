@@ -0,0 +1,195 @@
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+from api.models import Url
+
+TABLE = Url._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+UNIQUE_CONSTRAINT = f"{TABLE}_short_expires_at_uniq"
+
+
+def _quote(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _month_start(when: datetime) -> datetime:
+    return datetime(when.year, when.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return month.replace(year=month.year + year, month=month_index + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def _check_postgresql() -> None:
+    if connection.vendor != "postgresql":
+        raise CommandError("URL table partitioning is only supported for PostgreSQL")
+
+
+def is_partitioned() -> bool:
+    _check_postgresql()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [TABLE])
+        (relkind,) = cursor.fetchone()
+    return relkind == "p"
+
+
+def list_partitions() -> dict[str, datetime]:
+    """
+    Return the monthly partitions of the URL table, by name, with the first month each one holds.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f"{TABLE}_p"
+    return {
+        name: datetime.strptime(name[len(prefix) :], "%Y%m").replace(tzinfo=timezone.utc)
+        for name in names
+        if name != DEFAULT_PARTITION
+    }
+
+
+def convert_to_partitioned(months_ahead: int) -> None:
+    """
+    Rebuild the URL table as a table partitioned by month of `expires_at`, copying all rows.
+
+    URLs which never expire, and those which expire past the last monthly partition, are kept
+    in a default partition. Since Postgres can't enforce uniqueness across partitions, the primary
+    key is replaced by a unique constraint on (short, expires_at) and the service checks for taken
+    short URLs itself while the table is partitioned (see `settings.URL_TABLE_PARTITIONED`).
+
+    The table is locked for the whole conversion, which should be done during a maintenance window.
+    """
+    if is_partitioned():
+        raise CommandError(f"{TABLE} is already partitioned")
+    if settings.URL_INTEGER_KEYS:
+        raise CommandError("URL table partitioning isn't supported with integer URL keys")
+
+    old_table = f"{TABLE}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            "SELECT index.relname, pg_get_indexdef(index.oid) FROM pg_index "
+            "JOIN pg_class index ON index.oid = pg_index.indexrelid "
+            "WHERE pg_index.indrelid = %s::regclass AND NOT pg_index.indisprimary",
+            [TABLE],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(f"SELECT min(expires_at) FROM {_quote(TABLE)}")
+        (first_expiry,) = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} RENAME TO {_quote(old_table)}")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {_quote(name)} RENAME TO {_quote(f'{name}_old')}")
+
+        cursor.execute(
+            f"CREATE TABLE {_quote(TABLE)} "
+            f"(LIKE {_quote(old_table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (expires_at)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {_quote(TABLE)} "
+            f"ADD CONSTRAINT {_quote(UNIQUE_CONSTRAINT)} UNIQUE (short, expires_at)"
+        )
+        for _, definition in indexes:
+            cursor.execute(definition)
+        cursor.execute(
+            f"CREATE TABLE {_quote(DEFAULT_PARTITION)} PARTITION OF {_quote(TABLE)} DEFAULT"
+        )
+
+        now = datetime.now(timezone.utc)
+        month = _month_start(min(first_expiry or now, now))
+        last_month = _add_months(_month_start(now), months_ahead)
+        while month <= last_month:
+            _create_partition(cursor, month)
+            month = _add_months(month, 1)
+
+        cursor.execute(f"INSERT INTO {_quote(TABLE)} SELECT * FROM {_quote(old_table)}")
+        cursor.execute(f"DROP TABLE {_quote(old_table)}")
+
+
+def _create_partition(cursor, month: datetime) -> None:
+    cursor.execute(
+        f"CREATE TABLE {_quote(partition_name(month))} PARTITION OF {_quote(TABLE)} "
+        "FOR VALUES FROM (%s) TO (%s)",
+        [month, _add_months(month, 1)],
+    )
+
+
+def ensure_partitions(months_ahead: int, as_of: Optional[datetime] = None) -> list[str]:
+    """
+    Create the monthly partitions from the current month up to `months_ahead` months ahead.
+
+    Rows which were already written to the default partition for a new month are moved to it,
+    since Postgres won't attach a partition whose rows are still in the default partition.
+
+    Returns:
+        list[str]: The names of the created partitions.
+    """
+    existing = list_partitions()
+    month = _month_start(as_of or datetime.now(timezone.utc))
+    created = []
+    for _ in range(months_ahead + 1):
+        name = partition_name(month)
+        if name not in existing:
+            end = _add_months(month, 1)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE {_quote(name)} "
+                    f"(LIKE {_quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+                cursor.execute(
+                    f"WITH moved AS (DELETE FROM {_quote(DEFAULT_PARTITION)} "
+                    "WHERE expires_at >= %s AND expires_at < %s RETURNING *) "
+                    f"INSERT INTO {_quote(name)} SELECT * FROM moved",
+                    [month, end],
+                )
+                cursor.execute(
+                    f"ALTER TABLE {_quote(TABLE)} ATTACH PARTITION {_quote(name)} "
+                    "FOR VALUES FROM (%s) TO (%s)",
+                    [month, end],
+                )
+            created.append(name)
+        month = _add_months(month, 1)
+    return created
+
+
+def drop_expired_partitions(
+    cutoff: datetime, before_drop: Optional[Callable[[str], None]] = None
+) -> list[str]:
+    """
+    Drop the monthly partitions whose rows all expired before the given cutoff.
+    Unlike deleting the rows, this is a metadata operation which leaves no dead tuples behind.
+
+    Args:
+        cutoff (datetime): Partitions which end before this time are dropped.
+        before_drop (Callable[[str], None], optional): Called with the name of every partition
+        once it's detached, before it's dropped (in the same transaction).
+
+    Returns:
+        list[str]: The names of the dropped partitions.
+    """
+    dropped = []
+    for name, month in sorted(list_partitions().items(), key=lambda item: item[1]):
+        if _add_months(month, 1) > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {_quote(TABLE)} DETACH PARTITION {_quote(name)}")
+            if before_drop is not None:
+                before_drop(name)
+            cursor.execute(f"DROP TABLE {_quote(name)}")
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,171 @@
+"""
+Sampled profiles of single requests, for finding where the time of slow requests goes.
+
+A profiled request runs under cProfile with every SQL query it issues timed, and is written to
+`settings.PROFILING_DIR` as a pstats file and a JSON file of its queries, of which only the
+`settings.PROFILING_MAX_FILES` most recent are kept. `manage.py profile_report` aggregates them.
+Only one request is profiled at a time per process, the requests sampled meanwhile run as usual.
+"""
+import cProfile
+import glob
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Optional, TypeVar
+
+from django.conf import settings
+from django.db import connections
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# header of requests which are always profiled, whose value is `settings.PROFILING_HEADER_TOKEN`
+HEADER = "X-Profile"
+
+_profiler_lock = threading.Lock()
+
+
+@dataclass
+class FunctionStats:
+    function: str
+    calls: int
+    cumulative_seconds: float
+
+
+@dataclass
+class QueryStats:
+    sql: str
+    count: int
+    total_seconds: float
+
+
+class _QueryRecorder:
+    """
+    An execute wrapper (see `connection.execute_wrapper`) which times every query.
+    """
+
+    def __init__(self) -> None:
+        self.queries: list[dict] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # params are left out, they're user data
+            self.queries.append({"sql": sql, "seconds": time.perf_counter() - start})
+
+
+def should_profile(header_token: Optional[str]) -> bool:
+    """
+    Whether to profile a request: any request with the profiling header set to
+    `settings.PROFILING_HEADER_TOKEN`, and a `settings.PROFILING_SAMPLE_RATE` fraction of the rest.
+    """
+    token = settings.PROFILING_HEADER_TOKEN
+    if token and header_token and hmac.compare_digest(header_token, token):
+        return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def profile(name: str, call: Callable[[], T]) -> T:
+    """
+    Return the result of `call`, profiled and written to `settings.PROFILING_DIR` under the given
+    name unless another request of this process is being profiled.
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return call()
+    try:
+        profiler = cProfile.Profile()
+        recorder = _QueryRecorder()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                return call()
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - start
+                try:
+                    _write_profile(name, profiler, recorder.queries, seconds)
+                except OSError:
+                    # profiling must not fail the request
+                    log.exception(f"Failed to write the profile of {name}")
+    finally:
+        _profiler_lock.release()
+
+
+def _write_profile(
+    name: str, profiler: cProfile.Profile, queries: list[dict], seconds: float
+) -> None:
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    # profiles sort by time, which is what they're rotated by
+    slug = re.sub(r"[^0-9A-Za-z]+", "-", name).strip("-")[:80]
+    path = os.path.join(directory, f"{time.time_ns()}-{os.getpid()}-{slug}")
+    profiler.dump_stats(f"{path}.prof")
+    with open(f"{path}.json", "w") as f:
+        json.dump({"name": name, "seconds": seconds, "queries": queries}, f)
+
+    paths = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    for old_path in paths[: max(len(paths) - settings.PROFILING_MAX_FILES, 0)]:
+        for old_file in (old_path, f"{old_path[:-len('.prof')]}.json"):
+            try:
+                os.unlink(old_file)
+            except FileNotFoundError:  # removed by another process
+                pass
+
+
+def load_profiles(directory: str) -> tuple[Optional[pstats.Stats], list[dict]]:
+    """
+    Return the merged stats of the profiles in the given directory, and their JSON records.
+    """
+    stats, records = None, []
+    for path in sorted(glob.glob(os.path.join(directory, "*.prof"))):
+        try:
+            with open(f"{path[:-len('.prof')]}.json") as f:
+                record = json.load(f)
+            if stats is None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+        # rotated away meanwhile, or still being written
+        except (OSError, ValueError, EOFError, TypeError):
+            continue
+        records.append(record)
+    return stats, records
+
+
+def top_functions(stats: pstats.Stats, limit: int) -> list[FunctionStats]:
+    """
+    Return the functions which took the most cumulative time across the profiles.
+    """
+    functions = [
+        FunctionStats(pstats.func_std_string(function), calls, cumulative_seconds)
+        for function, (_, calls, _, cumulative_seconds, _) in stats.stats.items()
+    ]
+    functions.sort(key=lambda function: function.cumulative_seconds, reverse=True)
+    return functions[:limit]
+
+
+def top_queries(records: list[dict], limit: int) -> list[QueryStats]:
+    """
+    Return the SQL statements which took the most time across the profiles.
+    """
+    queries: dict[str, QueryStats] = {}
+    for record in records:
+        for query in record["queries"]:
+            stats = queries.setdefault(query["sql"], QueryStats(query["sql"], 0, 0.0))
+            stats.count += 1
+            stats.total_seconds += query["seconds"]
+    return sorted(queries.values(), key=lambda query: query.total_seconds, reverse=True)[:limit]
@@ -0,0 +1,289 @@
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from api.consts import ALLOWED_CHARACTERS, SHORT_URL_LENGTH
+from api.models import Url, short_url_from_db
+from api.services import partition_service, url_service
+from api.services.archive_service import ARCHIVE_COLUMNS, UrlArchive
+
+log = logging.getLogger(__name__)
+
+KeyRange = tuple[Optional[str], Optional[str]]
+
+
+@dataclass
+class PurgeStats:
+    rows: int
+    seconds: float
+    peak_memory_kb: int
+    partitions_dropped: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def split_key_range(parts: int) -> list[KeyRange]:
+    """
+    Split the short URL space into contiguous ranges, as ordered by the DB.
+
+    The boundaries are single characters sorted by the DB itself, so the ranges follow the
+    collation of the PK index whatever it is, and each range can be walked with an index scan.
+    Integer keys sort like their short URLs do bytewise, with boundaries padded to short URLs.
+    """
+    parts = min(parts, len(ALLOWED_CHARACTERS))
+    if parts <= 1:
+        return [(None, None)]
+    if settings.URL_INTEGER_KEYS:
+        chars = sorted(ALLOWED_CHARACTERS)
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT c FROM (VALUES {', '.join(['(%s)'] * len(ALLOWED_CHARACTERS))}) "
+                "AS chars (c) ORDER BY c",
+                list(ALLOWED_CHARACTERS),
+            )
+            chars = [row[0] for row in cursor.fetchall()]
+    boundaries = [chars[i * len(chars) // parts] for i in range(1, parts)]
+    if settings.URL_INTEGER_KEYS:
+        boundaries = [boundary.ljust(SHORT_URL_LENGTH, chars[0]) for boundary in boundaries]
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+
+class ExpiredUrlPurger:
+    """
+    Delete expired URLs by walking the PK index in bounded chunks.
+
+    Every chunk is a single `DELETE ... RETURNING` of the next `batch_size` expired rows after
+    the last deleted key, so no chunk rescans rows which were already visited (unlike OFFSET).
+    The last deleted key of every range is checkpointed after each chunk, so an interrupted run
+    picks up where it stopped when it's started again with the same checkpoint directory.
+    When the URL table is partitioned, partitions which only hold expired URLs are dropped first.
+    When it's sharded, every shard is purged by its own `workers` processes in parallel.
+
+    Args:
+        grace_days (int): Grace period for expired entries (days).
+        batch_size (int): Maximum number of rows deleted by each statement.
+        checkpoint_dir (str): Directory for checkpoint files, removed once the purge completes.
+        workers (int, optional): Number of processes per shard, each purging its own key range.
+        Defaults to 1.
+        archive_dir (str, optional): Directory to archive every chunk (and dropped partition) to
+        before it's deleted, see `UrlArchive`. Defaults to None, which doesn't archive anything.
+    """
+
+    def __init__(
+        self,
+        grace_days: int,
+        batch_size: int,
+        checkpoint_dir: str,
+        workers: int = 1,
+        archive_dir: Optional[str] = None,
+    ) -> None:
+        self.grace_days = grace_days
+        self.batch_size = batch_size
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = workers
+        self.archive = UrlArchive(archive_dir) if archive_dir else None
+        self.as_of: Optional[datetime] = None
+        self.key_ranges: list[KeyRange] = []
+
+    def run(self) -> PurgeStats:
+        start = time.perf_counter()
+        self._load_or_create_checkpoint()
+        partitions_dropped = 0
+        if settings.URL_TABLE_PARTITIONED:
+            partitions_dropped = len(
+                partition_service.drop_expired_partitions(
+                    url_service.expired_urls_cutoff(self.grace_days, as_of=self.as_of),
+                    before_drop=self._archive_partition if self.archive else None,
+                )
+            )
+        pending = [
+            (i, shard)
+            for shard in settings.DATABASE_SHARDS
+            for i in range(len(self.key_ranges))
+            if not self._read_progress(i, shard)["done"]
+        ]
+        processes = self.workers * len(settings.DATABASE_SHARDS)
+
+        if len(pending) > 1 and processes > 1:
+            # forked processes must not share the parent's DB connections
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(min(processes, len(pending))) as pool:
+                rows = sum(pool.starmap(self.purge_range, pending))
+        else:
+            rows = sum(self.purge_range(i, shard) for i, shard in pending)
+
+        shutil.rmtree(self.checkpoint_dir)
+        return PurgeStats(
+            rows=rows,
+            seconds=time.perf_counter() - start,
+            peak_memory_kb=max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            ),
+            partitions_dropped=partitions_dropped,
+        )
+
+    def purge_range(self, index: int, shard: str = DEFAULT_DB_ALIAS) -> int:
+        lower, upper = self.key_ranges[index]
+        progress = self._read_progress(index, shard)
+        while True:
+            if self.archive is None:
+                deleted = self._delete_chunk(progress["last_key"], lower, upper, using=shard)
+            else:
+                deleted = self._archive_and_delete_chunk(index, progress, lower, upper, shard)
+            if not deleted:
+                break
+            url_service.invalidate_cached_urls(*deleted)
+            progress["last_key"] = deleted[-1]
+            progress["rows"] += len(deleted)
+            self._write_progress(index, progress, shard)
+
+        progress["done"] = True
+        self._write_progress(index, progress, shard)
+        log.info(f"Removed {progress['rows']} expired urls in range {lower} - {upper} of {shard}")
+        return progress["rows"]
+
+    def _expired_urls(
+        self,
+        last_key: Optional[str],
+        lower: Optional[str],
+        upper: Optional[str],
+        using: str = DEFAULT_DB_ALIAS,
+    ) -> QuerySet[Url]:
+        urls = url_service.retrieve_expired_urls(self.grace_days, as_of=self.as_of).using(using)
+        if last_key is not None:
+            urls = urls.filter(short__gt=last_key)
+        if lower is not None:
+            urls = urls.filter(short__gte=lower)
+        if upper is not None:
+            urls = urls.filter(short__lt=upper)
+        return urls.order_by("short")
+
+    def _delete_chunk(
+        self,
+        last_key: Optional[str],
+        lower: Optional[str],
+        upper: Optional[str],
+        using: str = DEFAULT_DB_ALIAS,
+    ) -> list[str]:
+        """
+        Delete the next chunk of expired rows and return their keys, in index order.
+        """
+        urls = self._expired_urls(last_key, lower, upper, using)
+        return self._delete_urls(urls[: self.batch_size])
+
+    def _archive_and_delete_chunk(
+        self,
+        index: int,
+        progress: dict,
+        lower: Optional[str],
+        upper: Optional[str],
+        shard: str = DEFAULT_DB_ALIAS,
+    ) -> list[str]:
+        """
+        Archive the next chunk of expired rows, then delete them in the same transaction.
+
+        The rows are locked while they're archived, so the deletion removes exactly the archived
+        rows. Progress is checkpointed before the deletion commits: if it doesn't, the rows are
+        left for the next purge to archive again, rather than for a rerun to overwrite their file.
+        """
+        urls = self._expired_urls(progress["last_key"], lower, upper, shard)
+        with transaction.atomic(using=shard):
+            chunk = urls.values(*ARCHIVE_COLUMNS)[: self.batch_size].select_for_update()
+            archived = self.archive.write_chunk(
+                f"{self._archive_prefix()}_{shard}_range{index}_{progress.get('chunks', 0):06d}",
+                *chunk.query.sql_with_params(),
+                using=shard,
+            )
+            if archived is None:
+                return []
+            self.archive.record(archived)
+            progress["chunks"] = progress.get("chunks", 0) + 1
+            self._write_progress(
+                index,
+                {
+                    **progress,
+                    "last_key": archived.last_key,
+                    "rows": progress["rows"] + archived.rows,
+                },
+                shard,
+            )
+            return self._delete_urls(urls.filter(short__lte=archived.last_key))
+
+    def _archive_partition(self, table: str) -> None:
+        quote_name = connection.ops.quote_name
+        archived = self.archive.write_chunk(
+            f"{self._archive_prefix()}_{table}",
+            f"SELECT {', '.join(map(quote_name, ARCHIVE_COLUMNS))} FROM {quote_name(table)}",
+            [],
+        )
+        if archived is not None:
+            self.archive.record(archived)
+
+    def _archive_prefix(self) -> str:
+        return f"expired_urls_{self.as_of:%Y%m%dT%H%M%S}"
+
+    def _delete_urls(self, urls: QuerySet[Url]) -> list[str]:
+        sql, params = urls.values("short").query.sql_with_params()
+
+        table = connection.ops.quote_name(Url._meta.db_table)
+        with connections[urls.db].cursor() as cursor:
+            cursor.execute(
+                f"WITH deleted AS (DELETE FROM {table} WHERE short IN ({sql}) RETURNING short) "
+                "SELECT short FROM deleted ORDER BY short",
+                params,
+            )
+            return [short_url_from_db(row[0]) for row in cursor.fetchall()]
+
+    def _load_or_create_checkpoint(self) -> None:
+        meta_path = os.path.join(self.checkpoint_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            log.info(f"Resuming purge from checkpoint in {self.checkpoint_dir}")
+        else:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            meta = {
+                "as_of": timezone.now().isoformat(),
+                "grace_days": self.grace_days,
+                "key_ranges": split_key_range(self.workers),
+            }
+            _write_json_atomically(meta_path, meta)
+        self.as_of = datetime.fromisoformat(meta["as_of"])
+        self.grace_days = meta["grace_days"]
+        self.key_ranges = [tuple(key_range) for key_range in meta["key_ranges"]]
+
+    def _progress_path(self, index: int, shard: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{shard}_range_{index}.json")
+
+    def _read_progress(self, index: int, shard: str = DEFAULT_DB_ALIAS) -> dict:
+        try:
+            with open(self._progress_path(index, shard)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"last_key": None, "rows": 0, "chunks": 0, "done": False}
+
+    def _write_progress(self, index: int, progress: dict, shard: str = DEFAULT_DB_ALIAS) -> None:
+        _write_json_atomically(self._progress_path(index, shard), progress)
+
+
+def _write_json_atomically(path: str, data: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
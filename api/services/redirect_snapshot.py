@@ -0,0 +1,223 @@
+import heapq
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Collate
+
+from api.consts import SHORT_URL_LENGTH
+from api.models import Url
+from api.services.url_cache import CachedUrl
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"MEMESNP1"
+
+# magic, number of URLs
+HEADER = struct.Struct("<8sQ")
+
+# offset into the blob of each URL, followed by the end of the blob
+OFFSET = struct.Struct("<Q")
+URL_BOUNDS = struct.Struct("<QQ")
+
+# expiry of each URL in microseconds since epoch, 0 if it never expires
+EXPIRY = struct.Struct("<q")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# URLs are read from a server-side cursor in chunks of this many rows
+EXPORT_CHUNK_SIZE = 10_000
+
+
+@dataclass
+class SnapshotStats:
+    urls: int
+    size: int
+    seconds: float
+
+
+class RedirectSnapshot:
+    """
+    A read-only, memory-mapped snapshot of the non-expired URLs, which all worker processes on a
+    host map from the same file so the OS keeps a single copy of it in memory.
+
+    The file holds a header, the short URLs sorted bytewise and padded to `SHORT_URL_LENGTH`
+    bytes, the offset of every URL in the blob (plus the blob's end), the expiry of every URL,
+    and the blob of UTF-8 URLs. Lookups binary search the short URLs in place and only decode the
+    URL they find, so opening a snapshot of any size costs nothing.
+
+    Args:
+        path (str): Path of the snapshot file.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a redirect snapshot")
+        self._offsets_start = HEADER.size + self.count * SHORT_URL_LENGTH
+        self._expiries_start = self._offsets_start + (self.count + 1) * OFFSET.size
+        self._blob_start = self._expiries_start + self.count * EXPIRY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get(self, short_url: str) -> Optional[CachedUrl]:
+        key = short_url.encode().ljust(SHORT_URL_LENGTH, b"\0")
+        if len(key) != SHORT_URL_LENGTH:
+            return None
+        snapshot = self._map
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = HEADER.size + middle * SHORT_URL_LENGTH
+            code = snapshot[start : start + SHORT_URL_LENGTH]
+            if code < key:
+                low = middle + 1
+            elif code > key:
+                high = middle
+            else:
+                return self._entry(middle)
+        return None
+
+    def _entry(self, index: int) -> CachedUrl:
+        start, end = URL_BOUNDS.unpack_from(self._map, self._offsets_start + index * OFFSET.size)
+        (expiry,) = EXPIRY.unpack_from(self._map, self._expiries_start + index * EXPIRY.size)
+        long_url = self._map[self._blob_start + start : self._blob_start + end].decode()
+        expires_at = None
+        if expiry:
+            expires_at = EPOCH + timedelta(microseconds=expiry)
+        return CachedUrl(long_url, expires_at)
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def export_snapshot(path: str) -> SnapshotStats:
+    """
+    Write the non-expired URLs of every shard to a new snapshot, and atomically replace the
+    snapshot at the given path with it. Sections are streamed to temporary files next to it,
+    so memory use doesn't depend on the number of URLs.
+    """
+    start_time = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(path))
+    with ExitStack() as stack:
+        codes, offsets, expiries, blob = [
+            stack.enter_context(tempfile.TemporaryFile(dir=directory)) for _ in range(4)
+        ]
+        count = offset = 0
+        for code, long_url, expires_at in _iter_urls():
+            encoded = long_url.encode()
+            codes.write(code)
+            offsets.write(OFFSET.pack(offset))
+            expiries.write(EXPIRY.pack(_microseconds(expires_at)))
+            blob.write(encoded)
+            offset += len(encoded)
+            count += 1
+        offsets.write(OFFSET.pack(offset))
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".redirect-snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as snapshot:
+                snapshot.write(HEADER.pack(MAGIC, count))
+                for section in (codes, offsets, expiries, blob):
+                    section.seek(0)
+                    shutil.copyfileobj(section, snapshot)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+                size = snapshot.tell()
+            os.chmod(temp_path, 0o644)
+            # workers which mapped the previous snapshot keep reading it until they reopen
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return SnapshotStats(urls=count, size=size, seconds=time.perf_counter() - start_time)
+
+
+def _iter_urls() -> Iterator[tuple[bytes, str, Optional[datetime]]]:
+    """
+    Yield the padded short URL, URL and expiry of every non-expired URL of every shard,
+    sorted bytewise by short URL.
+    """
+    now = datetime.now(timezone.utc)
+    shards = [
+        (
+            (short.encode().ljust(SHORT_URL_LENGTH, b"\0"), long_url, expires_at)
+            for short, long_url, expires_at in Url.objects.using(shard)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+            # bytewise order, whatever the DB's collation is, which integer keys sort in as well
+            .order_by("short" if settings.URL_INTEGER_KEYS else Collate("short", "C"))
+            .values_list("short", "long", "expires_at")
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        for shard in settings.DATABASE_SHARDS
+    ]
+    return heapq.merge(*shards, key=lambda row: row[0])
+
+
+def _microseconds(expires_at: Optional[datetime]) -> int:
+    if expires_at is None:
+        return 0
+    return (expires_at - EPOCH) // timedelta(microseconds=1)
+
+
+_snapshot: Optional[RedirectSnapshot] = None
+_next_check = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def get_redirect_snapshot() -> Optional[RedirectSnapshot]:
+    """
+    Return the snapshot at `settings.REDIRECT_SNAPSHOT_PATH`, or None if it's not set or there's
+    no snapshot yet. The path is checked for a new snapshot every
+    `settings.REDIRECT_SNAPSHOT_CHECK_INTERVAL_SECONDS`.
+    """
+    global _snapshot, _next_check
+    if not settings.REDIRECT_SNAPSHOT_PATH:
+        return None
+    now = time.monotonic()
+    if now >= _next_check:
+        with _snapshot_lock:
+            if now >= _next_check:
+                _snapshot = _reopen(settings.REDIRECT_SNAPSHOT_PATH, _snapshot)
+                _next_check = now + settings.REDIRECT_SNAPSHOT_CHECK_INTERVAL_SECONDS
+    return _snapshot
+
+
+def _reopen(path: str, current: Optional[RedirectSnapshot]) -> Optional[RedirectSnapshot]:
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+    if current is not None and current.inode == inode:
+        return current
+    try:
+        # the previous snapshot is unmapped once the lookups still using it are done
+        return RedirectSnapshot(path)
+    except (OSError, ValueError, struct.error):
+        log.exception(f"Failed to open the redirect snapshot at {path}")
+        return current
+
+
+def reset_redirect_snapshot() -> None:
+    """
+    Forget the current snapshot, so the next lookup opens the snapshot at the path again.
+    """
+    global _snapshot, _next_check
+    with _snapshot_lock:
+        _snapshot = None
+        _next_check = 0.0
@@ -0,0 +1,113 @@
+import logging
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from api.models import Url
+from api.services import sharding
+
+log = logging.getLogger(__name__)
+
+URL_COLUMNS = [field.column for field in Url._meta.concrete_fields]
+
+
+@dataclass
+class ReshardStats:
+    scanned: int
+    moved: int
+    conflicts: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.scanned / self.seconds if self.seconds else 0.0
+
+
+class Resharder:
+    """
+    Move URLs which don't belong on their shard anymore to their shard on the current ring,
+    while the service keeps running.
+
+    Every shard is walked along its PK index in chunks of `batch_size` short URLs. The rows of
+    each chunk which belong elsewhere are locked on their old shard, inserted on their new shard,
+    and only deleted from the old shard once the insert committed, so a lookup finds every URL on
+    its new shard or, with `settings.DATABASE_SHARDS_PREVIOUS` set, on its old one. A move which
+    is interrupted between the two commits is completed by the next run.
+
+    A short URL which was meanwhile created on its new shard for another URL can't be moved,
+    and is left on its old shard and counted as a conflict.
+
+    Args:
+        batch_size (int): Number of short URLs scanned per chunk.
+    """
+
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self.ring = sharding.get_ring()
+
+    def run(self) -> ReshardStats:
+        start = time.perf_counter()
+        stats = ReshardStats(scanned=0, moved=0, conflicts=0, seconds=0.0)
+        for shard in settings.DATABASE_SHARDS:
+            self.reshard(shard, stats)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def reshard(self, shard: str, stats: ReshardStats) -> None:
+        urls = Url.objects.using(shard).order_by("short").values_list("short", flat=True)
+        last_key = None
+        while True:
+            chunk = urls.filter(short__gt=last_key) if last_key is not None else urls
+            short_urls = list(chunk[: self.batch_size])
+            if not short_urls:
+                break
+            last_key = short_urls[-1]
+            stats.scanned += len(short_urls)
+            for target, moving in self.ring.group(short_urls).items():
+                if target != shard:
+                    moved, conflicts = self._move(shard, target, moving)
+                    stats.moved += moved
+                    stats.conflicts += conflicts
+        log.info(f"Resharded {shard}: scanned {stats.scanned} URLs, moved {stats.moved} so far")
+
+    def _move(self, source: str, target: str, short_urls: list[str]) -> tuple[int, int]:
+        """
+        Move the given URLs from the source shard to the target shard.
+
+        Returns:
+            tuple[int, int]: The number of moved URLs, and of URLs which couldn't be moved.
+        """
+        quote_name = connections[source].ops.quote_name
+        table = quote_name(Url._meta.db_table)
+        columns = ", ".join(map(quote_name, URL_COLUMNS))
+        with transaction.atomic(using=source), connections[source].cursor() as cursor:
+            cursor.execute(
+                f"SELECT {columns} FROM {table} WHERE short = ANY(%s) FOR UPDATE", [short_urls]
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return 0, 0
+
+            # a row which is already on the target, from an interrupted move, is moved again
+            # keeping the higher hit count, since hits were meanwhile recorded on either shard
+            row_placeholder = f"({', '.join(['%s'] * len(URL_COLUMNS))})"
+            with transaction.atomic(using=target), connections[target].cursor() as target_cursor:
+                target_cursor.execute(
+                    f"INSERT INTO {table} ({columns}) "
+                    f"VALUES {', '.join([row_placeholder] * len(rows))} "
+                    f"ON CONFLICT (short) DO UPDATE SET hits = GREATEST({table}.hits, "
+                    f"EXCLUDED.hits) WHERE {table}.long = EXCLUDED.long "
+                    f"AND {table}.created_at = EXCLUDED.created_at RETURNING short",
+                    [value for row in rows for value in row],
+                )
+                moved = [row[0] for row in target_cursor.fetchall()]
+
+            if len(moved) < len(rows):
+                log.warning(
+                    f"{len(rows) - len(moved)} short URLs on {source} are taken on {target} "
+                    "by other URLs, leaving them on their previous shard"
+                )
+            cursor.execute(f"DELETE FROM {table} WHERE short = ANY(%s)", [moved])
+        return len(moved), len(rows) - len(moved)
@@ -0,0 +1,190 @@
+import csv
+import io
+import multiprocessing
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, connections, transaction
+from django.utils import timezone
+
+from api.consts import SHORT_URL_LENGTH
+from api.models import Url
+from api.services import sharding
+from api.services.load_generator import ZipfSampler
+from api.services.short_url_allocator import get_allocator, reserve_block
+from api.utils import digest_url, encode_base62
+
+SEED_COLUMNS = ["short", "long", "created_at", "time_to_live", "hits", "long_digest", "expires_at"]
+
+# rows are streamed to COPY in buffers of about this many bytes
+STREAM_BUFFER_SIZE = 1 << 16
+
+
+@dataclass
+class SeedStats:
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class _RowStream:
+    """
+    Read-only file-like object which renders rows as CSV only as COPY reads them.
+    """
+
+    def __init__(self, rows: Iterator[tuple]) -> None:
+        self._rows = rows
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while len(self._pending) < max(size, STREAM_BUFFER_SIZE):
+            self._writer.writerows(row for _, row in zip(range(1000), self._rows))
+            rendered = self._buffer.getvalue()
+            if not rendered:
+                break
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._pending += rendered.encode()
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class UrlSeeder:
+    """
+    Insert dummy URLs for capacity testing with `COPY ... FROM STDIN`, in chunks of `chunk_size`.
+
+    Short URLs are taken from blocks of the allocator's sequence and mapped through its
+    permutation, so they never collide with each other or with allocated short URLs, and rows are
+    generated while COPY reads them, so memory use doesn't depend on the amount. A chunk which
+    collides with a randomly generated short URL is copied again into a temporary table and
+    inserted from it, skipping the taken short URLs.
+
+    Args:
+        chunk_size (int): Number of rows copied in each transaction.
+        long_urls (int): Number of distinct long URLs.
+        long_url_zipf (float): Skew of the long URL popularity, 0 is uniform.
+        ttl_days (tuple[int, int]): Range of the uniformly distributed TTLs (days).
+        no_expiry_ratio (float): Fraction of URLs which never expire.
+        workers (int, optional): Number of processes, each copying its own share of the rows.
+        Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int,
+        long_urls: int,
+        long_url_zipf: float,
+        ttl_days: tuple[int, int],
+        no_expiry_ratio: float,
+        workers: int = 1,
+    ) -> None:
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("Seeding URLs with COPY is only supported for PostgreSQL")
+        if sharding.is_sharded():
+            raise ImproperlyConfigured("Seeding URLs isn't supported with sharding")
+        if settings.URL_INTEGER_KEYS:
+            raise ImproperlyConfigured("Seeding URLs isn't supported with integer URL keys")
+        self.chunk_size = chunk_size
+        self.ttl_days = ttl_days
+        self.no_expiry_ratio = no_expiry_ratio
+        self.workers = workers
+        self.created_at: Optional[datetime] = None
+        self._long_urls = [
+            (long_url, digest_url(long_url))
+            for long_url in (f"https://stackoverflow.com/questions/{i}" for i in range(long_urls))
+        ]
+        self._rng = random.Random()
+        self._long_url_sampler = ZipfSampler(long_urls, long_url_zipf, self._rng)
+
+    def run(self, amount: int) -> SeedStats:
+        start = time.perf_counter()
+        self.created_at = timezone.now()
+        shares = [amount // self.workers + (i < amount % self.workers) for i in range(self.workers)]
+        shares = [share for share in shares if share]
+
+        if len(shares) > 1:
+            # forked processes must not share the parent's DB connections
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(len(shares)) as pool:
+                rows = sum(pool.map(self.seed, shares))
+        else:
+            rows = sum(map(self.seed, shares))
+        return SeedStats(rows=rows, seconds=time.perf_counter() - start)
+
+    def seed(self, amount: int) -> int:
+        first, end = reserve_block(amount)
+        rows = 0
+        for chunk_start in range(first, end, self.chunk_size):
+            rows += self._copy_chunk(chunk_start, min(chunk_start + self.chunk_size, end))
+        return rows
+
+    def _copy_chunk(self, start: int, end: int) -> int:
+        table = connection.ops.quote_name(Url._meta.db_table)
+        columns = ", ".join(map(connection.ops.quote_name, SEED_COLUMNS))
+        if not settings.URL_TABLE_PARTITIONED:
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    with connection.wrap_database_errors:
+                        cursor.copy_expert(
+                            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                            _RowStream(self._rows(start, end)),
+                        )
+                    return end - start
+            except IntegrityError:
+                pass
+
+        # the partitioned table can't reject taken short URLs by itself
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE seed_urls (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(
+                f"COPY seed_urls ({columns}) FROM STDIN WITH (FORMAT csv)",
+                _RowStream(self._rows(start, end)),
+            )
+            # a chunk holds too many short URLs to lock each of them like the service does (see
+            # `url_service._lock_short_urls_statement`), so the table is locked against concurrent
+            # inserts (and updates) instead, until the chunk commits
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM seed_urls "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.short = seed_urls.short) "
+                "ON CONFLICT DO NOTHING"
+            )
+            rows = cursor.rowcount
+            # within an outer transaction, the next chunk would run before the commit drops it
+            cursor.execute("DROP TABLE seed_urls")
+            return rows
+
+    def _rows(self, start: int, end: int) -> Iterator[tuple]:
+        """
+        Generate the rows for the given sequence numbers, the same ones every time.
+        """
+        rng = self._rng
+        rng.seed(start)
+        permutation = get_allocator().permutation
+        created_at = self.created_at.isoformat()
+        expiries = {
+            days: (f"{days} days", (self.created_at + timedelta(days=days)).isoformat())
+            for days in range(self.ttl_days[0], self.ttl_days[1] + 1)
+        }
+        for sequence_number in range(start, end):
+            short_url = encode_base62(permutation.permute(sequence_number), SHORT_URL_LENGTH)
+            long_url, long_digest = self._long_urls[self._long_url_sampler.sample()]
+            if rng.random() < self.no_expiry_ratio:
+                time_to_live = expires_at = None
+            else:
+                time_to_live, expires_at = expiries[rng.randint(*self.ttl_days)]
+            yield short_url, long_url, created_at, time_to_live, 0, long_digest, expires_at
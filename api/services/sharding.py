@@ -0,0 +1,96 @@
+import bisect
+import hashlib
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+# points each shard gets on the ring, more points spread short URLs more evenly
+VIRTUAL_NODES = 256
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of short URLs onto DB aliases.
+
+    Every shard is hashed onto `VIRTUAL_NODES` points of a ring, and a short URL belongs to the
+    shard of the first point at or after its own hash. Adding a shard only moves the short URLs
+    which fall just before its points, about 1/N of them, all to the new shard.
+    """
+
+    def __init__(self, shards: Iterable[str]) -> None:
+        self.shards = tuple(shards)
+        points = sorted(
+            (_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(VIRTUAL_NODES)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, short_url: str) -> str:
+        if len(self.shards) == 1:
+            return self.shards[0]
+        index = bisect.bisect_left(self._hashes, _hash(short_url))
+        return self._shards[index % len(self._shards)]
+
+    def group(self, short_urls: Iterable[str]) -> dict[str, list[str]]:
+        groups = defaultdict(list)
+        for short_url in short_urls:
+            groups[self.shard_for(short_url)].append(short_url)
+        return groups
+
+
+@lru_cache
+def _ring(shards: tuple[str, ...]) -> HashRing:
+    if len(shards) > 1 and settings.DATABASE_REPLICAS:
+        raise ImproperlyConfigured("Read replicas aren't supported with sharding")
+    if len(shards) > 1 and settings.URL_TABLE_PARTITIONED:
+        raise ImproperlyConfigured("URL table partitioning isn't supported with sharding")
+    if len(shards) > 1 and settings.URL_INTEGER_KEYS:
+        raise ImproperlyConfigured("Integer URL keys aren't supported with sharding")
+    return HashRing(shards)
+
+
+def get_ring() -> HashRing:
+    """
+    Return the ring of `settings.DATABASE_SHARDS`, where URLs are created and looked up.
+    """
+    return _ring(tuple(settings.DATABASE_SHARDS))
+
+
+def get_previous_ring() -> Optional[HashRing]:
+    """
+    Return the ring from before shards were added while `manage.py reshard` is moving URLs
+    to their new shards, during which URLs which aren't found on their shard are looked up on
+    their previous shard.
+    """
+    if not settings.DATABASE_SHARDS_PREVIOUS:
+        return None
+    return _ring(tuple(settings.DATABASE_SHARDS_PREVIOUS))
+
+
+def shard_for(short_url: str) -> str:
+    return get_ring().shard_for(short_url)
+
+
+def shards_for(short_url: str) -> list[str]:
+    """
+    Return the shard of the given short URL, followed by its previous shard if it was moved.
+    """
+    shard = shard_for(short_url)
+    previous_ring = get_previous_ring()
+    if previous_ring is not None:
+        previous_shard = previous_ring.shard_for(short_url)
+        if previous_shard != shard:
+            return [shard, previous_shard]
+    return [shard]
+
+
+def is_sharded() -> bool:
+    return settings.DATABASE_SHARDS != [DEFAULT_DB_ALIAS]
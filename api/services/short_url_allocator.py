@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from api.consts import ALLOWED_CHARACTERS, SHORT_URL_LENGTH
+from api.errors import AppError
+from api.models import ShortUrlSequence
+from api.services import async_db
+from api.utils import encode_base62
+
+SHORT_URL_SPACE = len(ALLOWED_CHARACTERS) ** SHORT_URL_LENGTH
+DEFAULT_SEQUENCE_NAME = "default"
+
+
+class FeistelPermutation:
+    """
+    A keyed bijection over the integers in [0, domain).
+
+    A balanced Feistel network permutes the smallest even-width bit space which contains
+    the domain, and values which land outside of the domain are permuted again (cycle walking)
+    until they fall back inside it. Without the key, consecutive inputs give outputs which
+    look random.
+
+    Args:
+        domain (int): Size of the permuted range.
+        key (bytes): Secret key for the round function.
+        rounds (int, optional): Number of Feistel rounds. Defaults to 4.
+    """
+
+    def __init__(self, domain: int, key: bytes, rounds: int = 4) -> None:
+        self.domain = domain
+        self.rounds = rounds
+        self._half_bits = max(1, ((domain - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half_bits) - 1
+        self._hash = hashlib.blake2b(key=hashlib.blake2b(key).digest(), digest_size=8)
+
+    def permute(self, value: int) -> int:
+        self._check(value)
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+    def invert(self, value: int) -> int:
+        self._check(value)
+        value = self._decrypt(value)
+        while value >= self.domain:
+            value = self._decrypt(value)
+        return value
+
+    def _check(self, value: int) -> None:
+        if not 0 <= value < self.domain:
+            raise ValueError(f"{value} is out of the permutation's domain")
+
+    def _round(self, i: int, half: int) -> int:
+        h = self._hash.copy()
+        h.update(bytes((i,)) + half.to_bytes(8, "little"))
+        return int.from_bytes(h.digest(), "little") & self._mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self._half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._mask
+        for i in reversed(range(self.rounds)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self._half_bits) | right
+
+
+def reserve_block(size: int, name: str = DEFAULT_SEQUENCE_NAME) -> tuple[int, int]:
+    """
+    Reserve `size` consecutive sequence numbers.
+
+    Note that the reservation is rolled back along with any enclosing transaction,
+    in which case another worker may be handed the same block. Codes are still never
+    duplicated in the DB, but the insert will fail and be retried with another code.
+
+    Returns:
+        tuple[int, int]: The first reserved number and the one past the last.
+    """
+    with transaction.atomic():
+        sequence = ShortUrlSequence.objects.select_for_update().get(name=name)
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=["next_value"])
+
+    if start >= SHORT_URL_SPACE:
+        raise AppError("Short URL space is exhausted")
+    return start, min(start + size, SHORT_URL_SPACE)
+
+
+async def areserve_block(size: int, name: str = DEFAULT_SEQUENCE_NAME) -> tuple[int, int]:
+    """
+    An async version of `reserve_block`, which doesn't take part in any enclosing transaction.
+    """
+    table = connection.ops.quote_name(ShortUrlSequence._meta.db_table)
+    (start,) = await async_db.fetch_one(
+        f"UPDATE {table} SET next_value = next_value + %s WHERE name = %s "
+        "RETURNING next_value - %s",
+        [size, name, size],
+    )
+    if start >= SHORT_URL_SPACE:
+        raise AppError("Short URL space is exhausted")
+    return start, min(start + size, SHORT_URL_SPACE)
+
+
+class BlockAllocator:
+    """
+    Issue short URLs without touching the DB, one per sequence number in a reserved block.
+
+    Sequence numbers are unique across workers, and mapped to short URLs through a keyed
+    permutation, so the issued short URLs never collide with each other and can't be guessed.
+    They might still collide with randomly generated short URLs created before the allocator
+    was enabled, in which case the insert fails and the next short URL is used.
+    """
+
+    def __init__(self, block_size: int, permutation: FeistelPermutation) -> None:
+        self.block_size = block_size
+        self.permutation = permutation
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._discard_block)
+
+    def next_short_url(self) -> str:
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = reserve_block(self.block_size)
+            sequence_number = self._next
+            self._next += 1
+        return encode_base62(self.permutation.permute(sequence_number), SHORT_URL_LENGTH)
+
+    async def anext_short_url(self) -> str:
+        with self._lock:
+            sequence_number = self._take()
+        if sequence_number is None:
+            block = await areserve_block(self.block_size)
+            with self._lock:
+                # another coroutine may have refilled the block meanwhile, in which case
+                # the new block is simply left unused
+                if self._next >= self._end:
+                    self._next, self._end = block
+                sequence_number = self._take()
+        return encode_base62(self.permutation.permute(sequence_number), SHORT_URL_LENGTH)
+
+    def _take(self) -> Optional[int]:
+        if self._next >= self._end:
+            return None
+        self._next += 1
+        return self._next - 1
+
+    def _discard_block(self) -> None:
+        # a forked worker must not issue codes from the block its parent holds
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+
+_allocator: Optional[BlockAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator() -> BlockAllocator:
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = BlockAllocator(
+                    block_size=settings.SHORT_URL_ALLOCATOR_BLOCK_SIZE,
+                    permutation=FeistelPermutation(
+                        domain=SHORT_URL_SPACE,
+                        key=settings.SHORT_URL_ALLOCATOR_KEY.encode(),
+                    ),
+                )
+    return _allocator
@@ -0,0 +1,265 @@
+import atexit
+import hashlib
+import logging
+import math
+import select
+import threading
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from api.models import Url
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "memechose_short_urls"
+
+# short URLs are read from a server-side cursor in chunks of this many rows
+BUILD_CHUNK_SIZE = 10_000
+
+# seconds between checks for notifications and for being stopped
+POLL_INTERVAL = 1.0
+
+# seconds to wait before listening again after the listener failed
+RETRY_DELAY = 5.0
+
+
+class BloomFilter:
+    """
+    A Bloom filter of strings: membership tests can return false positives, at about the given
+    error rate as long as no more than `capacity` strings are added, but never false negatives.
+
+    Positions are derived from a single BLAKE2b digest by double hashing.
+    For 100M short URLs at a 1% error rate the filter takes 114 MiB (7 hashes),
+    at 0.1% it takes 171 MiB (10 hashes).
+
+    Args:
+        capacity (int): Number of strings the filter is sized for.
+        error_rate (float): False positive rate at full capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.bits, self.hashes = self.size_for(capacity, error_rate)
+        self._array = bytearray((self.bits + 7) // 8)
+
+    @staticmethod
+    def size_for(capacity: int, error_rate: float) -> tuple[int, int]:
+        """
+        Returns:
+            tuple[int, int]: The optimal number of bits and hashes for the given capacity
+            and error rate.
+        """
+        bits = math.ceil(-max(capacity, 1) * math.log(error_rate) / math.log(2) ** 2)
+        return bits, max(1, round(bits / max(capacity, 1) * math.log(2)))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._array)
+
+    def _positions(self, value: str) -> Iterable[int]:
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        return ((h1 + i * h2) % bits for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        array = self._array
+        for position in self._positions(value):
+            array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        array = self._array
+        return all(
+            array[position >> 3] & (1 << (position & 7)) for position in self._positions(value)
+        )
+
+
+class ShortUrlFilter:
+    """
+    A per-process Bloom filter of the existing short URLs, so lookups of short URLs which don't
+    exist can be answered without querying the DB.
+
+    The filter is built by a background thread from a streaming scan of the short URLs of every
+    shard, and rebuilt every `rebuild_interval` seconds so purged short URLs stop taking up room.
+    Before scanning, the thread LISTENs on the default DB for the short URLs created by every
+    process, which are NOTIFYed there by the creating transaction. Scans run on a thread (and DB
+    connection) of their own while the listener keeps adding the notified short URLs to both the
+    current filter and the one being built, so neither misses a short URL created meanwhile.
+    Until the filter is built, and whenever the listener fails, every short URL may exist.
+    Rows inserted without notifying, such as seeded ones, are only added by the next rebuild.
+
+    Args:
+        capacity (int): Number of short URLs the filter is sized for.
+        error_rate (float): False positive rate at full capacity.
+        rebuild_interval (float, optional): Seconds between rebuilds. If not provided,
+        the filter is only built once.
+    """
+
+    def __init__(
+        self, capacity: int, error_rate: float, rebuild_interval: Optional[float] = None
+    ) -> None:
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("The short URL filter is only supported for PostgreSQL")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self._filter: Optional[BloomFilter] = None
+        # the filter being built, which short URLs created meanwhile are added to as well
+        self._next: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, short_url: str) -> bool:
+        bloom_filter = self._filter
+        return bloom_filter is None or short_url in bloom_filter
+
+    def add(self, *short_urls: str) -> None:
+        with self._lock:
+            for bloom_filter in (self._filter, self._next):
+                if bloom_filter is not None:
+                    for short_url in short_urls:
+                        bloom_filter.add(short_url)
+
+    def build(self) -> int:
+        """
+        Scan the short URLs into a new filter and replace the current one with it.
+        Short URLs added during the scan are added to the new filter as well.
+
+        Returns:
+            int: The number of scanned short URLs.
+        """
+        bloom_filter = BloomFilter(self.capacity, self.error_rate)
+        with self._lock:
+            self._next = bloom_filter
+        try:
+            rows = 0
+            for shard in settings.DATABASE_SHARDS:
+                short_urls = Url.objects.using(shard).values_list("short", flat=True)
+                for short_url in short_urls.iterator(chunk_size=BUILD_CHUNK_SIZE):
+                    bloom_filter.add(short_url)
+                    rows += 1
+            with self._lock:
+                self._filter = bloom_filter
+        finally:
+            with self._lock:
+                self._next = None
+        if rows > self.capacity:
+            log.warning(
+                f"{rows} short URLs exceed the short URL filter capacity of {self.capacity}, "
+                "raise SHORT_URL_FILTER_CAPACITY to keep the error rate down"
+            )
+        return rows
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="short-url-filter-listener", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                log.exception("Short URL filter listener failed, will rebuild the filter")
+            finally:
+                # notifications may have been missed, so the filter can't be trusted anymore
+                with self._lock:
+                    self._filter = None
+                connection.close()
+            self._stopped.wait(RETRY_DELAY)
+
+    def _listen(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        listener = connection.connection
+        while not self._stopped.is_set():
+            self._rebuild(listener)
+            waited = 0.0
+            while not self._stopped.is_set() and (
+                self.rebuild_interval is None or waited < self.rebuild_interval
+            ):
+                self._add_notified(listener)
+                waited += POLL_INTERVAL
+
+    def _rebuild(self, listener) -> None:
+        """
+        Build the filter on a thread of its own while this one keeps adding the short URLs
+        notified meanwhile, since a scan of many short URLs takes minutes.
+        """
+        errors = []
+
+        def build() -> None:
+            try:
+                self.build()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        builder = threading.Thread(target=build, name="short-url-filter-builder", daemon=True)
+        builder.start()
+        while builder.is_alive() and not self._stopped.is_set():
+            self._add_notified(listener)
+        if errors:
+            raise errors[0]
+
+    def _add_notified(self, listener) -> None:
+        """
+        Wait up to `POLL_INTERVAL` for notifications, and add the notified short URLs.
+        """
+        select.select([listener], [], [], POLL_INTERVAL)
+        listener.poll()
+        notified = [notification.payload for notification in listener.notifies]
+        listener.notifies.clear()
+        self.add(*notified)
+
+
+def notify_statement(short_urls: list[str]) -> tuple[str, list]:
+    """
+    Notify the filters of all processes of the given new short URLs, once the current
+    transaction commits.
+    """
+    return "SELECT pg_notify(%s, short) FROM unnest(%s::text[]) AS short", [
+        NOTIFY_CHANNEL,
+        short_urls,
+    ]
+
+
+_short_url_filter = None
+_short_url_filter_lock = threading.Lock()
+
+
+def get_short_url_filter() -> Optional[ShortUrlFilter]:
+    """
+    Return this process' short URL filter, creating and starting it on first use,
+    or None if `settings.SHORT_URL_FILTER_ENABLED` is off.
+    """
+    global _short_url_filter
+    if not settings.SHORT_URL_FILTER_ENABLED:
+        return None
+    if _short_url_filter is None:
+        with _short_url_filter_lock:
+            if _short_url_filter is None:
+                short_url_filter = ShortUrlFilter(
+                    capacity=settings.SHORT_URL_FILTER_CAPACITY,
+                    error_rate=settings.SHORT_URL_FILTER_ERROR_RATE,
+                    rebuild_interval=settings.SHORT_URL_FILTER_REBUILD_INTERVAL_SECONDS or None,
+                )
+                short_url_filter.start()
+                atexit.register(short_url_filter.close)
+                _short_url_filter = short_url_filter
+    return _short_url_filter
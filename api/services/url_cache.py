@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+from django.conf import settings
+
+
+class CachedUrl(NamedTuple):
+    long: str
+    expires_at: Optional[datetime]
+
+
+class UrlCache:
+    """
+    A bounded, per-process LRU cache of short URL -> (long URL, expiry).
+
+    Entries are dropped as soon as their URL expires, so a cached entry never outlives the
+    DB row it was read from. Since every worker holds its own copy, edits made through another
+    process are only picked up once the entry is evicted; `max_age` bounds that staleness.
+    """
+
+    def __init__(self, size: int, max_age: Optional[float] = None) -> None:
+        self.size = size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[CachedUrl, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, short_url: str) -> Optional[CachedUrl]:
+        with self._lock:
+            item = self._entries.get(short_url)
+            if item is None:
+                self.misses += 1
+                return None
+            entry, evict_at = item
+            if evict_at <= time.time():
+                del self._entries[short_url]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(short_url)
+            self.hits += 1
+            return entry
+
+    def put(self, short_url: str, long_url: str, expires_at: Optional[datetime]) -> None:
+        if self.size <= 0:
+            return
+        evict_at = expires_at.timestamp() if expires_at is not None else float("inf")
+        if self.max_age is not None:
+            evict_at = min(evict_at, time.time() + self.max_age)
+        with self._lock:
+            self._entries[short_url] = (CachedUrl(long_url, expires_at), evict_at)
+            self._entries.move_to_end(short_url)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, short_urls: Iterable[str]) -> None:
+        with self._lock:
+            for short_url in short_urls:
+                if self._entries.pop(short_url, None) is not None:
+                    self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+url_cache = UrlCache(
+    size=settings.URL_CACHE_SIZE,
+    max_age=settings.URL_CACHE_MAX_AGE_SECONDS or None,
+)
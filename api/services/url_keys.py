@@ -0,0 +1,109 @@
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+from api.consts import SHORT_URL_LENGTH
+from api.models import Url
+from api.services import partition_service
+from api.utils import KEY_CHARACTERS
+
+TABLE = Url._meta.db_table
+
+
+def _quote(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _like_index_name() -> str:
+    # the name Django gave the index for LIKE queries on the text column
+    with connection.schema_editor() as schema_editor:
+        return schema_editor._create_index_name(TABLE, ["short"], suffix="_like")
+
+
+def _check_postgresql() -> None:
+    if connection.vendor != "postgresql":
+        raise CommandError("Integer URL keys are only supported for PostgreSQL")
+
+
+def has_integer_keys() -> bool:
+    _check_postgresql()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = %s AND column_name = 'short'",
+            [TABLE],
+        )
+        (data_type,) = cursor.fetchone()
+    return data_type == "bigint"
+
+
+def integer_key_sql(column: str) -> str:
+    """
+    SQL computing the integer key of the short URLs in the given text column.
+    """
+    return " + ".join(
+        f"(strpos('{KEY_CHARACTERS}', substr({column}, {position}, 1)) - 1)::bigint "
+        f"* {len(KEY_CHARACTERS) ** (SHORT_URL_LENGTH - position)}"
+        for position in range(1, SHORT_URL_LENGTH + 1)
+    )
+
+
+def short_url_sql(column: str) -> str:
+    """
+    SQL computing the short URLs of the integer keys in the given column.
+    """
+    base = len(KEY_CHARACTERS)
+    return " || ".join(
+        f"substr('{KEY_CHARACTERS}', "
+        f"({column} / {base ** (SHORT_URL_LENGTH - position)} % {base} + 1)::integer, 1)"
+        for position in range(1, SHORT_URL_LENGTH + 1)
+    )
+
+
+def convert_to_integer_keys() -> None:
+    """
+    Convert the short URL column to the integers the short URLs decode to (see
+    `api.utils.decode_short_url_key`), in place. The primary key index then compares integers
+    rather than collated text, and the LIKE index, which integers don't need, is dropped.
+
+    The table is rewritten and locked for the whole conversion, which should be done during a
+    maintenance window.
+    """
+    if has_integer_keys():
+        raise CommandError(f"{TABLE} already has integer keys")
+    if partition_service.is_partitioned():
+        raise CommandError("Integer URL keys aren't supported with URL table partitioning")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            f"SELECT short FROM {_quote(TABLE)} WHERE short !~ %s LIMIT 1",
+            [f"^[{KEY_CHARACTERS}]{{{SHORT_URL_LENGTH}}}$"],
+        )
+        invalid = cursor.fetchone()
+        if invalid is not None:
+            raise CommandError(f"{invalid[0]!r} is not a valid short URL, it can't be converted")
+        cursor.execute(f"DROP INDEX IF EXISTS {_quote(_like_index_name())}")
+        cursor.execute(
+            f"ALTER TABLE {_quote(TABLE)} "
+            f"ALTER COLUMN short TYPE bigint USING {integer_key_sql('short')}"
+        )
+
+
+def revert_to_text_keys() -> None:
+    """
+    Convert integer keys back to short URLs, and restore the LIKE index.
+    The table is rewritten and locked for the whole conversion, like `convert_to_integer_keys`.
+    """
+    if not has_integer_keys():
+        raise CommandError(f"{TABLE} doesn't have integer keys")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            f"ALTER TABLE {_quote(TABLE)} "
+            f"ALTER COLUMN short TYPE varchar({SHORT_URL_LENGTH}) USING {short_url_sql('short')}"
+        )
+        cursor.execute(
+            f"CREATE INDEX {_quote(_like_index_name())} "
+            f"ON {_quote(TABLE)} (short varchar_pattern_ops)"
+        )
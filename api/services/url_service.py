@@ -1,73 +1,525 @@
+import hashlib
 import random
-from datetime import timedelta
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Iterable, Optional, Union
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import F, QuerySet
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    IntegrityError,
+    connection,
+    connections,
+    transaction,
+)
+from django.db.models import QuerySet
 from django.utils import timezone
 
 from api.consts import ALLOWED_CHARACTERS, MAX_RETRIES_FOR_URL_CLASH, SHORT_URL_LENGTH
 from api.decorators import retry
 from api.errors import AppError, ExpiredUrl, InvalidUrl, ShortUrlTaken, UrlNotFound
-from api.models import Url
+from api.models import Url, short_url_from_db
+from api.services import metrics, sharding
+from api.services.hit_counters import get_hit_counter
+from api.services.short_url_allocator import get_allocator
+from api.services.url_cache import CachedUrl, url_cache
+from api.utils import digest_url, normalize_url
+
+if TYPE_CHECKING:
+    from api.services.group_commit import CreateBatcher
+    from api.services.hit_rollups import HitRollups
+    from api.services.redirect_snapshot import RedirectSnapshot
+    from api.services.short_url_filter import ShortUrlFilter
+
+SHORT_URL_GENERATION_ERROR = "Error generating short URL, please try again momentarily"
+
+_url_validator = URLValidator()
+_LONG_URL_MAX_LENGTH = Url._meta.get_field("long").max_length
+
+
+# Optional features are imported on first use, so workers which don't enable them, e.g. those of
+# the lean profile (see `memechose.settings_lean`), don't import them.
+
+
+def get_redirect_snapshot() -> Optional["RedirectSnapshot"]:
+    if not settings.REDIRECT_SNAPSHOT_PATH:
+        return None
+    from api.services import redirect_snapshot
+
+    return redirect_snapshot.get_redirect_snapshot()
+
+
+def get_short_url_filter() -> Optional["ShortUrlFilter"]:
+    if not settings.SHORT_URL_FILTER_ENABLED:
+        return None
+    from api.services import short_url_filter
+
+    return short_url_filter.get_short_url_filter()
+
+
+def get_hit_rollups() -> Optional["HitRollups"]:
+    if not settings.HIT_ROLLUPS_ENABLED:
+        return None
+    from api.services import hit_rollups
+
+    return hit_rollups.get_hit_rollups()
 
 
 def _generate_short_url() -> str:
+    if settings.SHORT_URL_ALLOCATOR_ENABLED:
+        return get_allocator().next_short_url()
+    short_url = _generate_random_short_url()
+    short_url_filter = get_short_url_filter()
+    if short_url_filter is not None:
+        # skip short URLs which are probably taken, a false positive only skips a free one
+        for _ in range(MAX_RETRIES_FOR_URL_CLASH):
+            if not short_url_filter.might_exist(short_url):
+                break
+            short_url = _generate_random_short_url()
+    return short_url
+
+
+def _generate_random_short_url() -> str:
     return "".join(random.choice(ALLOWED_CHARACTERS) for _ in range(SHORT_URL_LENGTH))
 
 
+def _lookup_dbs(short_url: str) -> list[str]:
+    """
+    Return the DBs to look the given short URL up in, in order.
+    """
+    shards = sharding.shards_for(short_url)
+    if shards != [DEFAULT_DB_ALIAS]:
+        # while resharding, a URL may not have been moved to its new shard yet
+        return shards
+    # reads inside a transaction on the primary may need to see its own writes
+    if not settings.DATABASE_REPLICAS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return [DEFAULT_DB_ALIAS]
+    # replicas lag behind the primary, so a URL which was just created may only be on the primary
+    return [random.choice(settings.DATABASE_REPLICAS), DEFAULT_DB_ALIAS]
+
+
 def _get_url_entry_from_short_url(short_url: str) -> Url:
-    try:
-        return Url.objects.get(pk=short_url)
-    except Url.DoesNotExist as e:
-        raise UrlNotFound(short_url) from e
+    for db in _lookup_dbs(short_url):
+        try:
+            return Url.objects.using(db).get(pk=short_url)
+        except Url.DoesNotExist:
+            pass
+    raise UrlNotFound(short_url)
 
 
-def get_redirect_url(short_url: str) -> str:
-    url = _get_url_entry_from_short_url(short_url)
+def get_redirect(short_url: str) -> CachedUrl:
+    """
+    Return the URL and expiry of the given short URL, and record a hit.
+    """
+    cached = url_cache.get(short_url)
+    if cached is not None:
+        metrics.REDIRECTS.labels("cached").inc()
+        _record_hit(short_url)
+        return cached
+
+    snapshot = get_redirect_snapshot()
+    if snapshot is not None:
+        snapshotted = snapshot.get(short_url)
+        if snapshotted is not None:
+            if snapshotted.expires_at is not None and snapshotted.expires_at <= timezone.now():
+                metrics.REDIRECTS.labels("expired").inc()
+                raise ExpiredUrl(short_url)
+            metrics.REDIRECTS.labels("snapshot").inc()
+            _record_hit(short_url)
+            return snapshotted
+
+    short_url_filter = get_short_url_filter()
+    if short_url_filter is not None and not short_url_filter.might_exist(short_url):
+        metrics.REDIRECTS.labels("filtered").inc()
+        raise UrlNotFound(short_url)
+    try:
+        with metrics.REDIRECT_STAGE_SECONDS.labels("db_lookup").time():
+            url = _get_url_entry_from_short_url(short_url)
+    except UrlNotFound:
+        metrics.REDIRECTS.labels("not_found").inc()
+        raise
     if url.is_expired():
+        metrics.REDIRECTS.labels("expired").inc()
         raise ExpiredUrl(url.short)
-    url.increment_hits()
-    return url.long
+    metrics.REDIRECTS.labels("found").inc()
+    url_cache.put(url.short, url.long, url.expires_at)
+    _record_hit(url.short)
+    return CachedUrl(url.long, url.expires_at)
 
 
-def get_or_create_short_url(long_url: str) -> str:
+def get_redirect_url(short_url: str) -> str:
+    return get_redirect(short_url).long
+
+
+def get_redirect_max_age(redirect: CachedUrl) -> int:
+    """
+    Return the number of seconds the redirect may be cached for by clients,
+    which never outlasts the URL.
+    """
+    max_age = settings.REDIRECT_CACHE_MAX_AGE_SECONDS
+    if redirect.expires_at is not None:
+        max_age = min(max_age, int((redirect.expires_at - timezone.now()).total_seconds()))
+    return max(max_age, 0)
+
+
+def get_redirect_etag(redirect: CachedUrl) -> str:
+    """
+    Return an ETag which changes whenever the URL or expiry of the redirect change.
+    """
+    expires_at = redirect.expires_at.isoformat() if redirect.expires_at else ""
+    digest = hashlib.blake2b(f"{redirect.long} {expires_at}".encode(), digest_size=8)
+    return f'"{digest.hexdigest()}"'
+
+
+def _record_hit(short_url: str) -> None:
+    with metrics.REDIRECT_STAGE_SECONDS.labels("record_hit").time():
+        get_hit_counter().record(short_url)
+        hit_rollups = get_hit_rollups()
+        if hit_rollups is not None:
+            hit_rollups.record(short_url)
+
+
+def invalidate_cached_urls(*short_urls: str) -> None:
+    url_cache.invalidate(short_urls)
+
+
+def get_or_create_short_url(long_url: str, deduplicate: Optional[bool] = None) -> str:
+    """
+    Create a short URL for the given URL.
+
+    Args:
+        long_url (str): The URL to shorten.
+        deduplicate (bool, optional): Return the short URL of an existing, non-expired entry for
+        the same URL instead of creating a new one. Defaults to `settings.DEDUPLICATE_URLS`.
+    """
     if not _is_url_valid(long_url):
+        metrics.CREATES.labels("invalid").inc()
         raise InvalidUrl(long_url)
-    return _create_url_entry_with_retry(long_url).short
+    if deduplicate is None:
+        deduplicate = settings.DEDUPLICATE_URLS
+    if not deduplicate:
+        return _create_short_url(long_url)
+
+    with transaction.atomic():
+        with metrics.CREATE_STAGE_SECONDS.labels("deduplicate").time():
+            _lock_long_url(long_url)
+            existing_short_url = _get_existing_short_url(long_url)
+        if existing_short_url:
+            metrics.CREATES.labels("deduplicated").inc()
+            return existing_short_url
+        return _create_short_url(long_url)
+
+
+def _create_short_url(long_url: str) -> str:
+    create_batcher = get_create_batcher()
+    # a batch is committed by the thread leading it, so creates within a transaction stay in it
+    if create_batcher is not None and not connection.in_atomic_block:
+        # outcomes are counted by `create_short_urls`
+        with metrics.CREATE_STAGE_SECONDS.labels("insert").time():
+            return create_batcher.create(long_url)
+
+    try:
+        with metrics.CREATE_STAGE_SECONDS.labels("insert").time():
+            short_url = _create_url_entry_with_retry(long_url).short
+    except AppError:
+        metrics.CREATES.labels("failed").inc()
+        raise
+    metrics.CREATES.labels("created").inc()
+    _publish_created_short_urls([short_url])
+    return short_url
+
+
+def _publish_created_short_urls(short_urls: list[str]) -> None:
+    """
+    Add new short URLs to the short URL filter of this process, and of the others once the
+    current transaction commits.
+    """
+    short_url_filter = get_short_url_filter()
+    if short_url_filter is None or not short_urls:
+        return
+    from api.services.short_url_filter import notify_statement
+
+    short_url_filter.add(*short_urls)
+    with connection.cursor() as cursor:
+        cursor.execute(*notify_statement(short_urls))
+
+
+_create_batcher = None
+_create_batcher_lock = threading.Lock()
+
+
+def get_create_batcher() -> Optional["CreateBatcher"]:
+    """
+    Return this process' batcher of concurrent creates, creating it on first use,
+    or None if `settings.CREATE_GROUP_COMMIT_ENABLED` is off.
+    """
+    global _create_batcher
+    if not settings.CREATE_GROUP_COMMIT_ENABLED:
+        return None
+    if _create_batcher is None:
+        with _create_batcher_lock:
+            if _create_batcher is None:
+                from api.services.group_commit import CreateBatcher
+
+                _create_batcher = CreateBatcher(
+                    create_short_urls,
+                    window_seconds=settings.CREATE_GROUP_COMMIT_WINDOW_SECONDS,
+                    max_batch_size=settings.CREATE_GROUP_COMMIT_MAX_BATCH_SIZE,
+                )
+    return _create_batcher
+
+
+def _get_existing_short_url(long_url: str) -> Optional[str]:
+    normalized_url = normalize_url(long_url)
+    now = timezone.now()
+    for shard in settings.DATABASE_SHARDS:
+        for url in Url.objects.using(shard).filter(long_digest=digest_url(long_url)):
+            if not url.is_expired(as_of=now) and normalize_url(url.long) == normalized_url:
+                return url.short
+    return None
+
+
+def _lock_long_url(long_url: str) -> None:
+    """
+    Serialize concurrent creation of the same URL until the end of the current transaction.
+    Other backends don't need this since they don't allow concurrent writes anyway.
+    """
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [_long_url_lock_id(long_url)])
+
+
+def _long_url_lock_id(long_url: str) -> int:
+    return int.from_bytes(bytes.fromhex(digest_url(long_url)[:16]), "big", signed=True)
+
+
+def create_short_urls(long_urls: list[str]) -> list[Union[str, AppError]]:
+    """
+    Create short URLs for many long URLs at once.
+
+    All valid URLs are inserted with a single multi-row statement, and only the ones whose
+    short URL was already taken are retried with new short URLs.
+
+    Args:
+        long_urls (list[str]): The URLs to shorten.
+
+    Returns:
+        list[Union[str, AppError]]: The short URL, or the error which prevented creating it,
+        for each of the given URLs in the same order.
+    """
+    results: list[Union[str, AppError]] = [None] * len(long_urls)
+    pending = {}
+    for i, long_url in enumerate(long_urls):
+        if _is_url_valid(long_url):
+            pending[i] = long_url
+        else:
+            metrics.CREATES.labels("invalid").inc()
+            results[i] = InvalidUrl(long_url)
+
+    for _ in range(MAX_RETRIES_FOR_URL_CLASH):
+        if not pending:
+            break
+        entries = dict(zip(pending, _generate_unique_short_urls(len(pending))))
+        taken = _taken_on_previous_shards(list(entries.values()))
+        created = _insert_ignoring_conflicts(
+            Url(short=short_url, long=pending[i])
+            for i, short_url in entries.items()
+            if short_url not in taken
+        )
+        for i, short_url in entries.items():
+            if short_url in created:
+                results[i] = short_url
+                del pending[i]
+        metrics.CREATES.labels("created").inc(len(created))
+        _publish_created_short_urls(list(created))
+        if pending:
+            metrics.SHORT_URL_COLLISIONS.inc(len(pending))
+
+    for i in pending:
+        results[i] = AppError(SHORT_URL_GENERATION_ERROR)
+    metrics.CREATES.labels("failed").inc(len(pending))
+    return results
+
+
+def is_short_url_taken(short_url: str) -> bool:
+    """
+    Return whether a URL, expired or not, has the given short URL, on its shard or, while
+    resharding, on its previous shard.
+    """
+    return any(
+        Url.objects.using(shard).filter(short=short_url).exists()
+        for shard in sharding.shards_for(short_url)
+    )
+
+
+def insert_url(url: Url) -> None:
+    """
+    Insert a URL created outside of the service, e.g. in the admin, checking that its short URL
+    isn't taken like the service's own inserts do: the partitioned table can't reject it by itself.
+
+    Raises:
+        ShortUrlTaken: If the short URL is taken.
+    """
+    if not _insert_ignoring_conflicts([url]):
+        raise ShortUrlTaken(f"The short URL {url.short} is taken")
+    url._state.adding = False
+    _publish_created_short_urls([url.short])
+
+
+def _generate_unique_short_urls(amount: int) -> list[str]:
+    short_urls = set()
+    while len(short_urls) < amount:
+        short_urls.add(_generate_short_url())
+    return list(short_urls)
+
+
+def _taken_on_previous_shards(short_urls: list[str]) -> set[str]:
+    """
+    Return the given short URLs which exist on their previous shard. While resharding, a short URL
+    which wasn't moved yet is still taken although its new shard doesn't have it. It's checked
+    before inserting on the new shard, which the resharder moves URLs to before deleting them.
+    """
+    if sharding.get_previous_ring() is None:
+        return set()
+    by_previous_shard: dict[str, list[str]] = {}
+    for short_url in short_urls:
+        shards = sharding.shards_for(short_url)
+        if len(shards) > 1:
+            by_previous_shard.setdefault(shards[1], []).append(short_url)
+    taken = set()
+    for shard, shard_short_urls in by_previous_shard.items():
+        taken.update(
+            Url.objects.using(shard)
+            .filter(short__in=shard_short_urls)
+            .values_list("short", flat=True)
+        )
+    return taken
+
+
+def _insert_ignoring_conflicts(entries: Iterable[Url]) -> set[str]:
+    """
+    Insert the given entries with a single statement per shard, skipping those whose short URL
+    is taken.
+
+    Returns:
+        set[str]: The short URLs which were inserted.
+    """
+    by_shard: dict[str, list[Url]] = {}
+    for entry in entries:
+        by_shard.setdefault(sharding.shard_for(entry.short), []).append(entry)
+
+    inserted = set()
+    for shard, shard_entries in by_shard.items():
+        if settings.URL_TABLE_PARTITIONED:
+            with transaction.atomic(using=shard), connections[shard].cursor() as cursor:
+                cursor.execute(
+                    *_lock_short_urls_statement([entry.short for entry in shard_entries])
+                )
+                cursor.execute(*_insert_ignoring_conflicts_statement(shard_entries))
+                inserted.update(short_url_from_db(row[0]) for row in cursor.fetchall())
+            continue
+
+        with connections[shard].cursor() as cursor:
+            cursor.execute(*_insert_ignoring_conflicts_statement(shard_entries))
+            inserted.update(short_url_from_db(row[0]) for row in cursor.fetchall())
+    return inserted
+
+
+def _insert_ignoring_conflicts_statement(entries: list[Url]) -> tuple[str, list]:
+    fields = Url._meta.concrete_fields
+    quote_name = connection.ops.quote_name
+    table = quote_name(Url._meta.db_table)
+    pk_column = quote_name(Url._meta.pk.column)
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    params = [
+        field.get_db_prep_save(field.pre_save(entry, True), connection)
+        for entry in entries
+        for field in fields
+    ]
+    if not settings.URL_TABLE_PARTITIONED:
+        row_placeholder = f"({', '.join(['%s'] * len(fields))})"
+        return (
+            f"INSERT INTO {table} ({columns}) "
+            f"VALUES {', '.join([row_placeholder] * len(entries))} "
+            f"ON CONFLICT DO NOTHING RETURNING {pk_column}",
+            params,
+        )
+
+    # a partitioned table can only enforce uniqueness of (short, expires_at), so short URLs which
+    # are taken are skipped explicitly, under the locks from `_lock_short_urls_statement`
+    row_placeholder = f"({', '.join(f'%s::{field.db_type(connection)}' for field in fields)})"
+    return (
+        f"INSERT INTO {table} ({columns}) SELECT * FROM "
+        f"(VALUES {', '.join([row_placeholder] * len(entries))}) AS new_urls ({columns}) "
+        f"WHERE NOT EXISTS "
+        f"(SELECT 1 FROM {table} WHERE {table}.{pk_column} = new_urls.{pk_column}) "
+        f"ON CONFLICT DO NOTHING RETURNING {pk_column}",
+        params,
+    )
+
+
+def _lock_short_urls_statement(short_urls: list[str]) -> tuple[str, list]:
+    """
+    Lock the given short URLs until the end of the current transaction, in a consistent order
+    so concurrent inserts can't deadlock.
+    """
+    return (
+        "SELECT pg_advisory_xact_lock(lock_id) FROM "
+        "(SELECT DISTINCT hashtext(short) AS lock_id FROM unnest(%s::text[]) AS short "
+        "ORDER BY lock_id) AS lock_ids",
+        [short_urls],
+    )
 
 
 @retry(
     to_catch=ShortUrlTaken,
     to_raise=AppError,
-    error_message="Error generating short URL, please try again momentarily",
+    error_message=SHORT_URL_GENERATION_ERROR,
     retries=MAX_RETRIES_FOR_URL_CLASH,
 )
 def _create_url_entry_with_retry(long_url: str) -> Url:
+    if settings.URL_TABLE_PARTITIONED:
+        entry = Url(short=_generate_short_url(), long=long_url)
+        if not _insert_ignoring_conflicts([entry]):
+            metrics.SHORT_URL_COLLISIONS.inc()
+            raise ShortUrlTaken()
+        return entry
+
+    short_url = _generate_short_url()
+    if _taken_on_previous_shards([short_url]):
+        metrics.SHORT_URL_COLLISIONS.inc()
+        raise ShortUrlTaken()
+    shard = sharding.shard_for(short_url)
     try:
-        return Url.objects.create(
-            short=_generate_short_url(),
-            long=long_url,
-        )
+        with transaction.atomic(using=shard):
+            return Url.objects.using(shard).create(
+                short=short_url,
+                long=long_url,
+            )
     except IntegrityError:
+        metrics.SHORT_URL_COLLISIONS.inc()
         raise ShortUrlTaken()
 
 
 def _is_url_valid(url: str) -> bool:
-    try:
-        URLValidator()(url)
-        return True
-    except ValidationError:
-        return False
+    with metrics.CREATE_STAGE_SECONDS.labels("validate").time():
+        # URLValidator accepts URLs longer than the column holds
+        if not isinstance(url, str) or len(url) > _LONG_URL_MAX_LENGTH:
+            return False
+        try:
+            _url_validator(url)
+            return True
+        except ValidationError:
+            return False
 
 
-def retrieve_expired_urls(grace_days: int) -> QuerySet[Url]:
-    cutoff_time = timezone.now() + timedelta(days=grace_days)
-    return (
-        Url.objects.exclude(time_to_live__isnull=True)
-        .annotate(expiry_time=F("time_to_live") + F("created_at"))
-        .filter(expiry_time__lt=cutoff_time)
-        .order_by("created_at")
-        .only("short")
-    )
+def expired_urls_cutoff(grace_days: int, as_of: Optional[datetime] = None) -> datetime:
+    return (as_of or timezone.now()) + timedelta(days=grace_days)
+
+
+def retrieve_expired_urls(grace_days: int, as_of: Optional[datetime] = None) -> QuerySet[Url]:
+    cutoff_time = expired_urls_cutoff(grace_days, as_of)
+    return Url.objects.filter(expires_at__lt=cutoff_time).order_by("expires_at").only("short")
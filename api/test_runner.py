@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Also migrate the URL table on `settings.DATABASE_TEST_SHARDS` (see `memechose.settings_test`),
+    which only the sharding tests add to `settings.DATABASE_SHARDS`.
+    """
+
+    def setup_databases(self, **kwargs):
+        with override_settings(
+            DATABASE_SHARDS=[*settings.DATABASE_SHARDS, *settings.DATABASE_TEST_SHARDS]
+        ):
+            return super().setup_databases(**kwargs)
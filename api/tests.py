@@ -1,14 +1,93 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from importlib import import_module
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import signals
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, close_old_connections, connection, connections
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
 from django.utils import timezone
 
-from api.errors import ExpiredUrl, InvalidUrl
-from api.models import DEFAULT_TTL_TIMEDELTA, Url
-from api.services import url_service
+from api import db_router, fast_path, views
+from api.consts import SHORT_URL_LENGTH
+from api.errors import AppError, ExpiredUrl, InvalidUrl, ShortUrlTaken, UrlNotFound
+from api.management.commands.bench_redirect_fast_path import call_wsgi
+from api.models import DEFAULT_TTL_TIMEDELTA, HitRollup, ShortUrlSequence, Url
+from api.services import (
+    admission,
+    async_db,
+    async_url_service,
+    group_commit,
+    hit_counters,
+    hit_rollups,
+    load_generator,
+    metrics,
+    microbenchmarks,
+    partition_service,
+    profiling,
+    purge_service,
+    redirect_snapshot,
+    reshard_service,
+    seed_service,
+    sharding,
+    short_url_allocator,
+    short_url_filter,
+    url_keys,
+    url_service,
+)
+from api.services.hit_counters import BufferedHitCounter
+from api.services.short_url_allocator import SHORT_URL_SPACE, BlockAllocator, FeistelPermutation
+from api.services.url_cache import UrlCache, url_cache
+from api.utils import (
+    KEY_SPACE,
+    decode_short_url_key,
+    digest_url,
+    encode_base62,
+    encode_short_url_key,
+    normalize_url,
+)
+from memechose import settings_lean
 
 
 class UrlTestCase(TestCase):
     VALID_URL = "https://stackoverflow.com/"
 
+    def setUp(self) -> None:
+        url_cache.clear()
+
     def _create_valid_entry(self) -> Url:
         short_url = url_service.get_or_create_short_url(self.VALID_URL)
         return url_service._get_url_entry_from_short_url(short_url)
@@ -59,3 +138,1837 @@ class UrlTestCase(TestCase):
         url_service.get_redirect_url(entry.short)
         post_redirect_hits = url_service._get_url_entry_from_short_url(entry.short).hits
         self.assertEqual(post_redirect_hits, current_hits + 1)
+
+    def test_cached_redirect_skips_lookup(self) -> None:
+        entry = self._create_valid_entry()
+        url_service.get_redirect_url(entry.short)
+        with self.assertNumQueries(1):  # only the hit increment
+            long_url = url_service.get_redirect_url(entry.short)
+        self.assertEqual(long_url, self.VALID_URL)
+
+    def test_invalidated_url_is_read_from_db(self) -> None:
+        entry = self._create_valid_entry()
+        url_service.get_redirect_url(entry.short)
+        entry.time_to_live -= DEFAULT_TTL_TIMEDELTA
+        entry.save()
+        url_service.invalidate_cached_urls(entry.short)
+        with self.assertRaises(ExpiredUrl):
+            url_service.get_redirect_url(entry.short)
+
+
+class UrlCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache = UrlCache(size=2)
+        cache.put("a", "https://a.com/", None)
+        cache.put("b", "https://b.com/", None)
+        cache.get("a")
+        cache.put("c", "https://c.com/", None)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a").long, "https://a.com/")
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expired_entry_is_evicted(self) -> None:
+        cache = UrlCache(size=2)
+        cache.put("a", "https://a.com/", timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats(), {"size": 0, "hits": 0, "misses": 1, "evictions": 1})
+
+    def test_entry_is_evicted_after_max_age(self) -> None:
+        cache = UrlCache(size=2, max_age=0)
+        cache.put("a", "https://a.com/", None)
+        self.assertIsNone(cache.get("a"))
+
+    def test_invalidate(self) -> None:
+        cache = UrlCache(size=2)
+        cache.put("a", "https://a.com/", None)
+        cache.invalidate(["a", "b"])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.evictions, 1)
+
+
+def _fail_nth_query(n: int):
+    """
+    Return an execute wrapper (see `connection.execute_wrapper`) which fails the nth query.
+    """
+    queries = itertools.count(1)
+
+    def execute(execute, sql, params, many, context):
+        if next(queries) == n:
+            raise DatabaseError("Connection lost")
+        return execute(sql, params, many, context)
+
+    return execute
+
+
+class BufferedHitCounterTestCase(TestCase):
+    def setUp(self) -> None:
+        self.counter = BufferedHitCounter()
+        self.short_urls = [
+            url_service.get_or_create_short_url(UrlTestCase.VALID_URL) for _ in range(3)
+        ]
+
+    def _hits(self) -> list[int]:
+        return [url_service._get_url_entry_from_short_url(short).hits for short in self.short_urls]
+
+    def test_hits_are_not_written_until_flushed(self) -> None:
+        with self.assertNumQueries(0):
+            self.counter.record(self.short_urls[0])
+        self.assertEqual(self._hits(), [0, 0, 0])
+
+    def test_hits_are_kept_across_flushes(self) -> None:
+        for i, short_url in enumerate(self.short_urls):
+            self.counter.record(short_url, amount=i + 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.counter.flush(), 6)
+        self.counter.record(self.short_urls[0])
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self._hits(), [2, 2, 3])
+
+    def test_failed_flush_keeps_pending_hits(self) -> None:
+        self.counter.record(self.short_urls[0], amount=2)
+        with mock.patch.object(hit_counters, "apply_hits", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.counter.flush()
+        self.counter.record(self.short_urls[0])
+        self.assertEqual(self.counter.pending, 3)
+        self.counter.flush()
+        self.assertEqual(self._hits(), [3, 0, 0])
+
+    def test_failed_flush_only_keeps_unwritten_hits(self) -> None:
+        for short_url in self.short_urls:
+            self.counter.record(short_url)
+        with mock.patch.object(hit_counters, "HITS_FLUSH_BATCH_SIZE", 1):
+            with connection.execute_wrapper(_fail_nth_query(2)), self.assertRaises(DatabaseError):
+                self.counter.flush()
+            self.assertEqual(self.counter.pending, 2)
+            self.counter.flush()
+        self.assertEqual(self._hits(), [1, 1, 1])
+
+    def test_close_flushes_pending_hits(self) -> None:
+        self.counter.record(self.short_urls[1], amount=5)
+        self.counter.close()
+        self.assertEqual(self._hits(), [0, 5, 0])
+
+    def test_concurrent_hits_are_not_lost(self) -> None:
+        def record_hits() -> None:
+            for _ in range(1000):
+                self.counter.record(self.short_urls[2])
+
+        threads = [threading.Thread(target=record_hits) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        flushed = 0
+        while any(thread.is_alive() for thread in threads):
+            flushed += self.counter.flush()
+        for thread in threads:
+            thread.join()
+        flushed += self.counter.flush()
+        self.assertEqual(flushed, 4000)
+        self.assertEqual(self._hits(), [0, 0, 4000])
+
+
+class BatchCreateTestCase(TestCase):
+    VALID_URL = UrlTestCase.VALID_URL
+    INVALID_URL = VALID_URL.replace("/", "@")
+
+    def test_valid_urls_are_inserted_in_a_single_query(self) -> None:
+        with self.assertNumQueries(1):
+            results = url_service.create_short_urls([self.VALID_URL] * 3)
+        self.assertEqual(len(set(results)), 3)
+        for short_url in results:
+            self.assertEqual(url_service.get_redirect_url(short_url), self.VALID_URL)
+
+    def test_results_keep_the_original_order(self) -> None:
+        results = url_service.create_short_urls([self.INVALID_URL, self.VALID_URL, ""])
+        self.assertIsInstance(results[0], InvalidUrl)
+        self.assertEqual(url_service.get_redirect_url(results[1]), self.VALID_URL)
+        self.assertIsInstance(results[2], InvalidUrl)
+
+    def test_urls_too_long_for_the_db_are_invalid(self) -> None:
+        too_long = f"https://example.com/{'a' * 300}"
+        results = url_service.create_short_urls([too_long, self.VALID_URL])
+        self.assertIsInstance(results[0], InvalidUrl)
+        self.assertEqual(url_service.get_redirect_url(results[1]), self.VALID_URL)
+        with self.assertRaises(InvalidUrl):
+            url_service.get_or_create_short_url(too_long)
+
+    def test_only_taken_short_urls_are_regenerated(self) -> None:
+        taken = url_service.get_or_create_short_url(self.VALID_URL)
+        codes = iter([taken, "aaaaaaa", "bbbbbbb"])
+        with mock.patch.object(url_service, "_generate_short_url", lambda: next(codes)):
+            with self.assertNumQueries(2):
+                results = url_service.create_short_urls([self.VALID_URL, self.VALID_URL])
+        self.assertEqual(sorted(results), ["aaaaaaa", "bbbbbbb"])
+
+    def test_exhausted_retries_are_reported(self) -> None:
+        taken = url_service.get_or_create_short_url(self.VALID_URL)
+        with mock.patch.object(url_service, "_generate_short_url", lambda: taken):
+            (result,) = url_service.create_short_urls([self.VALID_URL])
+        self.assertIsInstance(result, AppError)
+
+    def test_batch_endpoint(self) -> None:
+        response = self.client.post(
+            "/create/batch/",
+            data={"urls": [self.VALID_URL, self.INVALID_URL]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        valid, invalid = json.loads(response.content)["results"]
+        self.assertEqual(url_service.get_redirect_url(valid["url"]), self.VALID_URL)
+        self.assertIn("App error", invalid)
+
+    def test_create_endpoint_rejects_missing_url(self) -> None:
+        response = self.client.post("/create/", data={}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_endpoint_rejects_non_string_urls(self) -> None:
+        response = self.client.post(
+            "/create/batch/",
+            data={"urls": [None, 42, self.VALID_URL]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        none, number, valid = json.loads(response.content)["results"]
+        self.assertIn("App error", none)
+        self.assertIn("App error", number)
+        self.assertEqual(url_service.get_redirect_url(valid["url"]), self.VALID_URL)
+
+    def test_batch_endpoint_rejects_non_list(self) -> None:
+        response = self.client.post(
+            "/create/batch/", data={"urls": self.VALID_URL}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class FeistelPermutationTestCase(SimpleTestCase):
+    def test_permutation_is_a_bijection(self) -> None:
+        domain = 10**5
+        permutation = FeistelPermutation(domain=domain, key=b"key")
+        self.assertEqual(sorted(map(permutation.permute, range(domain))), list(range(domain)))
+
+    def test_permutation_is_invertible_over_short_url_space(self) -> None:
+        permutation = FeistelPermutation(domain=SHORT_URL_SPACE, key=b"key")
+        for value in (0, 1, 2, 12345, SHORT_URL_SPACE // 2, SHORT_URL_SPACE - 1):
+            permuted = permutation.permute(value)
+            self.assertLess(permuted, SHORT_URL_SPACE)
+            self.assertEqual(permutation.invert(permuted), value)
+
+    def test_permutation_depends_on_key(self) -> None:
+        first = FeistelPermutation(domain=SHORT_URL_SPACE, key=b"first")
+        second = FeistelPermutation(domain=SHORT_URL_SPACE, key=b"second")
+        self.assertNotEqual(
+            [first.permute(i) for i in range(10)], [second.permute(i) for i in range(10)]
+        )
+
+
+@override_settings(SHORT_URL_ALLOCATOR_ENABLED=True, SHORT_URL_ALLOCATOR_BLOCK_SIZE=10)
+class BlockAllocatorTestCase(TestCase):
+    def setUp(self) -> None:
+        self.allocator = BlockAllocator(
+            block_size=10,
+            permutation=FeistelPermutation(domain=SHORT_URL_SPACE, key=b"key"),
+        )
+        patcher = mock.patch.object(short_url_allocator, "_allocator", self.allocator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_short_urls_are_issued_from_reserved_blocks(self) -> None:
+        first = self.allocator.next_short_url()
+        with self.assertNumQueries(0):
+            short_urls = [first] + [self.allocator.next_short_url() for _ in range(9)]
+        self.assertEqual(len(set(short_urls)), 10)
+        self.assertEqual({len(short_url) for short_url in short_urls}, {SHORT_URL_LENGTH})
+        self.allocator.next_short_url()
+        self.assertEqual(ShortUrlSequence.objects.get(name="default").next_value, 20)
+
+    def test_taken_short_urls_are_skipped(self) -> None:
+        taken = BlockAllocator(block_size=1, permutation=self.allocator.permutation)
+        taken._next, taken._end = 0, 1
+        Url.objects.create(short=taken.next_short_url(), long=UrlTestCase.VALID_URL)
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        self.assertEqual(url_service.get_redirect_url(short_url), UrlTestCase.VALID_URL)
+        self.assertEqual(Url.objects.count(), 2)
+
+
+class DeduplicationTestCase(TestCase):
+    VALID_URL = UrlTestCase.VALID_URL
+
+    def test_urls_are_not_deduplicated_by_default(self) -> None:
+        first = url_service.get_or_create_short_url(self.VALID_URL)
+        second = url_service.get_or_create_short_url(self.VALID_URL)
+        self.assertNotEqual(first, second)
+
+    def test_existing_short_url_is_returned(self) -> None:
+        first = url_service.get_or_create_short_url(self.VALID_URL, deduplicate=True)
+        second = url_service.get_or_create_short_url(
+            "HTTPS://StackOverflow.com:443", deduplicate=True
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(Url.objects.count(), 1)
+
+    @override_settings(DEDUPLICATE_URLS=True)
+    def test_expired_short_url_is_not_reused(self) -> None:
+        first = url_service.get_or_create_short_url(self.VALID_URL)
+        Url.objects.filter(short=first).update(expires_at=timezone.now())
+        second = url_service.get_or_create_short_url(self.VALID_URL)
+        self.assertNotEqual(first, second)
+
+    def test_digest_is_stored_on_create(self) -> None:
+        short_url = url_service.get_or_create_short_url(self.VALID_URL)
+        (batch_short_url,) = url_service.create_short_urls([self.VALID_URL])
+        digests = Url.objects.filter(short__in=[short_url, batch_short_url]).values_list(
+            "long_digest", flat=True
+        )
+        self.assertEqual(set(digests), {digest_url(self.VALID_URL)})
+
+    @override_settings(DEDUPLICATE_URLS=True)
+    def test_digests_of_older_urls_are_backfilled(self) -> None:
+        migration = import_module("api.migrations.0007_backfill_url_long_digest")
+        short_url = url_service.get_or_create_short_url(self.VALID_URL)
+        url_service.create_short_urls(["https://example.com/1", "https://example.com/2"])
+        Url.objects.update(long_digest=None)
+        with mock.patch.object(migration, "BATCH_SIZE", 2):
+            with connection.schema_editor() as schema_editor:
+                migration.populate_long_digest(django_apps, schema_editor)
+        self.assertFalse(Url.objects.filter(long_digest__isnull=True).exists())
+        self.assertEqual(url_service.get_or_create_short_url(self.VALID_URL), short_url)
+
+    def test_create_endpoint_deduplicates_on_request(self) -> None:
+        short_urls = [
+            json.loads(
+                self.client.post(
+                    "/create/",
+                    data={"url": self.VALID_URL, "deduplicate": True},
+                    content_type="application/json",
+                ).content
+            )["url"]
+            for _ in range(2)
+        ]
+        self.assertEqual(short_urls[0], short_urls[1])
+
+    def test_normalize_url(self) -> None:
+        self.assertEqual(normalize_url("HTTP://Example.com:80"), "http://example.com/")
+        self.assertEqual(
+            normalize_url("https://user@Example.com:8443/a?b=1#c"),
+            "https://user@example.com:8443/a?b=1#c",
+        )
+        self.assertEqual(normalize_url("HTTP://Example.com:99999"), "http://example.com:99999/")
+
+    def test_url_with_out_of_range_port_is_created(self) -> None:
+        url = "http://example.com:99999/"
+        short_url = url_service.get_or_create_short_url(url, deduplicate=True)
+        self.assertEqual(url_service.get_or_create_short_url(url, deduplicate=True), short_url)
+        (batch_short_url,) = url_service.create_short_urls([url])
+        self.assertEqual(url_service.get_redirect_url(batch_short_url), url)
+
+
+class AsyncUrlServiceTestCase(TransactionTestCase):
+    # the async pool uses its own connections, which can't see the data of a test transaction
+    serialized_rollback = True
+    VALID_URL = UrlTestCase.VALID_URL
+
+    def setUp(self) -> None:
+        url_cache.clear()
+
+    async def test_created_url_redirects(self) -> None:
+        try:
+            short_url = await async_url_service.aget_or_create_short_url(self.VALID_URL)
+            self.assertEqual(await async_url_service.aget_redirect_url(short_url), self.VALID_URL)
+            self.assertEqual(await async_url_service.aget_redirect_url(short_url), self.VALID_URL)
+            url = await Url.objects.aget(short=short_url)
+            self.assertEqual(url.hits, 2)
+        finally:
+            await async_db.close_pools()
+
+    async def test_invalid_url_fails(self) -> None:
+        with self.assertRaises(InvalidUrl):
+            await async_url_service.aget_or_create_short_url("not a url")
+
+    async def test_missing_and_expired_urls_raise(self) -> None:
+        try:
+            url = await Url.objects.acreate(
+                short="expired", long=self.VALID_URL, time_to_live=timedelta(0)
+            )
+            with self.assertRaises(ExpiredUrl):
+                await async_url_service.aget_redirect_url(url.short)
+            with self.assertRaises(UrlNotFound):
+                await async_url_service.aget_redirect_url("missing")
+        finally:
+            await async_db.close_pools()
+
+    async def test_urls_are_deduplicated(self) -> None:
+        try:
+            first = await async_url_service.aget_or_create_short_url(
+                self.VALID_URL, deduplicate=True
+            )
+            second = await async_url_service.aget_or_create_short_url(
+                self.VALID_URL, deduplicate=True
+            )
+            self.assertEqual(first, second)
+        finally:
+            await async_db.close_pools()
+
+    @override_settings(SHORT_URL_ALLOCATOR_ENABLED=True)
+    async def test_allocated_short_url(self) -> None:
+        allocator = BlockAllocator(
+            block_size=10, permutation=FeistelPermutation(domain=SHORT_URL_SPACE, key=b"key")
+        )
+        try:
+            with mock.patch.object(short_url_allocator, "_allocator", allocator):
+                short_url = await async_url_service.aget_or_create_short_url(self.VALID_URL)
+            self.assertEqual(short_url, encode_base62(allocator.permutation.permute(0), 7))
+            sequence = await ShortUrlSequence.objects.aget(name="default")
+            self.assertEqual(sequence.next_value, 10)
+        finally:
+            await async_db.close_pools()
+
+    async def test_async_views(self) -> None:
+        factory = AsyncRequestFactory()
+        try:
+            request = factory.post(
+                "/create/", data={"url": self.VALID_URL}, content_type="application/json"
+            )
+            response = await views.acreate_url(request)
+            self.assertEqual(response.status_code, 201)
+            short_url = json.loads(response.content)["url"]
+            response = await views.aredirect_to_original_url(factory.get("/"), url=short_url)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response["Location"], self.VALID_URL)
+            response = await views.aredirect_to_original_url(factory.get("/"), url="missing")
+            self.assertEqual(response.status_code, 404)
+            response = await views.aredirect_to_original_url(factory.post("/"), url=short_url)
+            self.assertEqual(response.status_code, 405)
+        finally:
+            await async_db.close_pools()
+
+
+class RemoveExpiredUrlsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.checkpoint_dir = os.path.join(tempfile.mkdtemp(), "checkpoint")
+        self.expired = sorted(
+            url_service.create_short_urls([UrlTestCase.VALID_URL] * 20)
+        )
+        Url.objects.filter(short__in=self.expired).update(expires_at=timezone.now())
+        self.live = url_service.create_short_urls([UrlTestCase.VALID_URL] * 5)
+
+    def _purger(self, workers: int = 1) -> purge_service.ExpiredUrlPurger:
+        return purge_service.ExpiredUrlPurger(
+            grace_days=0, batch_size=3, checkpoint_dir=self.checkpoint_dir, workers=workers
+        )
+
+    def test_only_expired_urls_are_removed(self) -> None:
+        call_command(
+            "remove_expired_urls",
+            grace_period=0,
+            batch_size=3,
+            checkpoint_dir=self.checkpoint_dir,
+            stdout=open(os.devnull, "w"),
+        )
+        self.assertEqual(sorted(Url.objects.values_list("short", flat=True)), sorted(self.live))
+        self.assertFalse(os.path.exists(self.checkpoint_dir))
+
+    def test_key_ranges_cover_all_urls(self) -> None:
+        purger = self._purger(workers=4)
+        purger._load_or_create_checkpoint()
+        self.assertEqual(len(purger.key_ranges), 4)
+        self.assertEqual(sum(map(purger.purge_range, range(4))), 20)
+        self.assertEqual(Url.objects.count(), 5)
+
+    def test_split_key_range(self) -> None:
+        key_ranges = purge_service.split_key_range(4)
+        self.assertEqual(len(key_ranges), 4)
+        self.assertIsNone(key_ranges[0][0])
+        self.assertIsNone(key_ranges[-1][1])
+        for (_, upper), (lower, _) in zip(key_ranges, key_ranges[1:]):
+            self.assertEqual(upper, lower)
+
+    def test_removed_urls_are_archived(self) -> None:
+        archive_dir = tempfile.mkdtemp()
+        stats = purge_service.ExpiredUrlPurger(
+            grace_days=0,
+            batch_size=3,
+            checkpoint_dir=self.checkpoint_dir,
+            archive_dir=archive_dir,
+        ).run()
+        self.assertEqual(stats.rows, 20)
+        self.assertEqual(Url.objects.count(), 5)
+
+        with open(os.path.join(archive_dir, "manifest.jsonl")) as manifest:
+            chunks = [json.loads(line) for line in manifest]
+        self.assertEqual(len(chunks), 7)
+        archived = []
+        for chunk in chunks:
+            with gzip.open(os.path.join(archive_dir, chunk["file"])) as file:
+                content = file.read()
+            self.assertEqual(hashlib.sha256(content).hexdigest(), chunk["sha256"])
+            rows = list(csv.reader(content.decode().splitlines()))
+            self.assertEqual(len(rows), chunk["rows"])
+            self.assertEqual(rows[-1][0], chunk["last_key"])
+            archived.extend(row[0] for row in rows)
+        self.assertEqual(sorted(archived), self.expired)
+
+    def test_interrupted_purge_is_resumed(self) -> None:
+        purger = self._purger()
+        calls = 0
+        delete_chunk = purger._delete_chunk
+
+        def crash_on_second_chunk(*args, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise KeyboardInterrupt
+            return delete_chunk(*args, **kwargs)
+
+        with mock.patch.object(purger, "_delete_chunk", crash_on_second_chunk):
+            with self.assertRaises(KeyboardInterrupt):
+                purger.run()
+        self.assertEqual(Url.objects.count(), 22)
+
+        resumed_purger = self._purger()
+        with mock.patch.object(
+            resumed_purger, "_delete_chunk", wraps=resumed_purger._delete_chunk
+        ) as resumed_delete_chunk:
+            stats = resumed_purger.run()
+        last_key, _, _ = resumed_delete_chunk.call_args_list[0].args
+        self.assertIn(last_key, self.expired)
+        self.assertEqual(stats.rows, 20)
+        self.assertEqual(Url.objects.count(), 5)
+
+
+def _add_url_in_admin(client, short_url: str) -> HttpResponse:
+    admin_user, _ = User.objects.get_or_create(
+        username="admin", defaults={"is_staff": True, "is_superuser": True}
+    )
+    client.force_login(admin_user)
+    data = {
+        "short": short_url,
+        "long": UrlTestCase.VALID_URL,
+        "created_at_0": "2026-10-18",
+        "created_at_1": "10:00:00",
+        "time_to_live": "30 00:00:00",
+        "hits": 0,
+    }
+    return client.post(reverse("admin:api_url_add"), data)
+
+
+@skipUnless(connection.vendor == "postgresql", "partitioning requires PostgreSQL")
+@override_settings(URL_TABLE_PARTITIONED=True)
+class PartitionedUrlTableTestCase(TestCase):
+    def setUp(self) -> None:
+        self.expired, self.live, self.permanent = url_service.create_short_urls(
+            [UrlTestCase.VALID_URL] * 3
+        )
+        Url.objects.filter(short=self.expired).update(
+            expires_at=timezone.now() - timedelta(days=90)
+        )
+        Url.objects.filter(short=self.permanent).update(time_to_live=None, expires_at=None)
+        partition_service.convert_to_partitioned(months_ahead=4)
+
+    def _partition_of(self, short_url: str) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {Url._meta.db_table} WHERE short = %s",
+                [short_url],
+            )
+            return cursor.fetchone()[0]
+
+    def test_rows_are_kept(self) -> None:
+        self.assertTrue(partition_service.is_partitioned())
+        self.assertEqual(Url.objects.count(), 3)
+        self.assertEqual(self._partition_of(self.permanent), partition_service.DEFAULT_PARTITION)
+        self.assertEqual(
+            self._partition_of(self.live),
+            partition_service.partition_name(Url.objects.get(pk=self.live).expires_at),
+        )
+        self.assertEqual(url_service.get_redirect_url(self.live), UrlTestCase.VALID_URL)
+
+    def test_taken_short_urls_are_rejected(self) -> None:
+        # a different expiry would land in another partition, where the short URL isn't taken
+        taken = Url(short=self.live, long=UrlTestCase.VALID_URL, time_to_live=timedelta(days=365))
+        self.assertEqual(url_service._insert_ignoring_conflicts([taken]), set())
+        self.assertEqual(Url.objects.filter(short=self.live).count(), 1)
+
+        with mock.patch.object(url_service, "_generate_short_url", side_effect=[self.live, "new"]):
+            self.assertEqual(url_service.get_or_create_short_url(UrlTestCase.VALID_URL), "new")
+
+    def test_admin_rejects_taken_short_urls(self) -> None:
+        url_admin = admin.site._registry[Url]
+        taken = Url(short=self.live, long=UrlTestCase.VALID_URL, time_to_live=timedelta(days=365))
+        with self.assertRaises(ShortUrlTaken):
+            url_admin.save_model(None, taken, None, change=False)
+        self.assertEqual(Url.objects.filter(short=self.live).count(), 1)
+
+        url_admin.save_model(None, Url(short="admin", long=UrlTestCase.VALID_URL), None, False)
+        self.assertEqual(url_service.get_redirect_url("admin"), UrlTestCase.VALID_URL)
+        self.assertIn("short", url_admin.get_readonly_fields(None, Url.objects.get(pk="admin")))
+
+    def test_admin_form_rejects_taken_short_urls(self) -> None:
+        response = _add_url_in_admin(self.client, self.live)
+        self.assertEqual(
+            response.context["adminform"].form.errors, {"short": ["This short URL is taken."]}
+        )
+        self.assertEqual(Url.objects.filter(short=self.live).count(), 1)
+
+        self.assertEqual(_add_url_in_admin(self.client, "admin").status_code, 302)
+        self.assertEqual(url_service.get_redirect_url("admin"), UrlTestCase.VALID_URL)
+
+    def test_seeded_short_urls_are_unique(self) -> None:
+        seeder = seed_service.UrlSeeder(
+            chunk_size=20, long_urls=5, long_url_zipf=1, ttl_days=(1, 3), no_expiry_ratio=0.5
+        )
+        seeder.created_at = timezone.now()
+        sequence = ShortUrlSequence.objects.get(name=short_url_allocator.DEFAULT_SEQUENCE_NAME)
+        taken = next(seeder._rows(sequence.next_value, sequence.next_value + 1))[0]
+        Url.objects.filter(short=self.live).update(short=taken)
+        self.assertEqual(seeder.run(30).rows, 29)
+        self.assertEqual(Url.objects.filter(short=taken).count(), 1)
+
+    def test_maintain_moves_rows_from_default_partition(self) -> None:
+        short_url = url_service._create_url_entry_with_retry(UrlTestCase.VALID_URL).short
+        Url.objects.filter(short=short_url).update(expires_at=timezone.now() + timedelta(days=400))
+        self.assertEqual(self._partition_of(short_url), partition_service.DEFAULT_PARTITION)
+
+        created = partition_service.ensure_partitions(months_ahead=14)
+        self.assertIn(self._partition_of(short_url), created)
+        self.assertEqual(partition_service.ensure_partitions(months_ahead=14), [])
+
+    def test_expired_partitions_are_archived_and_dropped_by_purge(self) -> None:
+        archive_dir = tempfile.mkdtemp()
+        stats = purge_service.ExpiredUrlPurger(
+            grace_days=0,
+            batch_size=10,
+            checkpoint_dir=os.path.join(tempfile.mkdtemp(), "checkpoint"),
+            archive_dir=archive_dir,
+        ).run()
+        self.assertGreaterEqual(stats.partitions_dropped, 1)
+        with open(os.path.join(archive_dir, "manifest.jsonl")) as manifest:
+            self.assertEqual([json.loads(line)["last_key"] for line in manifest], [self.expired])
+        self.assertEqual(
+            sorted(Url.objects.values_list("short", flat=True)), sorted([self.live, self.permanent])
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY requires PostgreSQL")
+class InsertDummyUrlsTestCase(TestCase):
+    def _seeder(self) -> seed_service.UrlSeeder:
+        return seed_service.UrlSeeder(
+            chunk_size=20, long_urls=5, long_url_zipf=1, ttl_days=(1, 3), no_expiry_ratio=0.5
+        )
+
+    def test_urls_are_seeded(self) -> None:
+        call_command("insert_dummy_urls", amount=50, chunk_size=20, stdout=open(os.devnull, "w"))
+        self.assertEqual(Url.objects.count(), 50)
+        self.assertEqual(Url.objects.filter(hits=0).count(), 50)
+        for url in Url.objects.all():
+            if url.time_to_live is None:
+                self.assertIsNone(url.expires_at)
+            else:
+                self.assertEqual(url.expires_at, url.created_at + url.time_to_live)
+            self.assertEqual(url.long_digest, digest_url(url.long))
+
+    def test_rows_and_codes_are_unique_and_stable(self) -> None:
+        seeder = self._seeder()
+        seeder.created_at = timezone.now()
+        rows = list(seeder._rows(0, 100))
+        self.assertEqual(len({row[0] for row in rows}), 100)
+        self.assertEqual(rows, list(seeder._rows(0, 100)))
+        self.assertGreater(len({row[3] for row in rows}), 1)
+
+    def test_taken_short_urls_are_skipped(self) -> None:
+        seeder = self._seeder()
+        seeder.created_at = timezone.now()
+        sequence = ShortUrlSequence.objects.get(name=short_url_allocator.DEFAULT_SEQUENCE_NAME)
+        taken = next(seeder._rows(sequence.next_value, sequence.next_value + 1))[0]
+        Url.objects.create(short=taken, long=UrlTestCase.VALID_URL)
+
+        stats = seeder.run(30)
+        self.assertEqual(stats.rows, 29)
+        self.assertEqual(Url.objects.count(), 30)
+        self.assertEqual(Url.objects.get(short=taken).long, UrlTestCase.VALID_URL)
+
+
+class LoadGeneratorTestCase(SimpleTestCase):
+    def test_zipf_sampler_favors_first_keys(self) -> None:
+        sampler = load_generator.ZipfSampler(100, 1.1, random.Random(0))
+        samples = [sampler.sample() for _ in range(10_000)]
+        self.assertTrue(all(0 <= sample < 100 for sample in samples))
+        self.assertGreater(samples.count(0), samples.count(1))
+        self.assertGreater(samples.count(1), samples.count(50))
+
+    def test_percentile(self) -> None:
+        values = list(range(1, 101))
+        self.assertEqual(load_generator.percentile(values, 50), 50)
+        self.assertEqual(load_generator.percentile(values, 99), 99)
+        self.assertEqual(load_generator.percentile([7], 95), 7)
+        self.assertEqual(load_generator.percentile([], 95), 0.0)
+
+
+class BenchCommandTestCase(TransactionTestCase):
+    def _bench(self, **options) -> dict:
+        output = os.path.join(tempfile.mkdtemp(), "results.json")
+        call_command(
+            "bench", requests=20, concurrency=2, output=output, stdout=io.StringIO(), **options
+        )
+        with open(output) as f:
+            return json.load(f)["results"]
+
+    @override_settings(REDIRECT_CACHE_MAX_AGE_SECONDS=60, REDIRECT_CACHE_STATUS=301)
+    def test_permanent_redirects_are_not_errors(self) -> None:
+        results = self._bench(urls=5, create_ratio=0)
+        self.assertEqual((results["redirect"]["requests"], results["redirect"]["errors"]), (20, 0))
+
+    def test_failed_seeds_are_skipped(self) -> None:
+        create_short_urls = url_service.create_short_urls
+
+        def create_some(long_urls: list[str]) -> list:
+            return [AppError("taken")] + create_short_urls(long_urls[1:])
+
+        with mock.patch.object(url_service, "create_short_urls", create_some):
+            results = self._bench(urls=3, create_ratio=0)
+        self.assertEqual(results["redirect"]["errors"], 0)
+
+    def test_at_least_one_url(self) -> None:
+        with self.assertRaises(CommandError):
+            self._bench(urls=0)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class RedirectFastPathTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        self.expired_short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        Url.objects.filter(short=self.expired_short_url).update(expires_at=timezone.now())
+        self.django_application = WSGIHandler()
+        self.application = fast_path.WSGIRedirectDispatcher(self.django_application)
+        # like the test client, keep the test transaction's connection open between requests
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def test_responses_are_identical(self) -> None:
+        for path in (f"/s/{self.short_url}/", "/s/missing/", f"/s/{self.expired_short_url}/"):
+            with self.subTest(path=path):
+                self.assertEqual(
+                    call_wsgi(self.application, path), call_wsgi(self.django_application, path)
+                )
+
+    def test_redirects_skip_django(self) -> None:
+        with mock.patch.object(self.application, "application") as django_application:
+            status, headers, _ = call_wsgi(self.application, f"/s/{self.short_url}/")
+        django_application.assert_not_called()
+        self.assertEqual(status, "302 Found")
+        self.assertIn(("Location", UrlTestCase.VALID_URL), headers)
+        self.assertEqual(Url.objects.get(short=self.short_url).hits, 1)
+
+    def test_other_requests_fall_through(self) -> None:
+        for path in ("/health/", "/s/", f"/s/{self.short_url}", "/s/not-a-code/"):
+            with self.subTest(path=path), mock.patch.object(
+                self.application, "application", wraps=self.django_application
+            ) as django_application:
+                call_wsgi(self.application, path)
+                django_application.assert_called_once()
+
+        with override_settings(ALLOWED_HOSTS=["example.com"]):
+            self.assertEqual(call_wsgi(self.application, "/health/")[0], "400 Bad Request")
+            application = fast_path.WSGIRedirectDispatcher(self.django_application)
+            self.assertEqual(
+                call_wsgi(application, f"/s/{self.short_url}/")[0], "400 Bad Request"
+            )
+
+    @override_settings(REDIRECT_CACHE_MAX_AGE_SECONDS=3600, REDIRECT_CACHE_STATUS=308)
+    def test_cacheable_responses_are_identical(self) -> None:
+        path = f"/s/{self.short_url}/"
+        status, headers, _ = call_wsgi(self.application, path)
+        self.assertEqual(status, "308 Permanent Redirect")
+        self.assertEqual(call_wsgi(self.django_application, path), (status, headers, b""))
+
+        # conditional requests are left to Django
+        etag = dict(headers)["ETag"]
+        with mock.patch.object(
+            self.application, "application", wraps=self.django_application
+        ) as django_application:
+            status, _, _ = call_wsgi(self.application, path, HTTP_IF_NONE_MATCH=etag)
+        django_application.assert_called_once()
+        self.assertEqual(status, "304 Not Modified")
+
+    def test_disabled_by_per_request_middleware_settings(self) -> None:
+        with override_settings(SECURE_SSL_REDIRECT=True):
+            self.assertFalse(fast_path.is_supported())
+        with override_settings(MIDDLEWARE=["api.middleware.Custom"]):
+            self.assertFalse(fast_path.is_supported())
+        self.assertTrue(fast_path.is_supported())
+
+    async def test_asgi_responses_are_identical(self) -> None:
+        django_application = ASGIHandler()
+        application = fast_path.ASGIRedirectDispatcher(django_application)
+        for path in (f"/s/{self.short_url}/", "/s/missing/"):
+            with self.subTest(path=path):
+                self.assertEqual(
+                    await self._call_asgi(application, path),
+                    await self._call_asgi(django_application, path),
+                )
+
+    async def _call_asgi(self, application, path: str) -> list[dict]:
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"testserver")],
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        await application(scope, receive, send)
+        return messages
+
+
+class PrimaryReplicaRouterTestCase(SimpleTestCase):
+    router = db_router.PrimaryReplicaRouter()
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self) -> None:
+        self.assertEqual(self.router.db_for_read(Url), "default")
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            self.assertEqual(url_service._lookup_dbs("aaaaaaa"), ["default"])
+
+    @override_settings(DATABASE_REPLICAS=["replica_0", "replica_1"])
+    def test_only_redirect_lookups_use_replicas(self) -> None:
+        self.assertEqual(self.router.db_for_read(Url), "default")
+        self.assertEqual(self.router.db_for_write(Url), "default")
+        self.assertTrue(self.router.allow_migrate("default", "api"))
+        self.assertFalse(self.router.allow_migrate("replica_0", "api"))
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            replica, primary = url_service._lookup_dbs("aaaaaaa")
+        self.assertIn(replica, ["replica_0", "replica_1"])
+        self.assertEqual(primary, "default")
+
+    @override_settings(DATABASE_REPLICAS=["replica_0"])
+    def test_lookups_in_a_transaction_use_the_primary(self) -> None:
+        with mock.patch.object(connections["default"], "in_atomic_block", True):
+            self.assertEqual(url_service._lookup_dbs("aaaaaaa"), ["default"])
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "requires DB_REPLICA_URLS")
+class ReadReplicaTestCase(TestCase):
+    # replicas mirror the default DB in tests, but read it through their own connections,
+    # which can't see the data of a test transaction, just like a lagging replica
+    databases = "__all__"
+
+    def setUp(self) -> None:
+        url_cache.clear()
+
+    def test_redirect_falls_back_on_the_primary(self) -> None:
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        replica = settings.DATABASE_REPLICAS[0]
+        # outside of the test transaction reads would go to the replica
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            with self.assertNumQueries(2, using=replica):
+                self.assertEqual(url_service.get_redirect_url(short_url), UrlTestCase.VALID_URL)
+                with self.assertRaises(UrlNotFound):
+                    url_service.get_redirect_url("missing")
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.registry = metrics.Registry()
+        self.counter = metrics.Counter(
+            "test_total", "Test counter.", "outcome", ("ok", "error"), registry=self.registry
+        )
+        self.histogram = metrics.Histogram(
+            "test_seconds", "Test histogram.", buckets=(0.1, 1.0), registry=self.registry
+        )
+
+    def test_render(self) -> None:
+        self.counter.labels("ok").inc()
+        self.counter.labels("ok").inc(2)
+        for value in (0.05, 0.1, 0.5, 5.0):
+            self.histogram.observe(value)
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP test_total Test counter.\n"
+            "# TYPE test_total counter\n"
+            'test_total{outcome="ok"} 3.0\n'
+            'test_total{outcome="error"} 0.0\n'
+            "# HELP test_seconds Test histogram.\n"
+            "# TYPE test_seconds histogram\n"
+            'test_seconds_bucket{le="0.1"} 2.0\n'
+            'test_seconds_bucket{le="1.0"} 3.0\n'
+            'test_seconds_bucket{le="+Inf"} 4.0\n'
+            "test_seconds_sum 5.65\n"
+            "test_seconds_count 4.0\n",
+        )
+
+    def test_metrics_must_be_defined_before_updates(self) -> None:
+        self.counter.labels("ok").inc()
+        with self.assertRaises(RuntimeError):
+            metrics.Counter("late_total", "Too late.", registry=self.registry)
+
+    def test_processes_are_aggregated(self) -> None:
+        with tempfile.TemporaryDirectory() as metrics_dir, override_settings(
+            METRICS_DIR=metrics_dir
+        ):
+            self.counter.labels("ok").inc()
+            with self.histogram.time():
+                pass
+            processes = [
+                multiprocessing.get_context("fork").Process(target=self._update_metrics)
+                for _ in range(2)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+
+            self.assertEqual(len(os.listdir(metrics_dir)), 3)
+            rendered = self.registry.render()
+
+        self.assertIn('test_total{outcome="ok"} 3.0', rendered)
+        self.assertIn('test_total{outcome="error"} 2.0', rendered)
+        self.assertIn("test_seconds_count 3.0", rendered)
+
+    def _update_metrics(self) -> None:
+        self.counter.labels("ok").inc()
+        self.counter.labels("error").inc()
+        self.histogram.observe(0.5)
+
+    def _scrape(self, sample: str) -> float:
+        rendered = self.client.get(reverse("metrics")).content.decode()
+        row = next(row for row in rendered.splitlines() if row.startswith(f"{sample} "))
+        return float(row.rsplit(" ", 1)[1])
+
+    def test_endpoint_reports_outcomes(self) -> None:
+        count = self._scrape
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        not_found = count('memechose_redirects_total{outcome="not_found"}')
+        found = count('memechose_redirects_total{outcome="found"}')
+        lookups = count('memechose_redirect_stage_seconds_count{stage="db_lookup"}')
+        self.client.get(reverse("redirect", args=["missing"]))
+        self.client.get(reverse("redirect", args=[short_url]))
+
+        self.assertEqual(count('memechose_redirects_total{outcome="not_found"}'), not_found + 1)
+        self.assertEqual(count('memechose_redirects_total{outcome="found"}'), found + 1)
+        self.assertEqual(
+            count('memechose_redirect_stage_seconds_count{stage="db_lookup"}'), lookups + 2
+        )
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+
+    def test_collisions_are_counted(self) -> None:
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        collisions = self._scrape("memechose_short_url_collisions_total")
+        with mock.patch.object(url_service, "_generate_short_url", side_effect=[short_url, "new"]):
+            url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        self.assertEqual(self._scrape("memechose_short_url_collisions_total"), collisions + 1)
+
+
+class BloomFilterTestCase(SimpleTestCase):
+    def test_no_false_negatives_and_few_false_positives(self) -> None:
+        bloom_filter = short_url_filter.BloomFilter(capacity=10_000, error_rate=0.01)
+        added = [f"added{i}" for i in range(10_000)]
+        for value in added:
+            bloom_filter.add(value)
+        self.assertTrue(all(value in bloom_filter for value in added))
+        false_positives = sum(f"other{i}" in bloom_filter for i in range(10_000))
+        self.assertLess(false_positives, 200)
+
+    def test_size(self) -> None:
+        bits, hashes = short_url_filter.BloomFilter.size_for(100_000_000, 0.01)
+        self.assertEqual(hashes, 7)
+        self.assertAlmostEqual(bits / 8 / 2**20, 114.3, places=1)
+
+
+@override_settings(SHORT_URL_FILTER_ENABLED=True)
+class ShortUrlFilterTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.filter = short_url_filter.ShortUrlFilter(capacity=1000, error_rate=0.01)
+        patcher = mock.patch.object(url_service, "get_short_url_filter", return_value=self.filter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+
+    def test_lookups_use_the_db_until_built(self) -> None:
+        self.assertFalse(self.filter.ready)
+        self.assertTrue(self.filter.might_exist("missing"))
+        with self.assertNumQueries(1), self.assertRaises(UrlNotFound):
+            url_service.get_redirect_url("missing")
+
+    def test_missing_short_urls_skip_the_db(self) -> None:
+        self.assertEqual(self.filter.build(), 1)
+        with self.assertNumQueries(0), self.assertRaises(UrlNotFound):
+            url_service.get_redirect_url("missing")
+        self.assertEqual(url_service.get_redirect_url(self.short_url), UrlTestCase.VALID_URL)
+
+    def test_created_short_urls_are_added(self) -> None:
+        self.filter.build()
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        batch = url_service.create_short_urls([UrlTestCase.VALID_URL])
+        self.assertTrue(self.filter.might_exist(short_url))
+        self.assertTrue(self.filter.might_exist(batch[0]))
+
+    def test_generation_skips_taken_short_urls(self) -> None:
+        self.filter.build()
+        with mock.patch.object(
+            url_service, "_generate_random_short_url", side_effect=[self.short_url, "new"]
+        ):
+            self.assertEqual(url_service._generate_short_url(), "new")
+
+
+class ShortUrlFilterListenerTestCase(TransactionTestCase):
+    def test_notified_short_urls_are_added(self) -> None:
+        url = Url.objects.create(short="before", long=UrlTestCase.VALID_URL)
+        listener = short_url_filter.ShortUrlFilter(capacity=1000, error_rate=0.01)
+        listener.start()
+        self.addCleanup(listener.close)
+        self._wait_for(lambda: listener.ready)
+        self.assertTrue(listener.might_exist(url.short))
+        self.assertFalse(listener.might_exist("after"))
+
+        Url.objects.create(short="after", long=UrlTestCase.VALID_URL)
+        with connection.cursor() as cursor:
+            cursor.execute(*short_url_filter.notify_statement(["after"]))
+        self._wait_for(lambda: listener.might_exist("after"))
+
+    @mock.patch.object(short_url_filter, "POLL_INTERVAL", 0.05)
+    def test_short_urls_notified_during_a_rebuild_are_added(self) -> None:
+        listener = short_url_filter.ShortUrlFilter(
+            capacity=1000, error_rate=0.01, rebuild_interval=0.05
+        )
+        builds = []
+        rebuilding, resume = threading.Event(), threading.Event()
+        build = listener.build
+
+        def slow_build() -> int:
+            builds.append(None)
+            if len(builds) > 1:
+                rebuilding.set()
+                resume.wait(10)
+            return build()
+
+        listener.build = slow_build
+        listener.start()
+        self.addCleanup(listener.close)
+        self.addCleanup(resume.set)
+        self.assertTrue(rebuilding.wait(10))
+        self.assertFalse(listener.might_exist("during"))
+
+        Url.objects.create(short="during", long=UrlTestCase.VALID_URL)
+        with connection.cursor() as cursor:
+            cursor.execute(*short_url_filter.notify_statement(["during"]))
+        # the current filter answers during the rebuild
+        self._wait_for(lambda: listener.might_exist("during"))
+        resume.set()
+        self._wait_for(lambda: len(builds) > 2)
+        self.assertTrue(listener.might_exist("during"))
+
+    def _wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+
+class HashRingTestCase(SimpleTestCase):
+    short_urls = [f"{i:07d}" for i in range(10_000)]
+
+    def test_single_shard(self) -> None:
+        ring = sharding.HashRing(["default"])
+        self.assertEqual(ring.group(self.short_urls), {"default": self.short_urls})
+
+    def test_adding_a_shard_only_moves_urls_to_it(self) -> None:
+        before = sharding.HashRing(["default", "shard_1", "shard_2"])
+        after = sharding.HashRing(["default", "shard_1", "shard_2", "shard_3"])
+        moved = [s for s in self.short_urls if before.shard_for(s) != after.shard_for(s)]
+        self.assertTrue(all(after.shard_for(short_url) == "shard_3" for short_url in moved))
+        self.assertAlmostEqual(len(moved) / len(self.short_urls), 0.25, delta=0.05)
+        for short_urls in after.group(self.short_urls).values():
+            self.assertAlmostEqual(len(short_urls) / len(self.short_urls), 0.25, delta=0.05)
+
+
+@override_settings(DATABASE_SHARDS=["default", *settings.DATABASE_TEST_SHARDS])
+class ShardingTestCase(TestCase):
+    databases = "__all__"
+
+    def setUp(self) -> None:
+        url_cache.clear()
+
+    def _shard_of(self, short_url: str) -> Url:
+        return Url.objects.using(sharding.shard_for(short_url)).get(short=short_url)
+
+    def test_urls_are_created_and_found_on_their_shard(self) -> None:
+        short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 20)
+        short_urls += [url_service.get_or_create_short_url(UrlTestCase.VALID_URL) for _ in range(5)]
+        self.assertGreater(len({sharding.shard_for(short_url) for short_url in short_urls}), 1)
+        self.assertEqual(
+            sum(Url.objects.using(shard).count() for shard in settings.DATABASE_SHARDS), 25
+        )
+        for short_url in short_urls:
+            self.assertEqual(url_service.get_redirect_url(short_url), UrlTestCase.VALID_URL)
+            self.assertEqual(self._shard_of(short_url).hits, 1)
+
+        hit_counters.apply_hits({short_url: 2 for short_url in short_urls})
+        self.assertTrue(all(self._shard_of(short_url).hits == 3 for short_url in short_urls))
+
+    def test_admin_form_rejects_short_urls_taken_on_other_shards(self) -> None:
+        short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 10)
+        taken = next(s for s in short_urls if sharding.shard_for(s) != "default")
+        response = _add_url_in_admin(self.client, taken)
+        self.assertEqual(
+            response.context["adminform"].form.errors, {"short": ["This short URL is taken."]}
+        )
+
+    def test_microbenchmarks_refuse_to_run(self) -> None:
+        with self.assertRaises(ImproperlyConfigured):
+            microbenchmarks.run_benchmarks(scale=0.01)
+
+    def test_deduplication_across_shards(self) -> None:
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL, deduplicate=True)
+        for _ in range(5):
+            self.assertEqual(
+                url_service.get_or_create_short_url(UrlTestCase.VALID_URL, deduplicate=True),
+                short_url,
+            )
+
+    def test_reshard(self) -> None:
+        with override_settings(DATABASE_SHARDS=["default"]):
+            short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 50)
+        self.assertEqual(Url.objects.using("default").count(), 50)
+        to_move = [s for s in short_urls if sharding.shard_for(s) != "default"]
+
+        with override_settings(DATABASE_SHARDS_PREVIOUS=["default"]):
+            # URLs which weren't moved yet are found on their previous shard
+            for short_url in short_urls:
+                self.assertEqual(url_service.get_redirect_url(short_url), UrlTestCase.VALID_URL)
+            url_cache.clear()
+
+            stats = reshard_service.Resharder(batch_size=7).run()
+            self.assertEqual((stats.moved, stats.conflicts), (len(to_move), 0))
+            for short_url in short_urls:
+                self.assertEqual(self._shard_of(short_url).hits, 1)
+                self.assertEqual(url_service.get_redirect_url(short_url), UrlTestCase.VALID_URL)
+            self.assertEqual(reshard_service.Resharder(batch_size=7).run().moved, 0)
+
+    def test_short_urls_not_moved_yet_are_taken(self) -> None:
+        with override_settings(DATABASE_SHARDS=["default"]):
+            short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 20)
+        taken = next(s for s in short_urls if sharding.shard_for(s) != "default")
+        free = "newShrt"
+
+        with override_settings(DATABASE_SHARDS_PREVIOUS=["default"]):
+            for create in (
+                lambda: url_service.get_or_create_short_url("https://example.net/"),
+                lambda: url_service.create_short_urls(["https://example.net/"])[0],
+            ):
+                with mock.patch.object(
+                    url_service, "_generate_short_url", side_effect=[taken, free]
+                ):
+                    self.assertEqual(create(), free)
+                Url.objects.using(sharding.shard_for(free)).filter(short=free).delete()
+            self.assertEqual(url_service.get_redirect_url(taken), UrlTestCase.VALID_URL)
+
+
+@override_settings(DATABASE_SHARDS=["default", *settings.DATABASE_TEST_SHARDS])
+class ShardedPurgeTestCase(TransactionTestCase):
+    databases = "__all__"
+
+    def test_expired_urls_are_removed_from_every_shard(self) -> None:
+        short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 30)
+        expired = short_urls[:20]
+        for shard, shard_short_urls in sharding.get_ring().group(expired).items():
+            Url.objects.using(shard).filter(short__in=shard_short_urls).update(
+                expires_at=timezone.now()
+            )
+
+        stats = purge_service.ExpiredUrlPurger(
+            grace_days=0,
+            batch_size=3,
+            checkpoint_dir=os.path.join(tempfile.mkdtemp(), "checkpoint"),
+        ).run()
+        self.assertEqual(stats.rows, 20)
+        remaining = [
+            short_url
+            for shard in settings.DATABASE_SHARDS
+            for short_url in Url.objects.using(shard).values_list("short", flat=True)
+        ]
+        self.assertEqual(sorted(remaining), sorted(short_urls[20:]))
+
+
+class HitRollupsTestCase(TestCase):
+    # 2026-10-18 10:30 UTC
+    NOW = 1792319400
+
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.rollups = hit_rollups.HitRollups()
+
+    def _rollups(self) -> list[tuple[str, datetime, int, int]]:
+        return list(
+            HitRollup.objects.order_by("short", "bucket", "hours").values_list(
+                "short", "bucket", "hours", "hits"
+            )
+        )
+
+    def _at(self, *args: int) -> datetime:
+        return datetime(*args, tzinfo=dt_timezone.utc)
+
+    def test_hits_are_bucketed_per_hour_in_memory(self) -> None:
+        with mock.patch.object(hit_rollups.time, "time", return_value=self.NOW):
+            with self.assertNumQueries(0):
+                for _ in range(1000):
+                    self.rollups.record("aaaaaaa")
+                self.rollups.record("bbbbbbb", amount=2)
+        with mock.patch.object(hit_rollups.time, "time", return_value=self.NOW + 3600):
+            self.rollups.record("aaaaaaa")
+        self.assertEqual(len(self.rollups._pending), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.rollups.flush(), 1003)
+        with mock.patch.object(hit_rollups.time, "time", return_value=self.NOW):
+            self.rollups.record("aaaaaaa")
+        self.rollups.flush()
+        self.assertEqual(
+            self._rollups(),
+            [
+                ("aaaaaaa", self._at(2026, 10, 18, 10), HitRollup.HOURLY, 1001),
+                ("aaaaaaa", self._at(2026, 10, 18, 11), HitRollup.HOURLY, 1),
+                ("bbbbbbb", self._at(2026, 10, 18, 10), HitRollup.HOURLY, 2),
+            ],
+        )
+
+    def test_failed_flush_only_keeps_unwritten_rollups(self) -> None:
+        with mock.patch.object(hit_rollups.time, "time", return_value=self.NOW):
+            for short_url in ("aaaaaaa", "bbbbbbb", "ccccccc"):
+                self.rollups.record(short_url)
+        with mock.patch.object(hit_rollups, "HITS_FLUSH_BATCH_SIZE", 1):
+            with connection.execute_wrapper(_fail_nth_query(2)), self.assertRaises(DatabaseError):
+                self.rollups.flush()
+            self.assertEqual(self.rollups.pending, 2)
+            self.rollups.flush()
+        self.assertEqual([hits for *_, hits in self._rollups()], [1, 1, 1])
+
+    def test_hourly_rollups_are_compacted_into_daily_ones(self) -> None:
+        HitRollup.objects.bulk_create(
+            [
+                HitRollup(short="aaaaaaa", bucket=self._at(2026, 10, 16, 1), hits=1),
+                HitRollup(short="aaaaaaa", bucket=self._at(2026, 10, 16, 23), hits=2),
+                HitRollup(short="bbbbbbb", bucket=self._at(2026, 10, 16, 5), hits=3),
+                HitRollup(short="aaaaaaa", bucket=self._at(2026, 10, 17, 0), hits=4),
+                HitRollup(short="aaaaaaa", bucket=self._at(2026, 10, 18, 9), hits=5),
+            ]
+        )
+        self.assertEqual(hit_rollups.compact_hourly_rollups(self._at(2026, 10, 18, 10)), 4)
+        # hits of a compacted day which were flushed late are added to its daily rollup
+        HitRollup.objects.create(short="bbbbbbb", bucket=self._at(2026, 10, 16, 6), hits=6)
+        self.assertEqual(hit_rollups.compact_hourly_rollups(self._at(2026, 10, 18, 10)), 1)
+        self.assertEqual(
+            self._rollups(),
+            [
+                ("aaaaaaa", self._at(2026, 10, 16), HitRollup.DAILY, 3),
+                ("aaaaaaa", self._at(2026, 10, 17), HitRollup.DAILY, 4),
+                ("aaaaaaa", self._at(2026, 10, 18, 9), HitRollup.HOURLY, 5),
+                ("bbbbbbb", self._at(2026, 10, 16), HitRollup.DAILY, 9),
+            ],
+        )
+        self.assertEqual(hit_rollups.delete_daily_rollups(self._at(2026, 10, 17)), 2)
+
+    def test_stats_endpoint(self) -> None:
+        short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        with mock.patch.object(url_service, "get_hit_rollups", return_value=self.rollups):
+            for _ in range(3):
+                self.client.get(reverse("redirect", args=[short_url]))
+        self.rollups.flush()
+        HitRollup.objects.create(
+            short=short_url,
+            bucket=self._at(2020, 10, 1),
+            hours=HitRollup.DAILY,
+            hits=10,
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("stats", args=[short_url]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["hits"], 3)
+        self.assertEqual([bucket["hours"] for bucket in response.json()["buckets"]], [1])
+
+        response = self.client.get(
+            reverse("stats", args=[short_url]), {"from": "2020-09-01", "to": "2020-10-02"}
+        )
+        self.assertEqual(
+            response.json()["buckets"],
+            [{"start": "2020-10-01T00:00:00+00:00", "hours": 24, "hits": 10}],
+        )
+
+    def test_invalid_ranges_are_rejected(self) -> None:
+        for params in ({"from": "yesterday"}, {"from": "2026-10-02", "to": "2026-10-01"}):
+            response = self.client.get(reverse("stats", args=["aaaaaaa"]), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class CacheableRedirectTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+
+    def _redirect(self, **headers):
+        return self.client.get(reverse("redirect", args=[self.short_url]), **headers)
+
+    def test_redirects_are_not_cacheable_by_default(self) -> None:
+        response = self._redirect()
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.has_header("Cache-Control"))
+        self.assertFalse(response.has_header("ETag"))
+
+    @override_settings(REDIRECT_CACHE_MAX_AGE_SECONDS=3600)
+    def test_max_age_is_capped_by_expiry(self) -> None:
+        response = self._redirect()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+        Url.objects.filter(short=self.short_url).update(
+            expires_at=timezone.now() + timedelta(minutes=10)
+        )
+        url_cache.clear()
+        max_age = int(self._redirect()["Cache-Control"].split("max-age=")[1])
+        self.assertTrue(590 <= max_age <= 600)
+
+    @override_settings(REDIRECT_CACHE_MAX_AGE_SECONDS=3600, REDIRECT_CACHE_STATUS=301)
+    def test_conditional_requests(self) -> None:
+        etag = self._redirect()["ETag"]
+        response = self._redirect(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        # revalidations are clicks which reached the service
+        self.assertEqual(Url.objects.get(short=self.short_url).hits, 2)
+
+        Url.objects.filter(short=self.short_url).update(long="https://example.com/")
+        url_cache.clear()
+        response = self._redirect(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response["Location"], "https://example.com/")
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class RedirectSnapshotTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.path = os.path.join(tempfile.mkdtemp(), "redirects.snapshot")
+        self.addCleanup(redirect_snapshot.reset_redirect_snapshot)
+        self.short_urls = url_service.create_short_urls(
+            [UrlTestCase.VALID_URL, "https://example.com/ünïcode", "https://example.org/"]
+        )
+        Url.objects.filter(short=self.short_urls[2]).update(time_to_live=None, expires_at=None)
+        self.expired_short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        Url.objects.filter(short=self.expired_short_url).update(expires_at=timezone.now())
+
+    def test_snapshot_holds_non_expired_urls(self) -> None:
+        call_command("export_redirect_snapshot", output=self.path, stdout=open(os.devnull, "w"))
+        snapshot = redirect_snapshot.RedirectSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(len(snapshot), 3)
+        for url in Url.objects.filter(short__in=self.short_urls):
+            self.assertEqual(snapshot.get(url.short), (url.long, url.expires_at))
+        for short_url in (self.expired_short_url, "missing", "tooLongForAShortUrl", ""):
+            self.assertIsNone(snapshot.get(short_url))
+
+    @override_settings(REDIRECT_SNAPSHOT_CHECK_INTERVAL_SECONDS=0)
+    def test_redirects_are_served_from_the_snapshot(self) -> None:
+        redirect_snapshot.export_snapshot(self.path)
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            # only the hit is written
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    url_service.get_redirect_url(self.short_urls[0]), UrlTestCase.VALID_URL
+                )
+            self.assertEqual(Url.objects.get(short=self.short_urls[0]).hits, 1)
+
+            # short URLs created after the export are looked up in the DB
+            short_url = url_service.get_or_create_short_url("https://example.net/")
+            self.assertEqual(url_service.get_redirect_url(short_url), "https://example.net/")
+            url_cache.clear()
+
+            # rebuilds replace the snapshot, which is reopened
+            redirect_snapshot.export_snapshot(self.path)
+            with self.assertNumQueries(1):
+                self.assertEqual(url_service.get_redirect_url(short_url), "https://example.net/")
+
+            later = timezone.now() + DEFAULT_TTL_TIMEDELTA
+            with mock.patch.object(url_service.timezone, "now", return_value=later):
+                with self.assertRaises(ExpiredUrl), self.assertNumQueries(0):
+                    url_service.get_redirect_url(self.short_urls[0])
+
+    @override_settings(REDIRECT_SNAPSHOT_CHECK_INTERVAL_SECONDS=0)
+    async def test_async_redirects_are_served_from_the_snapshot(self) -> None:
+        await sync_to_async(redirect_snapshot.export_snapshot)(self.path)
+        try:
+            with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+                # the URL expires, so its expiry is checked
+                self.assertEqual(
+                    await async_url_service.aget_redirect_url(self.short_urls[0]),
+                    UrlTestCase.VALID_URL,
+                )
+                later = timezone.now() + DEFAULT_TTL_TIMEDELTA
+                with mock.patch.object(timezone, "now", return_value=later):
+                    with self.assertRaises(ExpiredUrl):
+                        await async_url_service.aget_redirect_url(self.short_urls[0])
+        finally:
+            await async_db.close_pools()
+
+    def test_missing_snapshot_falls_back_on_the_db(self) -> None:
+        with override_settings(REDIRECT_SNAPSHOT_PATH=self.path):
+            self.assertEqual(
+                url_service.get_redirect_url(self.short_urls[1]), "https://example.com/ünïcode"
+            )
+
+
+class UrlKeysTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.short_urls = url_service.create_short_urls([UrlTestCase.VALID_URL] * 5)
+
+    def test_codec(self) -> None:
+        keys = sorted([0, KEY_SPACE - 1] + [random.randrange(KEY_SPACE) for _ in range(1000)])
+        short_urls = [encode_short_url_key(key) for key in keys]
+        self.assertEqual(short_urls[0], "0000000")
+        self.assertEqual(short_urls[-1], "zzzzzzz")
+        # integer order is the bytewise order of short URLs
+        self.assertEqual(short_urls, sorted(short_urls))
+        self.assertEqual([decode_short_url_key(short_url) for short_url in short_urls], keys)
+        for short_url in ("", "abc", "abc-def", "tooLongForAShortUrl"):
+            self.assertIsNone(decode_short_url_key(short_url))
+        with self.assertRaises(ValueError):
+            encode_short_url_key(KEY_SPACE)
+
+    @override_settings(URL_INTEGER_KEYS=True)
+    def test_urls_are_served_from_integer_keys(self) -> None:
+        call_command("url_keys", "convert", stdout=open(os.devnull, "w"))
+        self.assertTrue(url_keys.has_integer_keys())
+        self.assertEqual(
+            sorted(Url.objects.values_list("short", flat=True)), sorted(self.short_urls)
+        )
+
+        self.assertEqual(url_service.get_redirect_url(self.short_urls[0]), UrlTestCase.VALID_URL)
+        self.assertEqual(Url.objects.get(short=self.short_urls[0]).hits, 1)
+        with self.assertRaises(UrlNotFound):
+            url_service.get_redirect_url("missing")
+
+        short_url = url_service.get_or_create_short_url("https://example.com/")
+        self.assertEqual(url_service.get_redirect_url(short_url), "https://example.com/")
+        self.assertEqual(
+            url_service.get_or_create_short_url("https://example.com/", deduplicate=True),
+            short_url,
+        )
+
+        # key ranges split integer keys in the order of their short URLs
+        Url.objects.filter(short__in=self.short_urls).update(expires_at=timezone.now())
+        purger = purge_service.ExpiredUrlPurger(
+            grace_days=0, batch_size=2, checkpoint_dir=tempfile.mkdtemp(), workers=4
+        )
+        purger._load_or_create_checkpoint()
+        self.assertEqual(sum(map(purger.purge_range, range(4))), 5)
+        self.assertEqual(list(Url.objects.values_list("short", flat=True)), [short_url])
+
+        url_keys.revert_to_text_keys()
+        self.assertFalse(url_keys.has_integer_keys())
+        with override_settings(URL_INTEGER_KEYS=False):
+            self.assertEqual(list(Url.objects.values_list("short", flat=True)), [short_url])
+
+    def test_invalid_short_urls_are_not_converted(self) -> None:
+        Url.objects.create(short="short", long=UrlTestCase.VALID_URL)
+        with self.assertRaises(CommandError):
+            url_keys.convert_to_integer_keys()
+        self.assertFalse(url_keys.has_integer_keys())
+
+
+class GateTestCase(SimpleTestCase):
+    def test_requests_beyond_the_limit_are_rejected(self) -> None:
+        gate = admission.Gate(limit=2, queue_seconds=0)
+        self.assertTrue(gate.enter())
+        self.assertTrue(gate.enter())
+        self.assertFalse(gate.enter())
+        gate.leave()
+        self.assertTrue(gate.enter())
+        self.assertEqual(gate.in_flight, 2)
+
+    def test_queued_requests_are_handed_slots_in_order(self) -> None:
+        gate = admission.Gate(limit=1, queue_seconds=10)
+        self.assertTrue(gate.enter())
+        admitted = []
+
+        def enter(name: str) -> None:
+            if gate.enter():
+                admitted.append(name)
+                gate.leave()
+
+        threads = [threading.Thread(target=enter, args=(name,)) for name in ("first", "second")]
+        for thread in threads:
+            thread.start()
+            while len(gate._waiters) < threads.index(thread) + 1:
+                time.sleep(0.001)
+        # requests which aren't allowed to queue don't jump the queue
+        self.assertFalse(gate.enter(queue=False))
+        gate.leave()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, ["first", "second"])
+        self.assertEqual(gate.in_flight, 0)
+
+    def test_queue_deadline(self) -> None:
+        gate = admission.Gate(limit=1, queue_seconds=0.01)
+        self.assertTrue(gate.enter())
+        self.assertFalse(gate.enter())
+        self.assertFalse(gate._waiters)
+        gate.leave()
+        self.assertEqual(gate.in_flight, 0)
+
+    async def test_async_requests_share_the_limit(self) -> None:
+        gate = admission.Gate(limit=1, queue_seconds=10)
+        self.assertTrue(gate.enter())
+        waiting = asyncio.ensure_future(gate.aenter())
+        while not gate._waiters:
+            await asyncio.sleep(0.001)
+        threading.Thread(target=gate.leave).start()
+        self.assertTrue(await waiting)
+        self.assertEqual(gate.in_flight, 1)
+        gate.leave()
+        self.assertEqual(gate.in_flight, 0)
+
+
+@override_settings(
+    ADMISSION_CONTROL_ENABLED=True,
+    ADMISSION_CREATE_MAX_IN_FLIGHT=1,
+    ADMISSION_CREATE_QUEUE_SECONDS=10,
+    ADMISSION_REDIRECT_MAX_IN_FLIGHT=1,
+    ADMISSION_REDIRECT_QUEUE_SECONDS=0,
+    ADMISSION_RETRY_AFTER_SECONDS=5,
+)
+class AdmissionControlTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        admission.reset_gates()
+        self.addCleanup(admission.reset_gates)
+        self.gates = admission.get_gates()
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+
+    def _rejections(self, request_class: str) -> float:
+        rendered = metrics.REGISTRY.render()
+        sample = f'memechose_admission_rejections_total{{request_class="{request_class}"}} '
+        row = next(row for row in rendered.splitlines() if row.startswith(sample))
+        return float(row.rsplit(" ", 1)[1])
+
+    def _create(self):
+        return self.client.post(
+            reverse("create"), {"url": UrlTestCase.VALID_URL}, content_type="application/json"
+        )
+
+    def test_requests_beyond_the_limit_get_a_503(self) -> None:
+        rejections = self._rejections("redirect")
+        self.assertTrue(self.gates[admission.REDIRECT].enter())
+        response = self.client.get(reverse("redirect", args=[self.short_url]))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(self._rejections("redirect"), rejections + 1)
+
+        self.gates[admission.REDIRECT].leave()
+        response = self.client.get(reverse("redirect", args=[self.short_url]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.gates[admission.REDIRECT].in_flight, 0)
+
+    def test_creates_are_shed_first(self) -> None:
+        # redirects are admitted while creates are at their limit
+        self.assertTrue(self.gates[admission.CREATE].enter())
+        response = self.client.get(reverse("redirect", args=[self.short_url]))
+        self.assertEqual(response.status_code, 302)
+
+        # creates aren't queued while redirects are at theirs
+        rejections = self._rejections("create")
+        self.assertTrue(self.gates[admission.REDIRECT].enter())
+        start = time.monotonic()
+        self.assertEqual(self._create().status_code, 503)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(self._rejections("create"), rejections + 1)
+
+        self.gates[admission.REDIRECT].leave()
+        self.gates[admission.CREATE].leave()
+        self.assertEqual(self._create().status_code, 201)
+
+
+class CreateBatcherTestCase(SimpleTestCase):
+    def _create_concurrently(self, batcher: group_commit.CreateBatcher, long_urls: list[str]):
+        results = {}
+
+        def create(long_url: str) -> None:
+            try:
+                results[long_url] = batcher.create(long_url)
+            except Exception as e:
+                results[long_url] = e
+
+        threads = [threading.Thread(target=create, args=(long_url,)) for long_url in long_urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_creates_are_batched(self) -> None:
+        batches = []
+
+        def create_many(long_urls: list[str]) -> list:
+            batches.append(long_urls)
+            return [AppError("taken") if url == "bad" else url.upper() for url in long_urls]
+
+        # the batch is closed as soon as it's full, long before the window ends
+        batcher = group_commit.CreateBatcher(create_many, window_seconds=10, max_batch_size=4)
+        start = time.monotonic()
+        results = self._create_concurrently(batcher, ["a", "b", "c", "bad"])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(sorted(batches[0]), ["a", "b", "bad", "c"])
+        self.assertEqual({url: results[url] for url in "abc"}, {"a": "A", "b": "B", "c": "C"})
+        self.assertIsInstance(results["bad"], AppError)
+
+    def test_window(self) -> None:
+        batcher = group_commit.CreateBatcher(
+            lambda long_urls: long_urls, window_seconds=0.01, max_batch_size=100
+        )
+        self.assertEqual(batcher.create("a"), "a")
+        self.assertEqual(batcher.create("b"), "b")
+
+    def test_errors_are_raised_in_every_thread(self) -> None:
+        def create_many(long_urls: list[str]) -> list:
+            raise RuntimeError("DB is down")
+
+        batcher = group_commit.CreateBatcher(create_many, window_seconds=10, max_batch_size=3)
+        results = self._create_concurrently(batcher, ["a", "b", "c"])
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results.values()))
+        # every thread raises its own exception
+        self.assertEqual(len({id(result) for result in results.values()}), 3)
+
+    def test_failing_urls_only_fail_their_own_create(self) -> None:
+        batches = []
+
+        def create_many(long_urls: list[str]) -> list:
+            batches.append(long_urls)
+            if "bad" in long_urls:
+                raise ValueError("bad")
+            return [url.upper() for url in long_urls]
+
+        batcher = group_commit.CreateBatcher(create_many, window_seconds=10, max_batch_size=3)
+        results = self._create_concurrently(batcher, ["a", "bad", "c"])
+        self.assertEqual(len(batches), 4)
+        self.assertEqual({url: results[url] for url in "ac"}, {"a": "A", "c": "C"})
+        self.assertIsInstance(results["bad"], ValueError)
+
+
+class GroupCommitTestCase(TransactionTestCase):
+    @override_settings(
+        CREATE_GROUP_COMMIT_ENABLED=True,
+        CREATE_GROUP_COMMIT_WINDOW_SECONDS=10,
+        CREATE_GROUP_COMMIT_MAX_BATCH_SIZE=4,
+    )
+    def test_concurrent_creates_are_inserted_together(self) -> None:
+        long_urls = [f"https://example.com/{i}" for i in range(4)]
+        short_urls = {}
+
+        def create(long_url: str) -> None:
+            try:
+                short_urls[long_url] = url_service.get_or_create_short_url(long_url)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=(long_url,)) for long_url in long_urls]
+        with mock.patch.object(url_service, "_create_batcher", None), mock.patch.object(
+            url_service, "_insert_ignoring_conflicts", wraps=url_service._insert_ignoring_conflicts
+        ) as insert:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(insert.call_count, 1)
+
+            # deduplicated creates hold a lock in their own transaction, so they aren't batched
+            start = time.monotonic()
+            url_service.get_or_create_short_url("https://example.org/", deduplicate=True)
+            self.assertLess(time.monotonic() - start, 5)
+        for long_url in long_urls:
+            self.assertEqual(url_service.get_redirect_url(short_urls[long_url]), long_url)
+
+
+class LeanProfileTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def test_responses_are_identical(self) -> None:
+        paths = ("/health/", f"/s/{self.short_url}/", "/s/missing/", f"/stats/{self.short_url}/")
+        # stats of a fixed range, so both responses are the same
+        query = "from=2020-01-01T00:00:00&to=2020-01-02T00:00:00"
+        full = [call_wsgi(WSGIHandler(), path, QUERY_STRING=query) for path in paths]
+        with override_settings(
+            MIDDLEWARE=settings_lean.MIDDLEWARE, ROOT_URLCONF=settings_lean.ROOT_URLCONF
+        ):
+            self.assertTrue(fast_path.is_supported())
+            lean = [call_wsgi(WSGIHandler(), path, QUERY_STRING=query) for path in paths]
+        self.assertEqual(lean, full)
+        self.assertEqual(settings_lean.INSTALLED_APPS, ["api.apps.ApiConfig"])
+
+    def test_optional_services_are_not_imported(self) -> None:
+        script = (
+            "import sys\n"
+            "from memechose.wsgi_lean import application\n"
+            "from api.management.commands.bench_redirect_fast_path import call_wsgi\n"
+            "for path in ('/health/', '/s/missing/'):\n"
+            "    call_wsgi(application, path, HTTP_HOST=sys.argv[1])\n"
+            "print(*sys.modules)\n"
+        )
+        host = settings.ALLOWED_HOSTS[0].lstrip(".") if settings.ALLOWED_HOSTS else "localhost"
+        modules = subprocess.run(
+            [sys.executable, "-c", script, host],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "memechose.settings_lean"},
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        ).stdout.split()
+        self.assertIn("api.services.url_service", modules)
+        optional = ("async_url_service", "group_commit", "hit_rollups", "profiling")
+        for service in (*optional, "redirect_snapshot", "short_url_filter"):
+            self.assertNotIn(f"api.services.{service}", modules)
+
+    def test_bench_startup(self) -> None:
+        call_command("bench_startup", boots=1, requests=1, stdout=open(os.devnull, "w"))
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        self.short_url = url_service.get_or_create_short_url(UrlTestCase.VALID_URL)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiling_settings = override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_SAMPLE_RATE=0,
+            PROFILING_HEADER_TOKEN="secret",
+            PROFILING_DIR=self.directory,
+            PROFILING_MAX_FILES=2,
+        )
+        profiling_settings.enable()
+        self.addCleanup(profiling_settings.disable)
+
+    def profiles(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".prof"))
+
+    def test_requests_with_the_token_are_profiled(self) -> None:
+        self.client.get(reverse("redirect", args=[self.short_url]))
+        self.client.get(reverse("redirect", args=[self.short_url]), HTTP_X_PROFILE="wrong")
+        self.assertEqual(self.profiles(), [])
+
+        response = self.client.get(
+            reverse("redirect", args=[self.short_url]), HTTP_X_PROFILE="secret"
+        )
+        self.assertEqual(response.status_code, 302)
+        stats, records = profiling.load_profiles(self.directory)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["name"], f"GET /s/{self.short_url}/")
+        self.assertIn("api_url", records[0]["queries"][0]["sql"])
+        self.assertNotIn(self.short_url, json.dumps(records[0]["queries"]))
+        functions = [function.function for function in profiling.top_functions(stats, 100)]
+        self.assertTrue(any("redirect_to_original_url" in function for function in functions))
+        self.assertFalse(fast_path.is_supported())
+
+    def test_sampling_and_rotation(self) -> None:
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            for _ in range(3):
+                self.client.get(reverse("redirect", args=[self.short_url]))
+        self.assertEqual(len(self.profiles()), 2)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    def test_profile_report(self) -> None:
+        with self.assertRaises(CommandError):
+            call_command("profile_report", directory=self.directory, stdout=open(os.devnull, "w"))
+        self.client.get(reverse("redirect", args=[self.short_url]), HTTP_X_PROFILE="secret")
+        call_command("profile_report", directory=self.directory, stdout=open(os.devnull, "w"))
+
+    def test_disabled(self) -> None:
+        with override_settings(PROFILING_ENABLED=False, PROFILING_SAMPLE_RATE=1):
+            self.client.get(reverse("redirect", args=[self.short_url]), HTTP_X_PROFILE="secret")
+            self.assertTrue(fast_path.is_supported())
+        self.assertEqual(self.profiles(), [])
+
+
+class MicrobenchmarksTestCase(TestCase):
+    def setUp(self) -> None:
+        url_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = os.path.join(directory.name, "baseline.json")
+
+    def test_query_budgets(self) -> None:
+        results = microbenchmarks.run_benchmarks(scale=0.01)
+        for benchmark, result in results:
+            self.assertEqual(result.queries_per_operation, benchmark.max_queries, benchmark.name)
+        bench_urls = Url.objects.filter(long__startswith=load_generator.BENCH_URL_PREFIX)
+        self.assertFalse(bench_urls.exists())
+
+    def test_regressions_fail(self) -> None:
+        options = {
+            "scale": 0.01,
+            "baseline": self.baseline,
+            "queries_only": True,
+            "stdout": io.StringIO(),
+        }
+        call_command("bench_service", update_baseline=True, **options)
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        baseline["results"]["redirect_lookup"]["queries_per_operation"] = 1
+        with open(self.baseline, "w") as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, "redirect_lookup: 2 queries per operation"):
+            call_command("bench_service", **options)
+
+    def test_default_baseline_only_holds_query_counts(self) -> None:
+        options = {"scale": 0.01, "queries_only": True, "stdout": io.StringIO()}
+        with mock.patch.object(microbenchmarks, "BASELINE_PATH", self.baseline):
+            call_command("bench_service", update_baseline=True, **options)
+            with open(self.baseline) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(
+                results["redirect_lookup"],
+                {"name": "redirect_lookup", "operations": 10, "queries_per_operation": 2},
+            )
+            call_command("bench_service", **options)
+
+    def test_check_results(self) -> None:
+        benchmark = microbenchmarks.Benchmark(
+            "noop", lambda _: None, max_queries=1, max_microseconds=10, operations=1
+        )
+        result = microbenchmarks.BenchmarkResult("noop", 1, 1, 5, 5, 5)
+        baseline = {"noop": {"queries_per_operation": 1, "p50_us": 3}}
+        self.assertEqual(microbenchmarks.check_results([(benchmark, result)], baseline, 1), [])
+        queries_only = {"noop": {"queries_per_operation": 1}}
+        self.assertEqual(microbenchmarks.check_results([(benchmark, result)], queries_only, 0), [])
+        self.assertEqual(
+            microbenchmarks.check_results([(benchmark, result)], baseline, 0.5),
+            ["noop: 5.0us per operation, up from 3.0us in the baseline"],
+        )
+        result.queries_per_operation, result.p50_us = 2, 20
+        self.assertEqual(len(microbenchmarks.check_results([(benchmark, result)], None, 0.5)), 2)
+        self.assertEqual(
+            microbenchmarks.check_results([(benchmark, result)], None, 0.5, check_times=False),
+            ["noop: 2 queries per operation, the budget is 1"],
+        )
@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.urls import path
 
 from api import views
 
 urlpatterns = [
     path("health/", views.health, name="health"),
-    path("create/", views.create_url, name="create"),
-    path("s/<str:url>/", views.redirect_to_original_url, name="redirect"),
+    path("metrics", views.metrics_view, name="metrics"),
+    path(
+        "create/",
+        views.acreate_url if settings.ASYNC_VIEWS else views.create_url,
+        name="create",
+    ),
+    path("create/batch/", views.create_urls_batch, name="create-batch"),
+    path("stats/<str:url>/", views.url_stats, name="stats"),
+    path(
+        "s/<str:url>/",
+        views.aredirect_to_original_url if settings.ASYNC_VIEWS else views.redirect_to_original_url,
+        name="redirect",
+    ),
 ]
@@ -1,22 +1,96 @@
-from typing import Generator, Iterable
+import hashlib
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
 
+from api.consts import ALLOWED_CHARACTERS, SHORT_URL_LENGTH
 
-def iterate_in_batches(
-    items: Iterable,
-    total: int,
-    batch_size: int = 1000,
-) -> Generator:
+BASE62_INDEX = {char: i for i, char in enumerate(ALLOWED_CHARACTERS)}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# digits of short URL keys in ASCII order, so keys sort like their short URLs do bytewise
+KEY_CHARACTERS = "".join(sorted(ALLOWED_CHARACTERS))
+KEY_SPACE = len(KEY_CHARACTERS) ** SHORT_URL_LENGTH
+# pairs of digits, so keys are encoded two characters at a time
+_KEY_PAIRS = [first + second for first in KEY_CHARACTERS for second in KEY_CHARACTERS]
+_KEY_PAIR_BASE = len(_KEY_PAIRS)
+# the value of each digit at each position, so keys are decoded without multiplications
+_KEY_DIGIT_VALUES = [
+    {
+        char: i * len(KEY_CHARACTERS) ** (SHORT_URL_LENGTH - 1 - position)
+        for i, char in enumerate(KEY_CHARACTERS)
+    }
+    for position in range(SHORT_URL_LENGTH)
+]
+
+
+def encode_base62(number: int, length: int) -> str:
     """
-    Iterate over a lazy collection in batches.
+    Encode a non-negative integer as a fixed-length base62 string, padded with leading zeros.
+    """
+    chars = []
+    for _ in range(length):
+        number, remainder = divmod(number, 62)
+        chars.append(ALLOWED_CHARACTERS[remainder])
+    if number:
+        raise ValueError(f"number does not fit in {length} base62 characters")
+    return "".join(reversed(chars))
+
 
-    Args:
-        items (Iterable): A lazy collection.
-        total (int): Number of items in the collection.
-        batch_size (int, optional): The batch size. Defaults to 1000.
+def decode_base62(value: str) -> int:
+    number = 0
+    for char in value:
+        number = number * 62 + BASE62_INDEX[char]
+    return number
 
-    Yields:
-        Generator: A concrete sequence of length batch_size (or less in the last iteration).
+
+def encode_short_url_key(key: int) -> str:
+    """
+    Return the short URL of an integer key in [0, KEY_SPACE), see `decode_short_url_key`.
     """
-    for start in range(0, total, batch_size):
-        end = min(start + batch_size, total)
-        yield items[start:end]
+    if not 0 <= key < KEY_SPACE:
+        raise ValueError(f"short URL key out of range: {key}")
+    # a leading digit and three pairs make up the `SHORT_URL_LENGTH` characters
+    pairs = _KEY_PAIRS
+    key, last = divmod(key, _KEY_PAIR_BASE)
+    key, middle = divmod(key, _KEY_PAIR_BASE)
+    key, first = divmod(key, _KEY_PAIR_BASE)
+    return KEY_CHARACTERS[key] + pairs[first] + pairs[middle] + pairs[last]
+
+
+def decode_short_url_key(short_url: str) -> Optional[int]:
+    """
+    Return the integer a short URL stands for in base62, with digits in ASCII order so keys sort
+    like their short URLs, or None if it isn't a valid short URL.
+    """
+    if len(short_url) != SHORT_URL_LENGTH:
+        return None
+    try:
+        return sum(map(dict.__getitem__, _KEY_DIGIT_VALUES, short_url))
+    except KeyError:
+        return None
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize the parts of a URL which don't change the resource it points to:
+    the scheme and host are lowercased, default ports are dropped and an empty path becomes "/".
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:  # IPv6
+        netloc = f"[{netloc}]"
+    try:
+        port = parts.port
+    except ValueError:  # out of range, which URLValidator accepts
+        port = parts.netloc.rpartition(":")[2]
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    userinfo, has_userinfo, _ = parts.netloc.rpartition("@")
+    if has_userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def digest_url(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
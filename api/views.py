@@ -1,10 +1,22 @@
 import json
 
+from django.conf import settings
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators import csrf, http
 
-from api.decorators import request_handler
-from api.services import url_service
+from api.decorators import (
+    admission_control,
+    async_csrf_exempt,
+    async_require_http_methods,
+    request_handler,
+)
+from api.errors import InvalidBatch
+from api.services import admission, metrics, url_service
+from api.services.url_cache import CachedUrl
+
+# the services of the stats and async views are imported when they're first called, so workers
+# which don't serve them (see `memechose.settings_lean`) don't import them
 
 
 @http.require_safe
@@ -13,20 +25,118 @@ def health(_) -> HttpResponse:
     return HttpResponse(status=200, content="OK")
 
 
+@http.require_safe
+@request_handler
+def metrics_view(_) -> HttpResponse:
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @csrf.csrf_exempt
 @http.require_POST
+@admission_control(admission.CREATE)
 @request_handler
 def create_url(request: HttpRequest) -> JsonResponse:
-    url = json.loads(request.body).get("url")
-    short_url = url_service.get_or_create_short_url(url)
+    body = json.loads(request.body)
+    short_url = url_service.get_or_create_short_url(
+        body.get("url"),
+        deduplicate=body.get("deduplicate"),
+    )
     return JsonResponse(
         status=201,
         data={"url": short_url},
     )
 
 
+@csrf.csrf_exempt
+@http.require_POST
+@admission_control(admission.CREATE)
+@request_handler
+def create_urls_batch(request: HttpRequest) -> JsonResponse:
+    urls = json.loads(request.body).get("urls")
+    if not isinstance(urls, list) or len(urls) > settings.CREATE_BATCH_MAX_SIZE:
+        raise InvalidBatch(settings.CREATE_BATCH_MAX_SIZE)
+    results = url_service.create_short_urls(urls)
+    return JsonResponse(
+        status=200,
+        data={
+            "results": [
+                {"App error": str(result)} if isinstance(result, Exception) else {"url": result}
+                for result in results
+            ]
+        },
+    )
+
+
 @http.require_safe
+@admission_control(admission.REDIRECT)
 @request_handler
-def redirect_to_original_url(_, url: str) -> HttpResponseRedirect:
-    redirect_url = url_service.get_redirect_url(url)
-    return HttpResponseRedirect(redirect_to=redirect_url)
+def redirect_to_original_url(request: HttpRequest, url: str) -> HttpResponse:
+    return _redirect_response(request, url_service.get_redirect(url))
+
+
+def _redirect_response(request: HttpRequest, redirect: CachedUrl) -> HttpResponse:
+    response = HttpResponseRedirect(redirect_to=redirect.long)
+    if not settings.REDIRECT_CACHE_MAX_AGE_SECONDS:
+        return response
+    response.status_code = settings.REDIRECT_CACHE_STATUS
+    response["ETag"] = url_service.get_redirect_etag(redirect)
+    patch_cache_control(response, public=True, max_age=url_service.get_redirect_max_age(redirect))
+    if request is None:
+        # the redirect fast path leaves conditional requests to Django
+        return response
+    # Django only evaluates preconditions against successful responses, so the redirect is left out
+    conditional_response = get_conditional_response(request, etag=response["ETag"])
+    if conditional_response is None:
+        return response
+    for header in ("ETag", "Cache-Control"):
+        conditional_response[header] = response[header]
+    return conditional_response
+
+
+@http.require_safe
+@request_handler
+def url_stats(request: HttpRequest, url: str) -> JsonResponse:
+    from api.services import hit_rollups
+
+    start, end = hit_rollups.parse_stats_range(request.GET.get("from"), request.GET.get("to"))
+    stats = hit_rollups.get_hit_stats(url, start, end)
+    return JsonResponse(
+        status=200,
+        data={
+            "url": url,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "hits": sum(hits for _, _, hits in stats),
+            "buckets": [
+                {"start": bucket.isoformat(), "hours": hours, "hits": hits}
+                for bucket, hours, hits in stats
+            ],
+        },
+    )
+
+
+@async_csrf_exempt
+@async_require_http_methods("POST")
+@admission_control(admission.CREATE)
+@request_handler
+async def acreate_url(request: HttpRequest) -> JsonResponse:
+    from api.services import async_url_service
+
+    body = json.loads(request.body)
+    short_url = await async_url_service.aget_or_create_short_url(
+        body.get("url"),
+        deduplicate=body.get("deduplicate"),
+    )
+    return JsonResponse(
+        status=201,
+        data={"url": short_url},
+    )
+
+
+@async_require_http_methods("GET", "HEAD")
+@admission_control(admission.REDIRECT)
+@request_handler
+async def aredirect_to_original_url(request: HttpRequest, url: str) -> HttpResponse:
+    from api.services import async_url_service
+
+    return _redirect_response(request, await async_url_service.aget_redirect(url))
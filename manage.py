@@ -6,7 +6,10 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "memechose.settings")
+    default_settings = "memechose.settings"
+    if sys.argv[1:2] == ["test"]:
+        default_settings = "memechose.settings_test"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "memechose.settings")
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.REDIRECT_FAST_PATH:
+    from api.fast_path import ASGIRedirectDispatcher  # noqa: E402
+
+    application = ASGIRedirectDispatcher(application)
@@ -0,0 +1,10 @@
+"""
+ASGI config of the lean redirect/create-only profile, see `memechose.settings_lean`.
+"""
+
+import os
+
+# unlike `memechose.asgi`, the profile is the point of this entry point, so it's not a default
+os.environ["DJANGO_SETTINGS_MODULE"] = "memechose.settings_lean"
+
+from memechose.asgi import application  # noqa: E402, F401
@@ -0,0 +1,30 @@
+"""
+Settings of a redirect/create-only tier: only the `api` app and the middleware which adds
+headers to its responses, so workers boot a little faster and take a little less memory. The
+services of optional features (the redirect snapshot, short URL filter, hit rollups, batched
+creates, profiling and async views) are only imported once they're used, in either profile.
+
+The admin, auth, sessions, messages, staticfiles and templates aren't loaded, and neither are
+their middleware (the API views are CSRF exempt and don't use sessions or users). Migrations and
+the admin are run from a deployment with the full settings. Serve it with
+`memechose.wsgi_lean:application` or `memechose.asgi_lean:application`, and compare both profiles
+with `manage.py bench_startup`.
+"""
+from memechose.settings import *  # noqa: F401, F403
+
+INSTALLED_APPS = [
+    "api.apps.ApiConfig",
+]
+
+MIDDLEWARE = [
+    "api.middleware.ProfilingMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ROOT_URLCONF = "memechose.urls_lean"
+
+TEMPLATES = []
+
+WSGI_APPLICATION = "memechose.wsgi_lean.application"
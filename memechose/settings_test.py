@@ -0,0 +1,18 @@
+"""
+Settings of the test suite, which `manage.py test` uses by default: the full settings, plus the
+shards the sharding tests override `DATABASE_SHARDS` with.
+"""
+from memechose.settings import *  # noqa: F401, F403
+from memechose.settings import DATABASES
+
+# Their test DBs are created on the default DB server, so the whole test suite runs unsharded and
+# without DB_SHARD_URLS, and the test runner migrates the URL table on them.
+DATABASE_TEST_SHARDS = ["test_shard_1", "test_shard_2"]
+for alias in DATABASE_TEST_SHARDS:
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": f"{DATABASES['default']['NAME']}_{alias}",
+        "TEST": {"NAME": f"test_{alias}"},
+    }
+
+TEST_RUNNER = "api.test_runner.TestRunner"
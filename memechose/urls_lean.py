@@ -0,0 +1,8 @@
+"""
+URL configuration of the lean profile, see `memechose.settings_lean`.
+"""
+from django.urls import include, path
+
+urlpatterns = [
+    path("", include("api.urls")),
+]
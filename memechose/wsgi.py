@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "memechose.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.REDIRECT_FAST_PATH:
+    from api.fast_path import WSGIRedirectDispatcher  # noqa: E402
+
+    application = WSGIRedirectDispatcher(application)